@@ -0,0 +1,109 @@
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Sequence
+
+import discord
+import numpy as np
+
+from ingest import DISCORD_EPOCH
+
+# Joining the guild this soon after making the account is a pretty strong tell
+FRESH_JOIN = timedelta(hours=1)
+
+
+def _ms(delta: timedelta) -> int:
+    return int(delta.total_seconds() * 1000)
+
+
+@dataclass
+class AuditResult:
+    members: int
+    flagged: np.ndarray
+    """Indexes into the audited member list"""
+    counts: dict[str, int] = field(default_factory=dict)
+    """How many members tripped each rule"""
+    cpu_time: float = 0.0
+
+
+@dataclass
+class MemberArrays:
+    """Column-wise view of a guild's members, only the cheap stuff we score on"""
+
+    ids: np.ndarray
+    joined_ms: np.ndarray
+    default_avatar: np.ndarray
+    no_roles: np.ndarray
+    exempt: np.ndarray
+    """Bots and moderators, these never get flagged"""
+
+    @classmethod
+    def from_members(cls, members: Sequence[discord.Member]) -> "MemberArrays":
+        n = len(members)
+        ids = np.fromiter((m.id for m in members), dtype=np.uint64, count=n)
+        joined = np.fromiter(
+            # Members we don't have a join date for count as joining right now
+            (m.joined_at.timestamp() * 1000 if m.joined_at else time.time() * 1000 for m in members),
+            dtype=np.int64,
+            count=n,
+        )
+        default_avatar = np.fromiter((m.avatar is None for m in members), dtype=bool, count=n)
+        # Everyone has @everyone so a single role means none were given
+        no_roles = np.fromiter((len(m.roles) <= 1 for m in members), dtype=bool, count=n)
+        exempt = np.fromiter(
+            (
+                m.bot or m.guild_permissions.ban_members or m.guild_permissions.kick_members
+                for m in members
+            ),
+            dtype=bool,
+            count=n,
+        )
+        return cls(ids, joined, default_avatar, no_roles, exempt)
+
+
+def created_ms(ids: np.ndarray) -> np.ndarray:
+    """Decodes account creation times (unix ms) straight out of the snowflakes"""
+    return (ids >> np.uint64(22)).astype(np.int64) + DISCORD_EPOCH
+
+
+def audit(
+    arrays: MemberArrays,
+    creation_limit: timedelta,
+    min_score: int = 3,
+    recent_join: timedelta = timedelta(days=1),
+) -> AuditResult:
+    """Scores every member at once.
+
+    Anyone whose account is still younger than `creation_limit` today is flagged
+    outright, the same rule `check_member` applies to new joins. Joining within
+    `recent_join` (the guild's prune delay), joining right after creating the
+    account, a default avatar and no roles each add a point and members reaching
+    `min_score` are flagged as well"""
+    start = time.process_time()
+    now = int(time.time() * 1000)
+    created = created_ms(arrays.ids)
+    age_at_join = arrays.joined_ms - created
+
+    rules = {
+        # Judged on the account's age now, someone who joined years ago with a week old
+        # account has had plenty of time to show they aren't a throwaway
+        "Young account": now - created < _ms(creation_limit),
+        "Joined recently": now - arrays.joined_ms < _ms(recent_join),
+        "Joined right after creation": age_at_join < _ms(FRESH_JOIN),
+        "Default avatar": arrays.default_avatar,
+        "No roles": arrays.no_roles,
+    }
+    score = (
+        rules["Young account"].astype(np.int8) * min_score
+        + rules["Joined recently"]
+        + rules["Joined right after creation"]
+        + rules["Default avatar"]
+        + rules["No roles"]
+    )
+    flagged = (score >= min_score) & ~arrays.exempt
+    return AuditResult(
+        members=len(arrays.ids),
+        flagged=np.flatnonzero(flagged),
+        counts={name: int((mask & ~arrays.exempt).sum()) for name, mask in rules.items()},
+        cpu_time=time.process_time() - start,
+    )
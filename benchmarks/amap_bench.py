@@ -0,0 +1,111 @@
+"""Micro-benchmark of `taskmaster.amap` against the old sleep-polling implementation
+
+    python -m benchmarks.amap_bench
+"""
+import asyncio
+import time
+from typing import (Any, AsyncIterator, Awaitable, Callable, Iterable, Optional,
+                    Sequence, Tuple, TypeVar, cast)
+
+from taskmaster import amap
+
+T = TypeVar("T")
+
+
+class legacy_amap(AsyncIterator[T], Awaitable[Sequence[T]]):
+    """The sleep-polling amap that taskmaster used to ship, kept only to compare against"""
+    def __init__(self, func: Callable[..., Awaitable[T]],  iterables: Sequence[Iterable[Any]] , concurrency:int = 16) -> None:
+        self._func = func 
+        self._queue = asyncio.Queue()
+        self._concurrency = concurrency
+        self._iters = zip(iterables)
+        self._running = True
+        self._task = asyncio.ensure_future(self.__loop())
+        self.__mapped = self.__results()
+
+    async def __loop(self):
+        pending: set[asyncio.Future[T]] = set()
+
+        def on_done(fut:asyncio.Future[T]):
+            pending.remove(fut)
+            exception = fut.exception()
+            if not exception:
+                self._queue.put_nowait((fut.result(), None))
+            else:
+                self._queue.put_nowait((None, exception))
+
+
+        while self._running or pending:
+            while self._running and (len(pending) < self._concurrency):
+                try:
+                    item = next(self._iters)
+                except StopIteration:
+                    self._running = False
+                    break
+
+                fut = asyncio.ensure_future(self._func(*item))
+                fut.add_done_callback(on_done)
+                pending.add(fut)
+
+            await asyncio.sleep(0.005)
+    
+    async def __results(self):
+        while not self._task.done() or not self._queue.empty():
+            try:
+                item, exc = cast(Tuple[T, Optional[BaseException]], self._queue.get_nowait())
+                if exc:
+                    raise exc
+                yield item
+            except asyncio.QueueEmpty:
+                await asyncio.sleep(0.005)
+        
+
+    async def __collect(self) -> Sequence[T]:
+        return [i async for i in self.__mapped]
+
+    def __await__(self) -> Sequence[T]:
+        return self.__collect().__await__()
+
+    async def __aiter__(self) -> AsyncIterator[T]:
+        async for i in self.__mapped:
+            yield i 
+    
+    async def __anext__(self) -> Awaitable[T]:
+        return self.__mapped.__anext__()
+
+
+async def noop(x: int) -> int:
+    return x
+
+
+async def tiny_io(x: int) -> int:
+    await asyncio.sleep(0.001)
+    return x
+
+
+async def measure(name: str, impl, func, n: int, concurrency: int):
+    wall, cpu = time.perf_counter(), time.process_time()
+    count = 0
+    async for _ in impl(func, range(n), concurrency=concurrency):
+        count += 1
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    assert count == n, f"{name} only returned {count}/{n} results"
+    print(
+        f"{name:<8} {func.__name__:<8} n={n:<6} c={concurrency:<3} "
+        f"{wall * 1000:9.1f} ms wall {cpu * 1000:9.1f} ms cpu {n / wall:12.0f} items/s"
+    )
+
+
+async def main():
+    for func, n, concurrency in (
+        (noop, 2_000, 16),
+        (noop, 20_000, 64),
+        (tiny_io, 2_000, 16),
+        (tiny_io, 5_000, 128),
+    ):
+        await measure("legacy", legacy_amap, func, n, concurrency)
+        await measure("amap", amap, func, n, concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,290 @@
+"""End to end benchmarks of Defender against fake guilds and a simulated rate-limited
+discord, no token or network needed. Each scenario gets a fresh on-disk SQLite database
+
+    python -m benchmarks.defender_bench                  # every scenario
+    python -m benchmarks.defender_bench raid lockdown    # just these
+    python -m benchmarks.defender_bench --json out.json  # save results
+    python -m benchmarks.defender_bench --compare out.json
+
+`--speed` shrinks simulated latency and rate limit windows (ours and discord's alike)
+so the big scenarios finish in seconds, ops/s are wall clock at that speed.
+`--compare` exits non-zero when a scenario's ops/s dropped by more than `--tolerance`
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+import discord
+import numpy as np
+from sqlalchemy import insert
+
+import defender
+from executor import ROUTE_LIMITS, ModerationExecutor
+from models import Defender, GuildModel, PrunedMember
+
+from .fakes import FakeCDN, FakeHTTP, FakeGuild, FakeInteraction, FakeMember, make_guild, snowflake
+
+
+@dataclass
+class Result:
+    scenario: str
+    ops: int
+    seconds: float
+    latencies: list[float] = field(default_factory=list, repr=False)
+    errors: int = 0
+    requests: int = 0
+    rate_limited: int = 0
+
+    @property
+    def ops_per_sec(self) -> float:
+        return self.ops / self.seconds if self.seconds else 0.0
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self.latencies, q)) if self.latencies else 0.0
+
+    def row(self) -> dict:
+        return {
+            "scenario": self.scenario,
+            "ops": self.ops,
+            "seconds": round(self.seconds, 3),
+            "ops_per_sec": round(self.ops_per_sec, 1),
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "errors": self.errors,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class BenchDefender(Defender):
+    """Defender that looks its guilds up from the fakes instead of the gateway cache"""
+
+    def __init__(self, dbname: str, speed: float) -> None:
+        super().__init__(dbname=dbname)
+        # Our own limits get the same speed up as the fake discord
+        self.actions = ModerationExecutor(limits={k: (n, per / speed) for k, (n, per) in ROUTE_LIMITS.items()})
+        self.fake_guilds: dict[int, FakeGuild] = {}
+
+    def get_guild(self, id: int) -> Optional[FakeGuild]:
+        return self.fake_guilds.get(id)
+
+    @property
+    def guilds(self) -> list[FakeGuild]:
+        return list(self.fake_guilds.values())
+
+
+class Bench:
+    """A fresh bot, database and fake discord for one scenario"""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.http = FakeHTTP(latency=args.latency, speed=args.speed)
+        self._dir = tempfile.TemporaryDirectory()
+        self.bot = BenchDefender(f"sqlite+aiosqlite:///{os.path.join(self._dir.name, 'bench.db')}", args.speed)
+
+    async def __aenter__(self) -> "Bench":
+        # The event handlers and commands all go through the module level bot
+        self._real_bot, defender.bot = defender.bot, self.bot
+        await self.bot.init_db()
+        self.bot.jobs.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        defender.bot = self._real_bot
+        self.bot.jobs.stop()
+        self.bot.actions.close()
+        self.bot.prune_scheduler.stop()
+        await self.bot.engine.dispose()
+        self._dir.cleanup()
+
+    async def add_guild(self, guild: FakeGuild, **settings) -> GuildModel:
+        """Registers a guild with its prune role and mod channel set like an admin would"""
+        self.bot.fake_guilds[guild.id] = guild
+        await self.bot.create_guild_model(guild)
+        await self.bot.update_guild_prune_role(guild.prune_role.id, guild.id)
+        gm = await self.bot.update_guild_mod_channel(guild.mod_channel.id, guild.id)
+        if settings:
+            gm = await self.bot.update_guild_raid_settings(guild.id, **settings)
+        return gm
+
+    def result(self, scenario: str, ops: int, seconds: float, latencies: list[float], errors: int = 0) -> Result:
+        return Result(
+            scenario, ops, seconds, latencies, errors,
+            requests=self.http.total_requests, rate_limited=self.http.total_rate_limited,
+        )
+
+
+async def timed(func: Callable[[], Awaitable], latencies: list[float]) -> bool:
+    start = time.perf_counter()
+    try:
+        await func()
+        return True
+    except Exception:
+        return False
+    finally:
+        latencies.append(time.perf_counter() - start)
+
+
+# === SCENARIOS ===
+
+
+async def bench_raid(args: argparse.Namespace) -> Result:
+    """`args.joins` fresh accounts join at once, dispatched concurrently through
+    on_member_join like the gateway would. Latency is per join"""
+    async with Bench(args) as bench:
+        guild = make_guild(bench.http, members=100, channels=20)
+        await bench.add_guild(guild, threshold=15, window=10.0, lockdown=False)
+        now = discord.utils.utcnow()
+        joins = [
+            guild.add_member(FakeMember(guild, id=snowflake(now - timedelta(minutes=i % 60)), joined_at=now))
+            for i in range(args.joins)
+        ]
+
+        latencies: list[float] = []
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed(lambda m=m: defender.on_member_join(m), latencies) for m in joins))
+        seconds = time.perf_counter() - start
+        return bench.result("raid", len(joins), seconds, latencies, errors=results.count(False))
+
+
+async def bench_massban(args: argparse.Namespace) -> Result:
+    """/massban with an `args.ids` line text file, served locally so the download and
+    ingest are part of it, through to the massban job finishing. Latency is per bulk-ban request"""
+    async with Bench(args) as bench, FakeCDN() as cdn:
+        guild = make_guild(bench.http, members=1000, channels=2)
+        await bench.add_guild(guild)
+        # A few existing bans so seeding the ban index has something to crawl
+        for _ in range(2000):
+            guild._bans[snowflake()] = "Old ban"
+        ids = [snowflake() for _ in range(args.ids)]
+        attachment = cdn.attachment("ids.txt", "\n".join(map(str, ids)).encode())
+
+        interaction = FakeInteraction(guild, user=guild.moderator)
+        start = time.perf_counter()
+        await defender.massban.callback(interaction, attachment, reason="Benchmark")
+        await bench.bot.jobs.join()
+        seconds = time.perf_counter() - start
+        banned = sum(1 for i in ids if i in guild._bans)
+        return bench.result("massban", banned, seconds, bench.http.latencies["bulk_ban"], errors=len(ids) - banned)
+
+
+async def bench_prune_sweep(args: argparse.Namespace) -> Result:
+    """Bans every overdue member out of an `args.pruned` row PrunedMember table,
+    alongside rows for other guilds that aren't due yet. Latency is per ban request"""
+    async with Bench(args) as bench:
+        guild = make_guild(bench.http, channels=2)
+        await bench.add_guild(guild)
+        overdue, later = datetime.now() - timedelta(hours=1), datetime.now() + timedelta(days=1)
+        rows = [{"member_id": snowflake(), "prune_date": overdue, "guild_id": guild.id} for _ in range(args.pruned)]
+        # Other guilds' rows are what the index has to skip over
+        rows += [{"member_id": snowflake(), "prune_date": later, "guild_id": i} for i in range(args.pruned)]
+        async with bench.bot.session() as s:
+            for i in range(0, len(rows), 5000):
+                await s.exec(insert(PrunedMember).values(rows[i : i + 5000]))
+            await s.commit()
+
+        start = time.perf_counter()
+        await bench.bot.ban_pruned_members(guild.id)
+        seconds = time.perf_counter() - start
+        left = len(await bench.bot.get_pruned_ids(guild.id))
+        return bench.result("prune-sweep", args.pruned - left, seconds, bench.http.latencies["ban"], errors=left)
+
+
+async def bench_lockdown(args: argparse.Namespace) -> Result:
+    """/lockdown then /unlock-server on an `args.channels` channel guild, ops are channels
+    locked plus unlocked. Latency is per channel edit"""
+    async with Bench(args) as bench:
+        guild = make_guild(bench.http, channels=args.channels, roles=20, overwrites=5)
+        await bench.add_guild(guild)
+        before = {c.id: dict(c.overwrites) for c in guild.text_channels}
+
+        start = time.perf_counter()
+        await defender.lockdown_server.callback(FakeInteraction(guild, user=guild.moderator))
+        locked = len(await bench.bot.get_guild_lockdowns(guild.id))
+        await defender.unlock_server.callback(FakeInteraction(guild, user=guild.moderator))
+        seconds = time.perf_counter() - start
+
+        # Anything that didn't come back exactly how it was counts as an error
+        restored = sum(
+            {o.id: ow.pair() for o, ow in c.overwrites.items()} == {o.id: ow.pair() for o, ow in before[c.id].items()}
+            for c in guild.text_channels
+        )
+        return bench.result(
+            "lockdown", locked * 2, seconds, bench.http.latencies["channel_edit"], errors=len(before) - restored
+        )
+
+
+SCENARIOS: dict[str, Callable[[argparse.Namespace], Awaitable[Result]]] = {
+    "raid": bench_raid,
+    "massban": bench_massban,
+    "prune-sweep": bench_prune_sweep,
+    "lockdown": bench_lockdown,
+}
+
+
+def compare(results: list[Result], baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    ok = True
+    for r in results:
+        if not (old := baseline.get(r.scenario)):
+            continue
+        change = (r.ops_per_sec - old["ops_per_sec"]) / old["ops_per_sec"] if old["ops_per_sec"] else 0.0
+        regressed = change < -tolerance
+        ok &= not regressed
+        print(f"{r.scenario:<12} {old['ops_per_sec']:>10.1f} -> {r.ops_per_sec:>10.1f} ops/s {change:+7.1%}"
+              + ("  REGRESSION" if regressed else ""))
+    return ok
+
+
+async def main(args: argparse.Namespace) -> int:
+    results = []
+    print(
+        f"{'scenario':<12} {'ops':>7} {'wall s':>8} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'errors':>6} {'requests':>8} {'429s':>6}"
+    )
+    for name in args.scenarios or SCENARIOS:
+        r = await SCENARIOS[name](args)
+        results.append(r)
+        row = r.row()
+        print(
+            f"{name:<12} {r.ops:>7} {r.seconds:>8.2f} {r.ops_per_sec:>10.1f} {row['p50_ms']:>8.2f} "
+            f"{row['p99_ms']:>8.2f} {r.errors:>6} {r.requests:>8} {r.rate_limited:>6}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"speed": args.speed, "latency": args.latency, "results": [r.row() for r in results]}, f, indent=2)
+    if args.compare:
+        return 0 if compare(results, args.compare, args.tolerance) else 1
+    return 0
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"any of {', '.join(SCENARIOS)}, all of them by default")
+    parser.add_argument("--speed", type=float, default=1000.0, help="how much faster than real time discord runs")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated round trip per request in seconds")
+    parser.add_argument("--joins", type=int, default=10_000)
+    parser.add_argument("--ids", type=int, default=100_000)
+    parser.add_argument("--pruned", type=int, default=20_000)
+    parser.add_argument("--channels", type=int, default=300)
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="results from an earlier --json run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed drop in ops/s before it's a regression")
+    args = parser.parse_args(argv)
+    if unknown := set(args.scenarios) - SCENARIOS.keys():
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,412 @@
+"""Stand-ins for the discord objects Defender touches and a simulated, rate-limited
+HTTP backend behind them, enough to drive the bot without a token or a network"""
+import asyncio
+import itertools
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Iterable, Optional
+
+import discord
+from aiohttp import web
+from discord.guild import BanEntry, BulkBanResult
+
+# (requests, per seconds) per route, a little above executor.ROUTE_LIMITS like the real thing
+DISCORD_LIMITS: dict[str, tuple[int, float]] = {
+    "global": (50, 1.0),
+    "ban": (6, 1.0),
+    "bulk_ban": (1, 1.5),
+    "unban": (6, 1.0),
+    "bans": (10, 1.0),
+    "member_edit": (12, 10.0),
+    "channel_permissions": (6, 5.0),
+    "channel_edit": (6, 5.0),
+    "message": (5, 5.0),
+    "message_edit": (5, 5.0),
+    "followup": (5, 2.0),
+}
+# Routes that aren't listed above share this
+DEFAULT_LIMIT = (5, 5.0)
+
+_ids = itertools.count(1)
+
+
+def snowflake(created: Optional[datetime] = None) -> int:
+    """Unique snowflake that decodes to `created` (now by default)"""
+    created = created or discord.utils.utcnow()
+    return discord.utils.time_snowflake(created) + next(_ids) % (1 << 22)
+
+
+class _Window:
+    """Fixed window bucket, the way discord resets `X-RateLimit-Remaining`"""
+
+    def __init__(self, limit: int, per: float) -> None:
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset = 0.0
+
+    def take(self, now: float) -> float:
+        """Takes a request and returns 0 or how long until the window resets (a 429)"""
+        if now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + self.per
+        if self.remaining:
+            self.remaining -= 1
+            return 0.0
+        return self.reset - now
+
+
+class FakeHTTP:
+    """Simulated discord API, every call pays `latency` and is held to per-route and
+    global limits. A 429 is waited out and retried like discord.py does on its own.
+    `speed` shrinks latency and rate limit windows so big scenarios finish quickly"""
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        speed: float = 1.0,
+        limits: Optional[dict[str, tuple[int, float]]] = None,
+    ) -> None:
+        self.latency = latency / speed
+        self.speed = speed
+        self.limits = limits or DISCORD_LIMITS
+        self._windows: dict[tuple, _Window] = {}
+        self.requests: defaultdict[str, int] = defaultdict(int)
+        self.rate_limited: defaultdict[str, int] = defaultdict(int)
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+
+    def _window(self, kind: str, major: Any) -> _Window:
+        if not (w := self._windows.get((kind, major))):
+            limit, per = self.limits.get(kind, DEFAULT_LIMIT)
+            w = self._windows[(kind, major)] = _Window(limit, per / self.speed)
+        return w
+
+    async def request(self, kind: str, major: Any = None):
+        start = time.perf_counter()
+        for window in (self._window("global", None), self._window(kind, major)):
+            while retry := window.take(time.monotonic()):
+                self.rate_limited[kind] += 1
+                await asyncio.sleep(retry)
+        await asyncio.sleep(self.latency)
+        self.requests[kind] += 1
+        self.latencies[kind].append(time.perf_counter() - start)
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    @property
+    def total_rate_limited(self) -> int:
+        return sum(self.rate_limited.values())
+
+
+class FakeRole:
+    type = discord.Role
+    """Lets `lockdown.target_type` tell these apart from members"""
+
+    def __init__(
+        self, guild: "FakeGuild", name: str, permissions: discord.Permissions,
+        managed: bool = False, position: int = 0,
+    ) -> None:
+        self.id = snowflake()
+        self.guild = guild
+        self.name = name
+        self.permissions = permissions
+        self.managed = managed
+        self.position = position
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    def __eq__(self, other) -> bool:
+        return getattr(other, "id", None) == self.id
+
+
+class FakeMessage:
+    def __init__(self, http: FakeHTTP, channel_id: int, content: Optional[str] = None) -> None:
+        self.id = snowflake()
+        self.http = http
+        self.channel_id = channel_id
+        self.content = content
+
+    async def edit(self, content: Optional[str] = None, **kwargs) -> "FakeMessage":
+        await self.http.request("message_edit", self.channel_id)
+        self.content = content
+        return self
+
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", name: str) -> None:
+        self.id = snowflake()
+        self.guild = guild
+        self.name = name
+        self._overwrites: dict[Any, discord.PermissionOverwrite] = {}
+        self.messages: list[FakeMessage] = []
+
+    @property
+    def mention(self) -> str:
+        return f"<#{self.id}>"
+
+    @property
+    def overwrites(self) -> dict[Any, discord.PermissionOverwrite]:
+        # Fresh copies every time like discord.py hands out
+        return {t: discord.PermissionOverwrite.from_pair(*o.pair()) for t, o in self._overwrites.items()}
+
+    async def edit(self, *, overwrites: Optional[dict] = None, reason: Optional[str] = None, **kwargs):
+        await self.guild.http.request("channel_edit", self.id)
+        if overwrites is not None:
+            self._overwrites = dict(overwrites)
+
+    async def set_permissions(
+        self, target, *, overwrite: Optional[discord.PermissionOverwrite] = None,
+        reason: Optional[str] = None, **permissions,
+    ):
+        await self.guild.http.request("channel_permissions", self.id)
+        overwrite = overwrite or self.overwrites.get(target) or discord.PermissionOverwrite()
+        overwrite.update(**permissions)
+        self._overwrites[target] = overwrite
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        await self.guild.http.request("message", self.id)
+        message = FakeMessage(self.guild.http, self.id, content)
+        self.messages.append(message)
+        return message
+
+
+class FakeMember:
+    def __init__(
+        self, guild: "FakeGuild", id: Optional[int] = None, name: Optional[str] = None,
+        roles: Iterable[FakeRole] = (), bot: bool = False, joined_at: Optional[datetime] = None,
+    ) -> None:
+        self.id = id or snowflake()
+        self.guild = guild
+        self.name = name or f"user{self.id}"
+        self.roles = [guild.default_role, *roles]
+        self.bot = bot
+        self.avatar = None
+        self.joined_at = joined_at or discord.utils.utcnow()
+
+    @property
+    def created_at(self) -> datetime:
+        return discord.utils.snowflake_time(self.id)
+
+    @property
+    def display_name(self) -> str:
+        return self.name
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    @property
+    def guild_permissions(self) -> discord.Permissions:
+        value = 0
+        for role in self.roles:
+            value |= role.permissions.value
+        return discord.Permissions(value)
+
+    async def edit(self, *, roles: Optional[list] = None, reason: Optional[str] = None, **kwargs):
+        await self.guild.http.request("member_edit", self.guild.id)
+        if roles is not None:
+            self.roles = [self.guild.default_role, *(self.guild.get_role(r.id) or r for r in roles)]
+
+    async def add_roles(self, *roles, reason: Optional[str] = None, **kwargs):
+        await self.guild.http.request("member_edit", self.guild.id)
+        self.roles.extend(roles)
+
+    async def remove_roles(self, *roles, reason: Optional[str] = None, **kwargs):
+        await self.guild.http.request("member_edit", self.guild.id)
+        ids = {r.id for r in roles}
+        self.roles = [r for r in self.roles if r.id not in ids]
+
+
+class FakeGuild:
+    def __init__(self, http: FakeHTTP, name: str = "Benchmark Guild") -> None:
+        self.id = snowflake()
+        self.http = http
+        self.name = name
+        self.roles: list[FakeRole] = []
+        self.default_role = self.create_role("@everyone", discord.Permissions.general() | discord.Permissions.text())
+        self._members: dict[int, FakeMember] = {}
+        self._channels: dict[int, FakeChannel] = {}
+        self._bans: dict[int, Optional[str]] = {}
+        # Filled in by make_guild
+        self.prune_role: Optional[FakeRole] = None
+        self.mod_channel: Optional[FakeChannel] = None
+        self.moderator: Optional[FakeMember] = None
+
+    def create_role(self, name: str, permissions: discord.Permissions, **kwargs) -> FakeRole:
+        role = FakeRole(self, name, permissions, position=len(self.roles), **kwargs)
+        self.roles.append(role)
+        return role
+
+    def create_channel(self, name: str) -> FakeChannel:
+        channel = FakeChannel(self, name)
+        self._channels[channel.id] = channel
+        return channel
+
+    def add_member(self, member: FakeMember) -> FakeMember:
+        self._members[member.id] = member
+        return member
+
+    @property
+    def members(self) -> list[FakeMember]:
+        return list(self._members.values())
+
+    @property
+    def member_count(self) -> int:
+        return len(self._members)
+
+    @property
+    def text_channels(self) -> list[FakeChannel]:
+        return list(self._channels.values())
+
+    def get_member(self, user_id: int) -> Optional[FakeMember]:
+        return self._members.get(user_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self._channels.get(channel_id)
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return next((r for r in self.roles if r.id == role_id), None)
+
+    async def ban(self, user: discord.abc.Snowflake, *, reason: Optional[str] = None, **kwargs):
+        await self.http.request("ban", self.id)
+        self._bans[user.id] = reason
+        self._members.pop(user.id, None)
+
+    async def bulk_ban(
+        self, users: list[discord.abc.Snowflake], *, reason: Optional[str] = None, **kwargs
+    ) -> BulkBanResult:
+        await self.http.request("bulk_ban", self.id)
+        for user in users:
+            self._bans[user.id] = reason
+            self._members.pop(user.id, None)
+        return BulkBanResult(banned=[discord.Object(id=u.id) for u in users], failed=[])
+
+    async def unban(self, user: discord.abc.Snowflake, *, reason: Optional[str] = None):
+        await self.http.request("unban", self.id)
+        if self._bans.pop(user.id, ...) is ...:
+            raise discord.NotFound(_Response(404), "Unknown Ban")
+
+    async def bans(self, *, limit: Optional[int] = 1000, **kwargs) -> AsyncIterator[BanEntry]:
+        # One request per page of 1000 like the real endpoint
+        entries = list(self._bans.items())[:limit]
+        for i in range(0, len(entries), 1000):
+            await self.http.request("bans", self.id)
+            for user_id, reason in entries[i : i + 1000]:
+                yield BanEntry(reason=reason, user=discord.Object(id=user_id))
+
+
+class _Response:
+    """Just enough of an aiohttp response for discord's HTTPException"""
+
+    def __init__(self, status: int) -> None:
+        self.status = status
+        self.reason = "Fake"
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **kwargs):
+        await self.interaction.http.request("followup", self.interaction.id)
+        self._done = True
+
+    async def send_message(self, content: Optional[str] = None, **kwargs):
+        await self.interaction.http.request("followup", self.interaction.id)
+        self.interaction.sent.append(content)
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+
+    async def send(self, content: Optional[str] = None, *, wait: bool = False, **kwargs) -> FakeMessage:
+        await self.interaction.http.request("followup", self.interaction.id)
+        self.interaction.sent.append(content)
+        return FakeMessage(self.interaction.http, self.interaction.channel.id, content)
+
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild, channel: Optional[FakeChannel] = None, user: Optional[FakeMember] = None) -> None:
+        self.id = snowflake()
+        self.http = guild.http
+        self.guild = guild
+        self.channel = channel or guild.text_channels[0]
+        self.user = user
+        self.command = None
+        self.created_at = discord.utils.utcnow()
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sent: list[Optional[str]] = []
+
+
+class FakeAttachment:
+    def __init__(self, filename: str, url: str, size: int) -> None:
+        self.filename = filename
+        self.url = url
+        self.size = size
+
+
+class FakeCDN:
+    """Serves attachment bodies over localhost so `ingest_attachment` downloads them for real"""
+
+    def __init__(self) -> None:
+        self._files: dict[str, bytes] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def _serve(self, request: web.Request) -> web.Response:
+        if (body := self._files.get(request.match_info["name"])) is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=body)
+
+    def attachment(self, filename: str, body: bytes) -> FakeAttachment:
+        self._files[filename] = body
+        return FakeAttachment(filename, f"http://127.0.0.1:{self.port}/attachments/{filename}", len(body))
+
+    async def __aenter__(self) -> "FakeCDN":
+        app = web.Application()
+        app.router.add_get("/attachments/{name}", self._serve)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
+
+
+def make_guild(
+    http: FakeHTTP, members: int = 0, channels: int = 1, roles: int = 5, overwrites: int = 3
+) -> FakeGuild:
+    """A guild with a mod role, a prune role, `roles` chatty roles and `channels` text
+    channels carrying `overwrites` overwrites each. Members are old, established accounts"""
+    guild = FakeGuild(http)
+    mods = guild.create_role("Moderator", discord.Permissions(ban_members=True, kick_members=True, send_messages=True))
+    guild.prune_role = guild.create_role("Pruned", discord.Permissions.none())
+    chatty = [guild.create_role(f"role-{i}", discord.Permissions(send_messages=True)) for i in range(roles)]
+    guild.mod_channel = guild.create_channel("mod-log")
+    for i in range(channels - 1):
+        channel = guild.create_channel(f"channel-{i}")
+        for role in (mods, *chatty)[:overwrites]:
+            channel._overwrites[role] = discord.PermissionOverwrite(read_messages=True, attach_files=i % 2 == 0)
+    guild.moderator = guild.add_member(FakeMember(guild, name="moderator", roles=[mods]))
+    old = discord.utils.utcnow() - timedelta(days=3 * 365)
+    for i in range(members):
+        guild.add_member(FakeMember(guild, id=snowflake(old), roles=chatty[i % len(chatty):][:1] if chatty else ()))
+    return guild
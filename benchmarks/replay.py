@@ -0,0 +1,262 @@
+"""Replays an event log written by recorder.py through Defender's real handlers against
+fake guilds and a stub discord, on a virtual clock that jumps straight from one event to
+the next. A month of joins takes seconds, so screening and raid settings can be tried
+against real raids before they go live
+
+    python -m benchmarks.replay events.jsonl.gz
+    python -m benchmarks.replay events.jsonl.gz --account-age-days 30 --threshold 10 --window 5
+    python -m benchmarks.replay events.jsonl.gz --policy '{"default_avatar": true}' --json out.json
+    python -m benchmarks.replay events.0.jsonl.gz events.1.jsonl.gz   # one log per shard process
+
+Joins go through on_member_join and bans through on_member_ban, prune sweeps run at
+each deadline the moment the clock passes it. Messages are counted but nothing reads
+them yet. Bans in the log include any the bot made itself when it was recorded
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+from typing import Optional
+from unittest import mock
+
+import discord
+
+import defender
+import models
+import raid
+import screening
+from models import GuildModel
+from recorder import read_events
+from screening import Policy
+
+from .defender_bench import BenchDefender
+from .fakes import FakeGuild, FakeHTTP, FakeMember, make_guild
+
+
+class VirtualClock:
+    """Stands in for the clocks raid detection, screening and prune deadlines read, so
+    the replay sees the time an event was recorded at instead of now"""
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.now)
+
+    def install(self) -> ExitStack:
+        clock = self
+
+        class VirtualDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.fromtimestamp(clock.now, tz)
+
+        stack = ExitStack()
+        stack.enter_context(mock.patch.object(raid, "time", self))
+        stack.enter_context(mock.patch.object(screening, "time", self))
+        stack.enter_context(mock.patch.object(models, "datetime", VirtualDatetime))
+        return stack
+
+
+class ReplayDefender(BenchDefender):
+    """Defender that remembers who it pruned, banned and when raids started"""
+
+    def __init__(self, dbname: str, clock: VirtualClock) -> None:
+        # Nothing should ever wait on a rate limit in a replay
+        super().__init__(dbname, speed=1e6)
+        self.clock = clock
+        self.pruned: dict[int, tuple[float, str]] = {}
+        self.banned: dict[int, float] = {}
+        self.raid_starts: list[tuple[float, int]] = []
+
+    async def prune_member(self, member, reason: str = "Suspicious account", uow=None):
+        pm = await super().prune_member(member, reason, uow)
+        self.pruned.setdefault(member.id, (self.clock.now, reason))
+        return pm
+
+    async def _ban_pruned(self, guild, rows):
+        done = await super()._ban_pruned(guild, rows)
+        members = dict(rows)
+        for row_id in done:
+            self.banned.setdefault(members[row_id], self.clock.now)
+        return done
+
+    async def start_raid_mode(self, guild, gm: GuildModel):
+        self.raid_starts.append((self.clock.now, guild.id))
+        await super().start_raid_mode(guild, gm)
+
+
+@dataclass
+class Report:
+    events: Counter = field(default_factory=Counter)
+    first: float = 0.0
+    last: float = 0.0
+    seconds: float = 0.0
+    """Wall clock"""
+    pruned: dict[int, tuple[float, str]] = field(default_factory=dict)
+    banned: dict[int, float] = field(default_factory=dict)
+    raids: list[tuple[float, int]] = field(default_factory=list)
+    log_bans: set[int] = field(default_factory=set)
+    """Everyone banned in the log, by mods or by the bot back when it was recorded"""
+
+    @property
+    def speedup(self) -> float:
+        return (self.last - self.first) / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        caught = self.log_bans & self.pruned.keys()
+        reasons = Counter(reason for _, reason in self.pruned.values())
+        lines = [
+            "events        " + ", ".join(f"{k}: {v}" for k, v in self.events.most_common()),
+            f"log covers    {timedelta(seconds=round(self.last - self.first))}, replayed in "
+            f"{self.seconds:.2f}s ({self.speedup:,.0f}x real time)",
+            f"pruned        {len(self.pruned)}" + "".join(f"\n  {n:>6}  {r}" for r, n in reasons.most_common()),
+            f"banned        {len(self.banned)} by prune sweeps, {len(self.pruned.keys() - self.banned.keys())} "
+            "still waiting on their deadline",
+            f"raids         {len(self.raids)}"
+            + "".join(f"\n          {datetime.fromtimestamp(t, timezone.utc):%Y-%m-%d %H:%M:%S} guild {g}" for t, g in self.raids),
+            f"log bans      {len(self.log_bans)}, {len(caught)} of them pruned by this replay, "
+            f"{len(self.pruned.keys() - self.log_bans)} pruned accounts nobody banned",
+        ]
+        return "\n".join(lines)
+
+    def to_json(self) -> dict:
+        return {
+            "events": dict(self.events),
+            "first": self.first,
+            "last": self.last,
+            "seconds": self.seconds,
+            "pruned": [{"user_id": u, "at": t, "reason": r} for u, (t, r) in self.pruned.items()],
+            "banned": [{"user_id": u, "at": t} for u, t in self.banned.items()],
+            "raids": [{"guild_id": g, "at": t} for t, g in self.raids],
+            "log_bans": sorted(self.log_bans),
+        }
+
+
+class Replay:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.clock = VirtualClock()
+        self.http = FakeHTTP(latency=0.0, speed=1e6)
+        self.guilds: dict[int, FakeGuild] = {}
+        self.policy = Policy.from_json(args.policy) if args.policy else None
+
+    async def add_guild(self, bot: ReplayDefender, guild_id: int) -> FakeGuild:
+        """Fake stand-in for a recorded guild, set up with the settings being tried out"""
+        guild = make_guild(self.http, channels=self.args.channels)
+        guild.id = guild_id
+        self.guilds[guild_id] = bot.fake_guilds[guild_id] = guild
+        await bot.create_guild_model(guild)
+        await bot.update_guild_prune_role(guild.prune_role.id, guild_id)
+        await bot.update_guild_mod_channel(guild.mod_channel.id, guild_id)
+        await bot.update_guild_raid_settings(guild_id, self.args.threshold, self.args.window, self.args.lockdown)
+        if self.policy:
+            await bot.update_guild_screening(guild_id, self.policy)
+        return guild
+
+    async def sweep_due(self, bot: ReplayDefender):
+        """Runs every prune sweep whose deadline the clock just went past"""
+        for guild_id in bot.prune_scheduler._pop_due(self.clock.datetime()):
+            await bot.run_due_prunes(guild_id)
+
+    async def run(self) -> Report:
+        args = self.args
+        report = Report()
+        with tempfile.TemporaryDirectory() as tmp, self.clock.install():
+            bot = ReplayDefender(f"sqlite+aiosqlite:///{tmp}/replay.db", self.clock)
+            real_bot, defender.bot = defender.bot, bot
+            try:
+                await bot.init_db()
+                if args.prune_hours is not None:
+                    bot.prune_date = timedelta(hours=args.prune_hours)
+                if args.account_age_days is not None:
+                    bot.screens.default = Policy(account_age=args.account_age_days * 86400 or None)
+
+                start = time.perf_counter()
+                # Shard processes each write a log of their own, play them back as one timeline
+                for event in heapq.merge(*map(read_events, args.log), key=itemgetter("t")):
+                    self.clock.now = t = event["t"]
+                    report.first = report.first or t
+                    report.last = t
+                    report.events[event["e"]] += 1
+                    await self.sweep_due(bot)
+                    guild = self.guilds.get(event["g"]) or await self.add_guild(bot, event["g"])
+                    await self.dispatch(event, guild, report)
+
+                if args.drain:
+                    # Let every deadline pass so "would be banned" covers everyone pruned
+                    while deadline := bot.prune_scheduler.next_deadline:
+                        self.clock.now = max(self.clock.now, deadline.timestamp())
+                        await self.sweep_due(bot)
+                # Raid mode runs as its own task and queues the lockdown as a job, let both finish
+                await asyncio.gather(*bot.raid_tasks)
+                await bot.jobs.join()
+                await bot.digest.close()
+                report.seconds = time.perf_counter() - start
+            finally:
+                defender.bot = real_bot
+                bot.actions.close()
+                await bot.engine.dispose()
+
+        report.pruned, report.banned, report.raids = bot.pruned, bot.banned, bot.raid_starts
+        return report
+
+    async def dispatch(self, event: dict, guild: FakeGuild, report: Report):
+        kind, user_id = event["e"], event["u"]
+        if kind == "join":
+            member = guild.add_member(
+                FakeMember(
+                    guild, id=user_id, name=event.get("n"), bot=bool(event.get("b")),
+                    joined_at=datetime.fromtimestamp(event["t"], timezone.utc),
+                )
+            )
+            member.avatar = "recorded" if event.get("a") else None
+            await defender.on_member_join(member)
+        elif kind == "ban":
+            report.log_bans.add(user_id)
+            await defender.on_member_ban(guild, discord.Object(id=user_id))
+        elif kind == "unban":
+            await defender.on_member_unban(guild, discord.Object(id=user_id))
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", nargs="+", help="event logs written by the recorder, .jsonl or .jsonl.gz")
+    parser.add_argument("--account-age-days", type=float, help="default screening account age, 0 turns it off")
+    parser.add_argument("--prune-hours", type=float, help="how long pruned members have before the ban")
+    parser.add_argument("--policy", help="screening policy json applied to every guild, see screening.Policy")
+    parser.add_argument("--threshold", type=int, default=GuildModel.model_fields["raid_threshold"].default)
+    parser.add_argument("--window", type=float, default=GuildModel.model_fields["raid_window"].default)
+    parser.add_argument("--lockdown", action="store_true", help="lock the fake guild down when a raid is detected")
+    parser.add_argument("--channels", type=int, default=2, help="text channels per fake guild, matters for --lockdown")
+    parser.add_argument("--no-drain", dest="drain", action="store_false",
+                        help="stop at the end of the log instead of running every remaining prune deadline")
+    parser.add_argument("--json", help="write every pruned and banned account here")
+    return parser.parse_args(argv)
+
+
+async def main(args: argparse.Namespace) -> int:
+    report = await Replay(args).run()
+    print(report.summary())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report.to_json(), f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
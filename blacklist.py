@@ -0,0 +1,112 @@
+import os
+import tempfile
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+class Blacklist:
+    """Federated blacklist of user ids, everyone banned in a guild that takes part.
+    Kept as a sorted uint64 array so a lookup is a binary search and millions of ids
+    only cost 8 bytes each. The array can be memory-mapped from disk so shard processes
+    share one copy, anything added or removed afterwards sits in small sets until
+    `compact` folds it in"""
+
+    def __init__(self, ids: Optional[np.ndarray] = None, merge_at: int = 4096) -> None:
+        self._sorted = np.unique(np.asarray(ids, dtype=np.uint64)) if ids is not None else np.empty(0, np.uint64)
+        self._added: set[int] = set()
+        self._removed: set[int] = set()
+        self.merge_at = merge_at
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "Blacklist":
+        """Opens an array written by `save`, it's already sorted and unique so nothing gets copied"""
+        bl = cls()
+        bl._sorted = np.load(path, mmap_mode="r" if mmap else None)
+        return bl
+
+    def save(self, path: str):
+        self.compact()
+        # Every shard process rebuilds and saves on startup, each gets a temp file of its
+        # own so their replaces can't trip over each other, the last one in wins
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, self._sorted)
+            # Readers mapping the old file keep their copy until they reopen
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._added:
+            return True
+        if user_id in self._removed:
+            return False
+        i = np.searchsorted(self._sorted, np.uint64(user_id))
+        return i < len(self._sorted) and self._sorted[i] == user_id
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """Vectorized `in` for a whole array of ids"""
+        self.compact()
+        ids = np.asarray(ids, dtype=np.uint64)
+        if not len(self._sorted):
+            return np.zeros(len(ids), dtype=bool)
+        return self._contains_sorted(ids)
+
+    def add(self, ids: Iterable[int]):
+        for i in ids:
+            self._added.add(int(i))
+            self._removed.discard(int(i))
+        if len(self._added) >= self.merge_at:
+            self.compact()
+
+    def discard(self, user_id: int):
+        self._added.discard(user_id)
+        self._removed.add(user_id)
+        if len(self._removed) >= self.merge_at:
+            self.compact()
+
+    def compact(self):
+        """Folds pending adds and removals into the sorted array"""
+        if not (self._added or self._removed):
+            return
+        merged = self._sorted
+        if self._added:
+            # Both halves are sorted runs which a stable (tim)sort merges in linear time
+            added = np.sort(np.fromiter(self._added, dtype=np.uint64, count=len(self._added)))
+            merged = np.sort(np.concatenate((merged, added)), kind="stable")
+            keep = np.empty(len(merged), dtype=bool)
+            keep[:1] = True
+            np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+            merged = merged[keep]
+        if self._removed:
+            removed = np.fromiter(self._removed, dtype=np.uint64, count=len(self._removed))
+            merged = merged[~np.isin(merged, removed)]
+        self._sorted = merged
+        self._added.clear()
+        self._removed.clear()
+
+    def _in_sorted(self, ids: set[int]) -> int:
+        """How many of `ids` are in the sorted array"""
+        if not ids or not len(self._sorted):
+            return 0
+        return int(np.count_nonzero(self._contains_sorted(np.fromiter(ids, dtype=np.uint64, count=len(ids)))))
+
+    def _contains_sorted(self, ids: np.ndarray) -> np.ndarray:
+        i = np.searchsorted(self._sorted, ids).clip(max=len(self._sorted) - 1)
+        return self._sorted[i] == ids
+
+    def __len__(self) -> int:
+        # Counted around the pending sets, compacting here would swap the shared
+        # memory-mapped array for a private copy every time metrics get scraped
+        return len(self._sorted) + len(self._added) - self._in_sorted(self._added) - self._in_sorted(self._removed)
+
+    @property
+    def nbytes(self) -> int:
+        return self._sorted.nbytes
+
+    @property
+    def mapped(self) -> bool:
+        return isinstance(self._sorted, np.memmap)
@@ -8,30 +8,38 @@ from discord import Member, Guild, Embed, app_commands
 import discord
 
 from taskmaster import suppress
+import metrics
 
 from colorama import init
 
-from models import Defender, LockdownChannel
-from typing import Union, Optional
+from models import is_moderator
+from sharding import create_bot, load_config
+from audit import MemberArrays, audit
+from executor import Priority
+from export import BlacklistExport, MAX_ATTACHMENTS
+from ingest import UnsupportedFile, ingest_attachment
+from typing import Literal, Union, Optional
+from datetime import datetime, timedelta
+import dataclasses
 import io
+import re
+import time
+import numpy as np
 
 
-bot = Defender("$")
+# Sharded when config.yaml sets shardCount, see sharding.py
+bot = create_bot(load_config(), "$")
 
 async def safe_prune(member: Member):
     # All roles should be removed from the member
 
     # Member should not be banned if they are moderators
-    if member.guild_permissions.ban_members or member.guild_permissions.kick_members:
+    if is_moderator(member):
         return None
 
-    # Remove all roles so channels can't be accessed
-    for r in member.guild.roles:
-        if member.get_role(r.id):
-            await member.remove_roles(r, reason="Violated The Rules")
-
+    # prune_member swaps every role for the prune role in one edit so channels can't be accessed
     try:
-        return await bot.prune_member(member)
+        return await bot.prune_member(member, reason="Violated The Rules")
     except (discord.HTTPException, discord.Forbidden):
         return None
 
@@ -46,7 +54,7 @@ async def safe_ban(
             return None
 
     async with suppress(discord.NotFound, discord.Forbidden, discord.HTTPException):
-        await interaction.guild.ban(user, reason=reason)
+        await bot.actions.ban(interaction.guild, user, priority=Priority.RAID, reason=reason)
         await interaction.followup.send(
             embed=Embed(title="Banned")
             .add_field(name="Member ID", value=user.id)
@@ -55,43 +63,123 @@ async def safe_ban(
         )
 
 
-@tasks.loop(minutes=15)
-async def prune_loop():
-    for guild in bot.guilds:
-        gm = await bot.get_guild_model(guild.id)
-        if gm.moderator_channel and gm.prune_role_id:
-            await bot.ban_pruned_members(gm.guild_id)
+async def finish_progress(interaction: discord.Interaction, progress: discord.WebhookMessage, content: str):
+    """Puts the final result on a progress message, interaction tokens only last 15 minutes
+    so anything slower than that gets posted to the channel instead"""
+    try:
+        await progress.edit(content=content)
+    except discord.HTTPException:
+        async with suppress(discord.HTTPException):
+            await interaction.channel.send(f"{interaction.user.mention} {content}")
+
+
+@tasks.loop(hours=6)
+async def reconcile_bans():
+    # Catches any bans/unbans we missed while offline
+    for guild_id in await bot.seeded_ban_guilds():
+        if guild := bot.get_guild(guild_id):
+            async with suppress(discord.Forbidden, discord.HTTPException):
+                await bot.reconcile_ban_index(guild)
+    # Rebuilding also drops anyone other processes saw getting unbanned
+    await bot.load_blacklist()
+
+
+@tasks.loop(minutes=1)
+async def refresh_blacklist():
+    # Bans recorded by other shard processes show up here
+    await bot.refresh_blacklist()
 
 
 @bot.event
+@metrics.event()
 async def on_ready():
-    await bot.init_db()
-    # Try a prune loop immediatley if all requirements
-    # were ment to perform one if we originally did a startup before...
-    for guild in bot.guilds:
-        gm = await bot.get_guild_model(guild.id)
-        if gm.moderator_channel and gm.prune_role_id:
-            await bot.ban_pruned_members(gm.guild_id)
-    prune_loop.start()
+    # on_ready fires again on every reconnect, only the first call sweeps
+    # the guilds that went overdue while we were offline
+    await bot.catch_up()
+    if not reconcile_bans.is_running():
+        reconcile_bans.start()
+    if not refresh_blacklist.is_running():
+        refresh_blacklist.start()
 
 
 @bot.event
+@metrics.event()
 async def on_guild_join(guild: Guild):
     await bot.create_guild_model(guild)
 
 
 @bot.event
+@metrics.event()
 async def on_guild_remove(guild: Guild):
     await bot.remove_guild_model(guild)
 
 
 @bot.event
+@metrics.event()
+async def on_member_ban(guild: Guild, user: Union[discord.User, Member]):
+    if bot.recorder:
+        bot.recorder.ban(guild, user)
+    await bot.record_bans(guild.id, [user.id], banned_at=datetime.now())
+
+
+@bot.event
+@metrics.event()
+async def on_member_unban(guild: Guild, user: discord.User):
+    if bot.recorder:
+        bot.recorder.unban(guild, user)
+    await bot.record_unban(guild.id, user.id)
+
+
+@bot.event
+@metrics.event()
 async def on_member_join(member: Member):
-    gm = await bot.get_guild_model(member.guild.id)
-    if gm.moderator_channel and gm.prune_role_id:
-        await bot.check_member(member)
-        # Smart to run this when we can...
-        await bot.ban_pruned_members(gm.guild_id)
+    if bot.recorder:
+        bot.recorder.join(member)
+    # The whole join shares one session and commits once, a clean join with the guild
+    # cached doesn't touch the database at all and a pruned one is a single insert
+    async with bot.unit_of_work("join") as uow:
+        gm = await bot.get_guild_model(member.guild.id, uow)
+        # Banned in another federated server, already dealt with
+        blacklisted = await bot.enforce_blacklist(member, gm, uow)
+        if gm.moderator_channel and gm.prune_role_id:
+            raid = bot.raids.record_join(gm.guild_id, gm.raid_threshold, gm.raid_window)
+            if raid.started:
+                # Don't hold up this join while every channel gets locked
+                bot.begin_raid_mode(member.guild, gm)
+            if blacklisted:
+                pass
+            elif raid.active:
+                async with suppress(discord.Forbidden, discord.HTTPException):
+                    await bot.prune_member(member, reason="Joined during a raid", uow=uow)
+            else:
+                await bot.check_member(member, gm, uow)
+    # No sweep here anymore, the prune scheduler bans everyone right at their deadline
+
+
+@bot.event
+async def on_message(message: discord.Message):
+    # Only here for the event recorder, nothing screens messages yet
+    if bot.recorder and message.guild:
+        bot.recorder.message(message)
+
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command: app_commands.Command):
+    # Measured from when discord created the interaction so queueing on our end counts too
+    elapsed = discord.utils.utcnow() - interaction.created_at
+    metrics.COMMAND_SECONDS.observe(elapsed.total_seconds(), command.qualified_name)
+
+
+@bot.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    command = interaction.command
+    metrics.COMMAND_ERRORS.inc(command.qualified_name if command else "unknown")
+    if isinstance(error, (app_commands.MissingPermissions, app_commands.BotMissingPermissions)):
+        # Not a bug, just tell whoever ran it what's missing
+        send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
+        return await send(f"ERROR: {error}", ephemeral=True)
+    # Still log it the way discord.py normally would
+    await app_commands.CommandTree.on_error(bot.tree, interaction, error)
 
 
 @bot.tree.command(name="add-prune-role")
@@ -148,24 +236,119 @@ async def check_requirements(interaction: discord.Interaction):
     await interaction.followup.send(embed=embed)
 
 
-# @bot.tree.command(name="prune")
-# @commands.bot_has_permissions(ban_members=True, manage_roles=True)
-# @commands.has_permissions(ban_members=True)
-# async def prune_users(ctx:Context, members:Greedy[Member]):
-#     """Prunes Single or Multiple members at a time useful for unsure ban-wipes"""
+@bot.tree.command(
+    name="audit",
+    description="""Scores every existing member and prunes the suspicious ones""",
+)
+@app_commands.checks.bot_has_permissions(manage_roles=True)
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    dry_run="Only report who would be pruned (default), turn off to actually prune them",
+    min_score="Points needed to be flagged: recent join, fresh join, default avatar and no roles are a point each",
+)
+async def audit_members(
+    interaction: discord.Interaction,
+    dry_run: bool = True,
+    min_score: app_commands.Range[int, 1, 4] = 3,
+):
+    """Runs the join screening rules over members that joined before the bot was set up"""
+    await interaction.response.defer()
+    guild = interaction.guild
+    model = await bot.get_guild_model(guild.id)
+    if not dry_run and not (model.moderator_channel and model.prune_role_id):
+        return await interaction.followup.send(
+            "Set a prune role and moderator channel first, see /requirements"
+        )
+
+    if not guild.chunked:
+        await guild.chunk()
+    members = guild.members
+    account_age = bot.screen_for(model).policy.account_age or 0
+    result = audit(
+        MemberArrays.from_members(members), timedelta(seconds=account_age), min_score, bot.prune_delay(model)
+    )
+
+    embed = Embed(title="Audit" + (" (dry run)" if dry_run else ""))
+    embed.add_field(name="Members", value=result.members)
+    embed.add_field(name="Flagged", value=len(result.flagged))
+    for name, count in result.counts.items():
+        embed.add_field(name=name, value=count)
+    embed.add_field(name="Scoring Took", value=f"{result.cpu_time * 1000:.1f}ms CPU")
+
+    flagged = [members[i] for i in result.flagged]
+    if dry_run:
+        return await interaction.followup.send(
+            embed=embed,
+            file=discord.File(
+                io.BytesIO("".join(f"{m.id}\n" for m in flagged).encode()),
+                filename="flagged.txt",
+            ),
+        )
+
+    await interaction.followup.send(embed=embed)
+    progress = await interaction.followup.send(f"Pruning 0/{len(flagged)}...", wait=True)
+
+    async def report(done: int):
+        async with suppress(discord.HTTPException):
+            await progress.edit(content=f"Pruning {done}/{len(flagged)}...")
+
+    pruned = await bot.prune_members(guild, flagged, reason="Flagged by audit", progress=report)
+    await finish_progress(interaction, progress, f"Pruned {pruned} members, skipped {len(flagged) - pruned}")
 
-#     model = await bot.get_guild_model(ctx.guild.id)
-#     if not (model.moderator_channel or model.prune_role_id):
-#         embed = Embed(color=0x1f1137, title="Error Unfinished Requirements")
-#         embed.add_field(name="Set Prune Role", value="Incomplete" if not model.prune_role_id else "Complete")
-#         embed.add_field(name="Set Moderation Channel", value="Incomplete" if not model.moderator_channel else "Complete")
-#         return await ctx.send(embed=embed)
 
-#     await ctx.send("Pruning members...")
+@bot.tree.command(name="prune")
+@app_commands.checks.bot_has_permissions(ban_members=True, manage_roles=True)
+@app_commands.checks.has_permissions(ban_members=True)
+@app_commands.describe(
+    members="Mentions or IDs of the members to prune, separated by spaces or commas",
+    file="A list of IDs to prune (txt, csv, json or jsonl, optionally gzipped)",
+    reason="Reason these members are being pruned",
+)
+async def prune_users(
+    interaction: discord.Interaction,
+    members: Optional[str] = None,
+    file: Optional[discord.Attachment] = None,
+    reason: str = "Suspicious account",
+):
+    """Prunes Single or Multiple members at a time useful for unsure ban-wipes"""
+    await interaction.response.defer()
+    guild = interaction.guild
+
+    model = await bot.get_guild_model(guild.id)
+    if not (model.moderator_channel and model.prune_role_id):
+        embed = Embed(color=0x1f1137, title="Error Unfinished Requirements")
+        embed.add_field(name="Set Prune Role", value="Incomplete" if not model.prune_role_id else "Complete")
+        embed.add_field(name="Set Moderation Channel", value="Incomplete" if not model.moderator_channel else "Complete")
+        return await interaction.followup.send(embed=embed)
+
+    ids = {int(i) for i in re.findall(r"\d{15,20}", members or "")}
+    if file:
+        try:
+            file_ids, report = await ingest_attachment(file)
+        except UnsupportedFile as e:
+            return await interaction.followup.send(f"ERROR: {e}")
+        await interaction.followup.send(report.summary())
+        ids.update(map(int, file_ids))
+
+    if not guild.chunked:
+        await guild.chunk()
+    targets = [m for i in ids if (m := guild.get_member(i))]
+    if not targets:
+        return await interaction.followup.send("None of those users are in the server")
+
+    progress = await interaction.followup.send(
+        f"Pruning 0/{len(targets)} members ({len(ids) - len(targets)} not in the server)...", wait=True
+    )
+
+    async def report_progress(done: int):
+        async with suppress(discord.HTTPException):
+            await progress.edit(content=f"Pruning {done}/{len(targets)} members...")
 
-#     async for result in amap(safe_prune , members, concurrency=2):
-#         if result is not None:
-#             await ctx.send(f"Pruned \"{result.member_id}\"")
+    pruned = await bot.prune_members(guild, targets, reason=reason, progress=report_progress)
+    await finish_progress(
+        interaction, progress,
+        f"Pruned {pruned} members, {len(targets) - pruned} were moderators, already pruned or failed",
+    )
 
 
 # TODO: Massban Command and Textfile/list Ban
@@ -176,10 +359,10 @@ async def check_requirements(interaction: discord.Interaction):
     name="massban",
     description="""Performs a masisve ban and bans Many Users given from a text file""",
 )
-@commands.bot_has_permissions(ban_members=True, manage_roles=True)
-@commands.has_permissions(administrator=True)
+@app_commands.checks.bot_has_permissions(ban_members=True, manage_roles=True)
+@app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(
-    file="A Text file/list of members to ban by Developer ID Line for line, The User does not have to be in the server to perform a massban.",
+    file="IDs to ban (txt, csv, json or jsonl, optionally gzipped), users don't need to be in the server",
     reason="Reason A Group of Users are being banned for.",
 )
 async def massban(
@@ -190,60 +373,217 @@ async def massban(
     """Performs a masisve ban and bans Many Users given from a text file"""
     await interaction.response.defer()
 
-    if not file.filename.endswith(".txt"):
-        return await interaction.channel.send(
-            "ERROR: Invalid File Type, textfiles with IDs on newlines required"
-        )
-    data = await file.read()
-    await interaction.followup.send("loading previous ban history to filter bans...")
-    entries_filter = {entry.user.id async for entry in interaction.guild.bans()}
-    await interaction.followup.send("Performing Massban")
+    try:
+        ids, report = await ingest_attachment(file)
+    except UnsupportedFile as e:
+        return await interaction.followup.send(f"ERROR: {e}")
 
-    for i in data.splitlines(keepends=False):
-        if uid := i.strip():
-            if uid.isdigit():
-                user_id = int(i.strip())
-                if user_id in entries_filter:
-                    continue
+    await interaction.followup.send(report.summary())
+    await interaction.followup.send("loading previous ban history to filter bans...")
+    banned = np.fromiter(await bot.get_guild_bans(interaction.guild), dtype=np.uint64)
+    ids = np.setdiff1d(ids, banned, assume_unique=True)
 
-                async with suppress(discord.NotFound):
-                    user = await bot.fetch_user(user_id)
-                    await safe_ban(user=user, interaction=interaction, reason=reason)
+    # Filtered once here, a job resumed after a restart carries on from its last checkpoint
+    job = await bot.submit_job(interaction.guild.id, "massban", ids, {"reason": reason}, interaction.channel.id)
+    await interaction.followup.send(
+        f"Massban of {len(ids)} users queued as job #{job.id}, follow along with /jobs"
+    )
 
 
 @bot.tree.command(
     name="blacklist",
     description="""makes a blacklist of banned users in the discord server""",
 )
-@commands.bot_has_permissions(ban_members=True, manage_roles=True)
-@commands.has_permissions(administrator=True)
-async def get_blacklist(interaction: discord.Interaction):
+@app_commands.checks.bot_has_permissions(ban_members=True)
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    format="txt is one ID per line (what /massban takes), csv and jsonl can carry metadata",
+    metadata="Include the ban reason and when the ban happened (csv/jsonl only)",
+)
+async def get_blacklist(
+    interaction: discord.Interaction,
+    format: Literal["txt", "csv", "jsonl"] = "txt",
+    metadata: bool = False,
+):
     """Be very careful when using this command as other users can lookup bad people"""
     await interaction.response.defer()
+    if not await bot.is_ban_index_seeded(interaction.guild.id):
+        await bot.reconcile_ban_index(interaction.guild)
 
-    # TODO: Local Database for banned users?
+    export = BlacklistExport(format, metadata, part_limit=interaction.guild.filesize_limit)
+    try:
+        async for chunk in bot.iter_bans(interaction.guild.id):
+            export.write(chunk)
 
-    return await interaction.followup.send(
-        file=discord.File(
-            io.StringIO(
-                "\n".join(
-                    map(
-                        str, {entry.user.id async for entry in interaction.guild.bans()}
-                    )
-                )
-            ),
-            filename="blacklist.txt",
+        files = export.files()
+        for i in range(0, len(files), MAX_ATTACHMENTS):
+            await interaction.followup.send(
+                f"Blacklist of {export.count} users" if i == 0 else "",
+                files=files[i : i + MAX_ATTACHMENTS],
+            )
+    finally:
+        export.close()
+
+
+@bot.tree.command(name="raid-settings")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    threshold="How many joins it takes to trigger raid mode",
+    window="How many seconds those joins have to happen in",
+    lockdown="Lock down every text channel when a raid is detected",
+)
+async def raid_settings(
+    interaction: discord.Interaction,
+    threshold: app_commands.Range[int, 2, 1000],
+    window: app_commands.Range[float, 1.0, 3600.0],
+    lockdown: bool = False,
+):
+    """Configures when the bot should consider a burst of joins a raid (reqiures admin)"""
+    await interaction.response.defer()
+    gm = await bot.update_guild_raid_settings(interaction.guild.id, threshold, window, lockdown)
+    message = f"Raid mode will trigger at {threshold} joins within {window:g}s" + (
+        " and lock down the server" if lockdown else ""
+    )
+    if (limit := bot.screen_for(gm).policy.max_join_rate) and limit >= threshold:
+        message += f"\nScreening's max_joins ({limit}) is no longer below the threshold and won't trip, lower it with /screening"
+    await interaction.followup.send(message)
+
+
+@bot.tree.command(name="screening")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    account_age_days="Prune accounts younger than this many days, 0 turns it off",
+    default_avatar="Prune accounts that never set an avatar",
+    name_pattern="Prune usernames or display names matching this regex, off to clear it",
+    similar_names="Comma separated names joiners shouldn't impersonate (staff, server name), off to clear",
+    max_joins="Prune everyone joining while more than this many joined in the raid window, below the raid threshold, 0 is off",
+    ban_after_hours="Hours a pruned member has before being banned, 0 uses the bot's default",
+    reset="Go back to the bot's default screening",
+)
+async def screening(
+    interaction: discord.Interaction,
+    account_age_days: Optional[app_commands.Range[float, 0.0, 3650.0]] = None,
+    default_avatar: Optional[bool] = None,
+    name_pattern: Optional[str] = None,
+    similar_names: Optional[str] = None,
+    max_joins: Optional[app_commands.Range[int, 0, 1000]] = None,
+    ban_after_hours: Optional[app_commands.Range[float, 0.0, 8760.0]] = None,
+    reset: bool = False,
+):
+    """Shows or changes how new members are screened (requires admin)"""
+    await interaction.response.defer()
+    gm = await bot.get_guild_model(interaction.guild.id)
+    screen = bot.screen_for(gm)
+    changes = {}
+    if account_age_days is not None:
+        changes["account_age"] = account_age_days * 86400 or None
+    if default_avatar is not None:
+        changes["default_avatar"] = default_avatar
+    if name_pattern is not None:
+        changes["name_pattern"] = None if name_pattern.lower() == "off" else name_pattern
+    if similar_names is not None:
+        changes["similar_names"] = (
+            () if similar_names.lower() == "off" else tuple(n.strip() for n in similar_names.split(",") if n.strip())
+        )
+    if max_joins is not None:
+        if max_joins >= gm.raid_threshold:
+            # Raid mode already prunes everyone from the threshold up, and the join rate
+            # is only tracked that far, a limit up there could never trip
+            return await interaction.followup.send(
+                f"ERROR: max_joins has to be below the raid threshold ({gm.raid_threshold}), "
+                "raid mode already prunes everyone past it"
+            )
+        changes["max_join_rate"] = max_joins or None
+    if ban_after_hours is not None:
+        changes["prune_after"] = ban_after_hours * 3600 or None
+
+    if reset:
+        screen = await bot.update_guild_screening(gm.guild_id, None)
+    elif changes:
+        try:
+            screen = await bot.update_guild_screening(gm.guild_id, dataclasses.replace(screen.policy, **changes))
+        except re.error as e:
+            return await interaction.followup.send(f"ERROR: name_pattern isn't a valid regex: {e}")
+
+    # Time the compiled rules against whoever ran this so admins can see what a heavy regex costs
+    start = time.perf_counter()
+    for _ in range(1000):
+        screen(interaction.user)
+    per_join = (time.perf_counter() - start) / 1000
+
+    embed = Embed(title="Join Screening")
+    for name, value in screen.policy.describe().items():
+        embed.add_field(name=name, value=value)
+    embed.add_field(name="Ban After", value=str(screen.prune_after or bot.prune_date))
+    embed.add_field(name="Evaluation", value=f"{per_join * 1e6:.2f}µs per join, {len(screen.rules)} rule(s)")
+    await interaction.followup.send(embed=embed)
+
+
+@bot.tree.command(name="federation")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    action="What to do with joiners banned in another federated server, off leaves the federation",
+)
+async def federation(
+    interaction: discord.Interaction,
+    action: Optional[Literal["off", "prune", "ban"]] = None,
+):
+    """Shares this server's bans with every other server the bot protects (requires admin)"""
+    await interaction.response.defer()
+    gm = await bot.get_guild_model(interaction.guild.id)
+    if action is not None:
+        gm = await bot.update_guild_blacklist_action(interaction.guild, None if action == "off" else action)
+    blacklist = bot.blacklist
+    await interaction.followup.send(
+        embed=Embed(title="Federated Blacklist")
+        .add_field(name="This Server", value=(gm.blacklist_action or "not taking part").title())
+        .add_field(name="Blacklisted Users", value=len(blacklist))
+        .add_field(
+            name="Memory",
+            value=f"{blacklist.nbytes / 2**20:.1f} MiB" + (" (memory-mapped)" if blacklist.mapped else ""),
         )
     )
 
 
+@bot.tree.command(name="raid-status")
+@app_commands.checks.has_permissions(ban_members=True)
+async def raid_status(interaction: discord.Interaction):
+    """Shows the current join rate against the raid threshold"""
+    gm = await bot.get_guild_model(interaction.guild.id)
+    await interaction.response.send_message(
+        embed=Embed(title="Raid Status")
+        .add_field(name="Raid Mode", value="Active" if bot.raids.is_active(gm.guild_id) else "Off")
+        .add_field(name=f"Joins in the last {gm.raid_window:g}s", value=bot.raids.rate(gm.guild_id))
+        .add_field(name="Threshold", value=gm.raid_threshold)
+        .add_field(name="Auto Lockdown", value="On" if gm.raid_lockdown else "Off")
+    )
+
+
+@bot.tree.command(name="raid-end")
+@app_commands.checks.has_permissions(ban_members=True)
+async def raid_end(interaction: discord.Interaction):
+    """Takes the server out of raid mode, use /unlock-server to lift a lockdown"""
+    bot.raids.end(interaction.guild.id)
+    await interaction.response.send_message("Raid mode ended, new members are screened normally again")
+
+
+@bot.tree.command(
+    name="moderation-queue",
+    description="""Shows how backed up the bot's bans, role edits and lockdowns are""",
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def moderation_queue(interaction: discord.Interaction):
+    """Shows queue depth and wait times for each moderation priority lane"""
+    await interaction.response.send_message(embed=bot.actions.embed())
+
+
 # Inspired by EvilPauze
 @bot.tree.command(
     name="lock-channel",
     description="""Locks down a discord server channel same to how EvilPauze works""",
 )
-@commands.bot_has_permissions(manage_channels=True)
-@commands.has_permissions(manage_channels=True)
+@app_commands.checks.bot_has_permissions(manage_channels=True)
+@app_commands.checks.has_permissions(manage_channels=True)
 async def lock_channel(
     interaction: discord.Interaction,
     channel: Optional[discord.TextChannel] = None,
@@ -254,29 +594,46 @@ async def lock_channel(
 
     assert channel, "No Channel Exists"
 
-    ldm = LockdownChannel(channel_id=channel.id, guild_id=interaction.guild.id)
-
-    for role in interaction.guild.roles:
-        if role.permissions.send_messages:
-            if moderators and (
-                role.permissions.ban_members
-                or role.permissions.kick_members
-                or role.permissions.deafen_members
-            ):
-                # Moderators can talk here to help with damage control
-                continue
-
-            await channel.set_permissions(target=role, send_messages=False)
-            ldm.add_role(role)
-    await bot.update_lockdown_role(ldm)
+    # A pending lockdown never finished locking the channel, lock_channels picks it back up
+    if (ld := await bot.get_lockdown(interaction.guild, channel)) and not ld.pending:
+        return await interaction.followup.send(f"""Channel {channel.name} is already locked-down""")
+    await bot.lock_channels(interaction.guild, [channel], moderators=moderators)
     await interaction.followup.send(f"""Channel {channel.name} is locked-down""")
 
 
+@bot.tree.command(
+    name="lockdown",
+    description="""Locks down every text channel in the server at once""",
+)
+@app_commands.checks.bot_has_permissions(manage_channels=True, manage_roles=True)
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    moderators="Let moderators keep talking to help with damage control",
+    reason="Why the server is being locked down",
+)
+async def lockdown_server(
+    interaction: discord.Interaction,
+    moderators: bool = True,
+    reason: Optional[str] = None,
+):
+    await interaction.response.defer()
+    started = time.monotonic()
+    channels = interaction.guild.text_channels
+    job = await bot.submit_job(
+        interaction.guild.id, "lockdown", [c.id for c in channels], {"moderators": moderators, "reason": reason}
+    )
+    progress = await bot.jobs.wait(job.id)
+    await interaction.followup.send(
+        embed=Embed(title="Server locked-down" if progress.state == "done" else f"Lockdown {progress.state}")
+        .add_field(name="Channels Locked", value=progress.succeeded)
+        .add_field(name="Channels Total", value=len(channels))
+        .add_field(name="Took", value=f"{time.monotonic() - started:.1f}s")
+    )
 
 
 @bot.tree.command(name="unlock-channel")
-@commands.bot_has_permissions(manage_channels=True)
-@commands.has_permissions(manage_channels=True)
+@app_commands.checks.bot_has_permissions(manage_channels=True)
+@app_commands.checks.has_permissions(manage_channels=True)
 async def unlock_channel(
     interaction: discord.Interaction,
     channel: Optional[discord.TextChannel] = None
@@ -294,6 +651,56 @@ async def unlock_channel(
         await interaction.followup.send(embed=discord.Embed(title="Lockdown successfully freed").add_field(name="Channel", value=_channel.name))
 
 
+@bot.tree.command(name="unlock-server")
+@app_commands.checks.bot_has_permissions(manage_channels=True, manage_roles=True)
+@app_commands.checks.has_permissions(administrator=True)
+async def unlock_server(interaction: discord.Interaction):
+    """Restores every locked channel in the server to how it was before the lockdown"""
+    await interaction.response.defer()
+    started = time.monotonic()
+    lockdowns = await bot.get_guild_lockdowns(interaction.guild.id)
+    job = await bot.submit_job(interaction.guild.id, "unlock", [ld.channel_id for ld in lockdowns])
+    progress = await bot.jobs.wait(job.id)
+    await interaction.followup.send(
+        embed=discord.Embed(title="Lockdown successfully freed" if progress.state == "done" else f"Unlock {progress.state}")
+        .add_field(name="Channels Unlocked", value=progress.succeeded)
+        .add_field(name="Took", value=f"{time.monotonic() - started:.1f}s")
+    )
+
+
+@bot.tree.command(name="jobs")
+@app_commands.checks.has_permissions(ban_members=True)
+@app_commands.describe(cancel="Job number to stop at its next checkpoint")
+async def jobs(interaction: discord.Interaction, cancel: Optional[int] = None):
+    """Shows this server's massbans, lockdowns and other long running jobs"""
+    await interaction.response.defer()
+    if cancel is not None:
+        job = await bot.get_job(cancel)
+        if not job or job.guild_id != interaction.guild.id or not bot.jobs.cancel(cancel):
+            return await interaction.followup.send(f"Job #{cancel} isn't queued or running")
+
+    embed = Embed(title="Jobs")
+    embed.set_footer(text=f"{bot.jobs.running} running, {bot.jobs.pending} waiting for a worker")
+    for job in await bot.get_guild_jobs(interaction.guild.id):
+        line = f"{job.done}/{job.total} ({job.done / job.total:.0%})" if job.total else "nothing to do"
+        if (progress := bot.jobs.progress.get(job.id)) and progress.state == "running":
+            line = f"{progress.done}/{progress.total} | {progress.rate:.1f}/s"
+            if progress.cancelled:
+                line += " | cancelling"
+            elif eta := progress.eta:
+                line += f" | ETA {eta}"
+        elif job.finished_at and job.started_at:
+            took = (job.finished_at - job.started_at).total_seconds()
+            line += f" | {job.done / took:.1f}/s" if took > 0 else ""
+        line += f"\nsucceeded {job.succeeded}, failed {job.failed}"
+        embed.add_field(
+            name=f"#{job.id} {job.kind} {progress.state if progress else job.state}",
+            value=line + (f"\n{job.error[:200]}" if job.error else ""),
+            inline=False,
+        )
+    await interaction.followup.send(embed=embed)
+
+
 
 
 def banner():
@@ -316,10 +723,14 @@ def banner():
 
 
 
-if __name__ == "__main__":
+def main():
     init(autoreset=True)
     banner()
     # This will be removed in a future update in replacement for the config.yaml file...
     with open("token.txt", "r") as token:
         bot.run(token.read().rstrip())
 
+
+if __name__ == "__main__":
+    main()
+
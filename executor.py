@@ -0,0 +1,305 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+import discord
+
+_log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Lanes for moderation actions, lower values always run first"""
+
+    RAID = 0
+    """Raid bans and lockdowns"""
+    PRUNE = 1
+    """Pruning suspicious joins and banning them once their deadline is met"""
+    CLEANUP = 2
+    """Unlocks, unbans and anything else that can wait until the raid is over"""
+
+
+# (requests, per seconds) for each kind of route, these are a little below what discord
+# normally hands out so we don't end up fighting discord.py's own 429 handling
+ROUTE_LIMITS: dict[str, tuple[int, float]] = {
+    "ban": (5, 1.0),
+    "bulk_ban": (1, 2.0),
+    "unban": (5, 1.0),
+    "member_edit": (10, 10.0),
+    "channel_permissions": (5, 5.0),
+    "channel_edit": (5, 5.0),
+}
+DEFAULT_LIMIT = (5, 5.0)
+
+
+class RouteLimiter:
+    """Sliding window over the last `capacity` requests on a route, the next one can go
+    once the oldest of them is `per` seconds old. Discord resets its buckets on fixed
+    windows and a token bucket can burst twice its capacity across a reset, this never
+    lets more than `capacity` through in any `per` seconds"""
+
+    def __init__(self, capacity: int, per: float) -> None:
+        self.capacity = capacity
+        self.per = per
+        self._sent: deque[float] = deque(maxlen=capacity)
+        self._paused_until = 0.0
+
+    def ready_at(self) -> float:
+        """When the next request can go, anything up to now means right away"""
+        if len(self._sent) < self.capacity:
+            return self._paused_until
+        return max(self._paused_until, self._sent[0] + self.per)
+
+    def take(self, now: float):
+        self._sent.append(now)
+
+    def pause(self, seconds: float):
+        """Holds the route back after a 429 so the next request waits `seconds`"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+@dataclass
+class LaneStats:
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    rate_limited: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        done = self.completed + self.failed
+        return self.total_wait / done if done else 0.0
+
+
+Route = tuple[str, Hashable]
+
+_RUNNABLE = "runnable"
+_SLEEPING = "sleeping"
+
+
+@dataclass
+class _Job:
+    route: Route
+    factory: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    priority: Priority
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class ModerationExecutor:
+    """Central queue that every moderation call (bans, role edits, permission
+    overwrites) goes through. Jobs wait on their own route until its limiter lets
+    them go, and of the routes that can go the most urgent job always runs first.
+    Only jobs that can be sent right away take one of the `workers` slots, so a
+    backed up ban route never holds up lockdowns or anything else"""
+
+    def __init__(
+        self,
+        workers: int = 8,
+        max_queue: int = 10_000,
+        limits: Optional[dict[str, tuple[int, float]]] = None,
+    ) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.limits = limits or ROUTE_LIMITS
+        self._limiters: dict[Route, RouteLimiter] = {}
+        self._pending: dict[Route, list[tuple[Priority, int, _Job]]] = {}
+        """Jobs per route, a heap so a raid ban jumps ahead of prune bans on the same route"""
+        self._state: dict[Route, str] = {}
+        self._runnable: list[tuple[Priority, int, Route]] = []
+        """Routes that can send right now by their most urgent job, stale entries get skipped"""
+        self._sleeping: list[tuple[float, int, Route]] = []
+        """Routes waiting on their limiter by when it lets the next request through"""
+        self._seq = itertools.count()
+        self._depth = {p: 0 for p in Priority}
+        self._space: dict[Priority, asyncio.Semaphore] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+        self.stats: dict[Priority, LaneStats] = {p: LaneStats() for p in Priority}
+
+    def _start(self):
+        if self._dispatcher:
+            return
+        self._space = {p: asyncio.Semaphore(self.max_queue) for p in Priority}
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def close(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in self._running:
+            task.cancel()
+
+    def limiter(self, route: Route) -> RouteLimiter:
+        if not (limiter := self._limiters.get(route)):
+            limiter = self._limiters[route] = RouteLimiter(*self.limits.get(route[0], DEFAULT_LIMIT))
+        return limiter
+
+    def depth(self, priority: Priority) -> int:
+        return self._depth[priority]
+
+    async def submit(
+        self,
+        route: Route,
+        factory: Callable[[], Awaitable[T]],
+        priority: Priority = Priority.PRUNE,
+    ) -> T:
+        """Queues up `factory()` on the given route and waits for its result,
+        `route` is a (kind, major id) pair such as `("ban", guild.id)`"""
+        self._start()
+        # Bounded lanes, if a lane is full the caller waits here
+        await self._space[priority].acquire()
+        job = _Job(route, factory, asyncio.get_running_loop().create_future(), priority)
+        self.stats[priority].submitted += 1
+        self._depth[priority] += 1
+
+        entry = (priority, next(self._seq), job)
+        pending = self._pending.setdefault(route, [])
+        heapq.heappush(pending, entry)
+        state = self._state.get(route)
+        if state is None:
+            self._schedule(route, time.monotonic())
+        elif state == _RUNNABLE and pending[0] is entry:
+            # Jumped ahead of the route's old head, the old entry goes stale
+            heapq.heappush(self._runnable, (priority, entry[1], route))
+            self._wakeup.set()
+        return await job.future
+
+    def _schedule(self, route: Route, now: float):
+        """Files a route under runnable or sleeping depending on its limiter"""
+        if not (pending := self._pending.get(route)):
+            self._pending.pop(route, None)
+            self._state.pop(route, None)
+            return
+        if (ready_at := self.limiter(route).ready_at()) <= now:
+            self._state[route] = _RUNNABLE
+            priority, seq, _ = pending[0]
+            heapq.heappush(self._runnable, (priority, seq, route))
+        else:
+            self._state[route] = _SLEEPING
+            heapq.heappush(self._sleeping, (ready_at, next(self._seq), route))
+        self._wakeup.set()
+
+    def _next_job(self, now: float) -> Optional[_Job]:
+        """Takes the most urgent job that can be sent right now"""
+        while self._sleeping and self._sleeping[0][0] <= now:
+            _, _, route = heapq.heappop(self._sleeping)
+            if self._state.get(route) == _SLEEPING:
+                self._schedule(route, now)
+
+        while self._runnable:
+            priority, seq, route = heapq.heappop(self._runnable)
+            pending = self._pending.get(route)
+            if self._state.get(route) != _RUNNABLE or not pending or pending[0][1] != seq:
+                continue
+            limiter = self.limiter(route)
+            if limiter.ready_at() > now:
+                # Hit a 429 since it was filed
+                self._schedule(route, now)
+                continue
+            _, _, job = heapq.heappop(pending)
+            self._depth[priority] -= 1
+            self._space[priority].release()
+            if not job.future.cancelled():
+                limiter.take(now)
+            self._schedule(route, now)
+            if not job.future.cancelled():
+                return job
+        return None
+
+    async def _dispatch(self):
+        while True:
+            await self._slots.acquire()
+            while not (job := self._next_job(now := time.monotonic())):
+                self._wakeup.clear()
+                timeout = self._sleeping[0][0] - now if self._sleeping else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            task = asyncio.create_task(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, job: _Job):
+        stats = self.stats[job.priority]
+        wait = time.monotonic() - job.enqueued
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        try:
+            result = await job.factory()
+        except discord.RateLimited as e:
+            self.limiter(job.route).pause(e.retry_after)
+            stats.rate_limited += 1
+            stats.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if isinstance(e, discord.HTTPException) and e.status == 429:
+                stats.rate_limited += 1
+            stats.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            stats.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    # === Helpers for the calls Defender makes ===
+
+    def ban(self, guild: discord.Guild, user: discord.abc.Snowflake, priority=Priority.PRUNE, **kwargs):
+        return self.submit(("ban", guild.id), lambda: guild.ban(user, **kwargs), priority)
+
+    def bulk_ban(self, guild: discord.Guild, users: list[discord.abc.Snowflake], priority=Priority.RAID, **kwargs):
+        return self.submit(("bulk_ban", guild.id), lambda: guild.bulk_ban(users, **kwargs), priority)
+
+    def unban(self, guild: discord.Guild, user: discord.abc.Snowflake, priority=Priority.CLEANUP, **kwargs):
+        return self.submit(("unban", guild.id), lambda: guild.unban(user, **kwargs), priority)
+
+    def edit_member(self, member: discord.Member, priority=Priority.PRUNE, **kwargs):
+        return self.submit(("member_edit", member.guild.id), lambda: member.edit(**kwargs), priority)
+
+    def add_roles(self, member: discord.Member, *roles: discord.abc.Snowflake, priority=Priority.PRUNE, **kwargs):
+        return self.submit(("member_edit", member.guild.id), lambda: member.add_roles(*roles, **kwargs), priority)
+
+    def remove_roles(self, member: discord.Member, *roles: discord.abc.Snowflake, priority=Priority.PRUNE, **kwargs):
+        return self.submit(("member_edit", member.guild.id), lambda: member.remove_roles(*roles, **kwargs), priority)
+
+    def set_permissions(self, channel: discord.abc.GuildChannel, target, priority=Priority.RAID, **kwargs):
+        return self.submit(
+            ("channel_permissions", channel.id), lambda: channel.set_permissions(target, **kwargs), priority
+        )
+
+    def edit_channel(self, channel: discord.abc.GuildChannel, priority=Priority.RAID, **kwargs):
+        return self.submit(("channel_edit", channel.id), lambda: channel.edit(**kwargs), priority)
+
+    def embed(self) -> discord.Embed:
+        """Queue depth and wait times per lane for the admins"""
+        embed = discord.Embed(title="Moderation Queue")
+        for p in Priority:
+            s = self.stats[p]
+            embed.add_field(
+                name=p.name.title(),
+                value=(
+                    f"Queued: {self.depth(p)}\n"
+                    f"Done: {s.completed} Failed: {s.failed}\n"
+                    f"429s: {s.rate_limited}\n"
+                    f"Wait avg/max: {s.avg_wait:.2f}s / {s.max_wait:.2f}s"
+                ),
+            )
+        return embed
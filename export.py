@@ -0,0 +1,115 @@
+import csv
+import gzip
+import io
+import json
+import tempfile
+from typing import IO, Iterable, Optional
+
+import discord
+
+FORMATS = ("txt", "csv", "jsonl")
+
+# Discord won't take more than this many files in a single message
+MAX_ATTACHMENTS = 10
+
+
+class BlacklistExport:
+    """Streams ban rows into gzip compressed files, starting a new part whenever the
+    current one would go over the upload limit. Only one chunk of rows is ever held
+    in memory, everything else lives in temporary files on disk
+
+    Rows are expected to look like `BannedUser` (user_id, reason, banned_at)"""
+
+    def __init__(
+        self,
+        fmt: str = "txt",
+        metadata: bool = False,
+        part_limit: int = 8 * 1024 * 1024,
+        name: str = "blacklist",
+    ) -> None:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown blacklist format {fmt!r}, expected one of {FORMATS}")
+        self.fmt = fmt
+        self.metadata = metadata
+        # Leave some headroom for the gzip trailer and multipart overhead
+        self.part_limit = int(part_limit * 0.95)
+        self.name = name
+        self.count = 0
+        self._parts: list[IO[bytes]] = []
+        self._raw: Optional[IO[bytes]] = None
+        self._gz: Optional[gzip.GzipFile] = None
+        self._last_chunk = 0
+
+    def _new_part(self):
+        self._end_part()
+        self._raw = tempfile.TemporaryFile()
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._parts.append(self._raw)
+        if self.fmt == "csv":
+            header = ["user_id", "reason", "banned_at"] if self.metadata else ["user_id"]
+            self._gz.write(self._encode_csv([header]))
+
+    def _end_part(self):
+        if self._gz:
+            self._gz.close()
+            self._gz = None
+
+    def _encode_csv(self, rows: list[list]) -> bytes:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue().encode()
+
+    def _encode(self, rows: list) -> bytes:
+        if self.fmt == "txt":
+            return "".join(f"{r.user_id}\n" for r in rows).encode()
+        if self.fmt == "csv":
+            if self.metadata:
+                return self._encode_csv(
+                    [[r.user_id, r.reason or "", r.banned_at.isoformat() if r.banned_at else ""] for r in rows]
+                )
+            return self._encode_csv([[r.user_id] for r in rows])
+        if self.metadata:
+            return "".join(
+                json.dumps(
+                    {
+                        "id": str(r.user_id),
+                        "reason": r.reason,
+                        "banned_at": r.banned_at.isoformat() if r.banned_at else None,
+                    }
+                ) + "\n"
+                for r in rows
+            ).encode()
+        return "".join(json.dumps({"id": str(r.user_id)}) + "\n" for r in rows).encode()
+
+    def write(self, rows: Iterable):
+        """Writes one chunk of rows"""
+        rows = list(rows)
+        if not rows:
+            return
+        if self._raw is None or self._raw.tell() + self._last_chunk > self.part_limit:
+            self._new_part()
+
+        before = self._raw.tell()
+        self._gz.write(self._encode(rows))
+        # Sync flush so that tell() reflects how big the compressed part really is
+        self._gz.flush()
+        self._last_chunk = self._raw.tell() - before
+        self.count += len(rows)
+
+    def files(self) -> list[discord.File]:
+        """Finishes the export and hands back one `discord.File` per part"""
+        if self._raw is None:
+            self._new_part()
+        self._end_part()
+        files = []
+        for n, raw in enumerate(self._parts, 1):
+            raw.seek(0)
+            suffix = f"-{n}" if len(self._parts) > 1 else ""
+            files.append(discord.File(raw, filename=f"{self.name}{suffix}.{self.fmt}.gz"))
+        return files
+
+    def close(self):
+        self._end_part()
+        for raw in self._parts:
+            raw.close()
+        self._parts.clear()
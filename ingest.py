@@ -0,0 +1,280 @@
+import csv
+import json
+import re
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+import aiohttp
+import discord
+import numpy as np
+
+# First millisecond of 2015, every snowflake's timestamp is counted from here
+DISCORD_EPOCH = 1420070400000
+
+FORMATS = ("txt", "csv", "json", "jsonl")
+
+_ID_KEY = re.compile(rb'"(?:user_id|id)"\s*:\s*"?(\d+)"?')
+_JSON_OBJECT = re.compile(rb"\{[^{}]*\}")
+_JSON_SEPARATORS = re.compile(rb"[\[\],\s]+")
+
+
+class UnsupportedFile(ValueError):
+    """The uploaded file isn't something we know how to read IDs out of"""
+    pass
+
+
+def snowflake_mask(ids: np.ndarray, now_ms: Optional[int] = None) -> np.ndarray:
+    """Which ids are real snowflakes, meaning their timestamp lands between
+    the discord epoch and right now"""
+    now_ms = now_ms or int(time.time() * 1000)
+    ts = (ids >> np.uint64(22)).astype(np.int64) + DISCORD_EPOCH
+    return (ts > DISCORD_EPOCH) & (ts <= now_ms)
+
+
+class IdSet:
+    """Deduplicated set of ids kept as a sorted uint64 numpy array, new ids are
+    buffered and merged in bulk so millions of ids only take 8 bytes each"""
+
+    def __init__(self, buffer: int = 1 << 18) -> None:
+        self._sorted = np.empty(0, dtype=np.uint64)
+        self._pending = np.empty(buffer, dtype=np.uint64)
+        self._n = 0
+        self.added = 0
+
+    def _merge(self):
+        if self._n:
+            # Both halves are sorted runs which a stable (tim)sort merges in linear time
+            merged = np.sort(
+                np.concatenate((self._sorted, np.sort(self._pending[: self._n]))), kind="stable"
+            )
+            keep = np.empty(len(merged), dtype=bool)
+            keep[:1] = True
+            np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+            self._sorted = merged[keep]
+            self._n = 0
+            # Grow the buffer with the set so merges stay amortized
+            if len(self._pending) < len(self._sorted) // 4:
+                self._pending = np.empty(len(self._sorted) // 4, dtype=np.uint64)
+
+    def extend(self, ids: np.ndarray):
+        self.added += len(ids)
+        while len(ids):
+            room = len(self._pending) - self._n
+            take = ids[:room]
+            self._pending[self._n : self._n + len(take)] = take
+            self._n += len(take)
+            ids = ids[room:]
+            if self._n == len(self._pending):
+                self._merge()
+
+    def array(self) -> np.ndarray:
+        """The sorted unique ids"""
+        self._merge()
+        return self._sorted
+
+    def __len__(self) -> int:
+        return len(self.array())
+
+    @property
+    def duplicates(self) -> int:
+        return self.added - len(self)
+
+
+@dataclass
+class IngestReport:
+    entries: int = 0
+    """Lines or JSON elements that were looked at"""
+    valid: int = 0
+    malformed: int = 0
+    out_of_range: int = 0
+    duplicates: int = 0
+    unique: int = 0
+    samples: list[str] = field(default_factory=list)
+    """First few malformed entries so the user can see what went wrong"""
+
+    def summary(self) -> str:
+        text = (
+            f"Read {self.entries} entries: {self.unique} unique IDs, {self.duplicates} duplicates, "
+            f"{self.malformed} malformed, {self.out_of_range} not valid discord IDs"
+        )
+        if self.samples:
+            text += "\nMalformed: " + ", ".join(f"`{s}`" for s in self.samples)
+        return text
+
+
+class IdParser:
+    """Incremental parser for massban lists, bytes are fed in as they arrive and
+    only the current chunk is ever held in memory.
+
+    Accepts txt (one ID per line), csv (ID in the first column), jsonl, json
+    arrays of IDs or of objects with an "id"/"user_id" key, all optionally gzipped"""
+
+    def __init__(self, filename: str, max_samples: int = 5) -> None:
+        name = filename.lower()
+        self.gzipped = name.endswith(".gz")
+        if self.gzipped:
+            name = name[:-3]
+        self.fmt = name.rsplit(".", 1)[-1]
+        if self.fmt not in FORMATS:
+            raise UnsupportedFile(
+                f"Unsupported file type {filename!r}, expected one of "
+                + ", ".join(f".{f}" for f in FORMATS)
+                + " (optionally .gz)"
+            )
+        self.ids = IdSet()
+        self.report = IngestReport()
+        self.max_samples = max_samples
+        self._decompressor = zlib.decompressobj(wbits=47) if self.gzipped else None
+        self._carry = b""
+        self._json_objects: Optional[bool] = None
+
+    def _malformed(self, entry: bytes):
+        self.report.malformed += 1
+        if len(self.report.samples) < self.max_samples:
+            self.report.samples.append(entry[:40].decode(errors="replace"))
+
+    def _parse_line(self, line: bytes) -> Optional[int]:
+        line = line.strip()
+        if not line:
+            return None
+        self.report.entries += 1
+
+        if self.fmt == "csv":
+            token = next(csv.reader([line.decode(errors="replace")]), [""])[0].strip().encode()
+            # Skip a header row
+            if self.report.entries == 1 and not token.isdigit():
+                self.report.entries -= 1
+                return None
+        else:
+            try:
+                value = json.loads(line)
+            except ValueError:
+                self._malformed(line)
+                return None
+            if isinstance(value, dict):
+                value = value.get("user_id", value.get("id"))
+            token = str(value).encode()
+
+        if token.isdigit() and len(token) <= 20:
+            return int(token)
+        self._malformed(line)
+        return None
+
+    def _parse_lines(self, data: bytes) -> list[int]:
+        data = self._carry + data
+        end = data.rfind(b"\n") + 1
+        self._carry = data[end:]
+        if self.fmt == "txt":
+            # Fast path, plain text is by far the most common thing handed to us
+            tokens = data[:end].split()
+            found = [int(t) for t in tokens if t.isdigit() and len(t) <= 20]
+            self.report.entries += len(tokens)
+            if len(found) != len(tokens):
+                for t in tokens:
+                    if not (t.isdigit() and len(t) <= 20):
+                        self._malformed(t)
+            return found
+        return [i for i in map(self._parse_line, data[:end].split(b"\n")) if i is not None]
+
+    def _parse_json(self, data: bytes, final: bool = False) -> list[int]:
+        data = self._carry + data
+        if self._json_objects is None:
+            head = data.lstrip().lstrip(b"[").lstrip()
+            if not head:
+                self._carry = data
+                return []
+            self._json_objects = head.startswith(b"{")
+
+        found = []
+        if self._json_objects:
+            end = 0
+            for m in _JSON_OBJECT.finditer(data):
+                end = m.end()
+                self.report.entries += 1
+                if key := _ID_KEY.search(m.group()):
+                    found.append(int(key.group(1)))
+                else:
+                    self._malformed(m.group())
+            self._carry = data[end:]
+            return found
+
+        tokens = _JSON_SEPARATORS.split(data)
+        # The last token could be cut off halfway through a number
+        self._carry = b"" if final else tokens.pop()
+        for token in tokens:
+            if not token:
+                continue
+            self.report.entries += 1
+            token = token.strip(b'"')
+            if token.isdigit() and len(token) <= 20:
+                found.append(int(token))
+            else:
+                self._malformed(token)
+        return found
+
+    def _add(self, found: list[int]):
+        if not found:
+            return
+        try:
+            ids = np.array(found, dtype=np.uint64)
+        except OverflowError:
+            ids = np.array([i for i in found if i < 1 << 64], dtype=np.uint64)
+            self.report.out_of_range += len(found) - len(ids)
+        mask = snowflake_mask(ids)
+        self.report.out_of_range += int(len(ids) - mask.sum())
+        ids = ids[mask]
+        self.report.valid += len(ids)
+        self.ids.extend(ids)
+
+    def _decompress(self, data: bytes, max_length: int = 256 * 1024) -> Iterator[bytes]:
+        """Inflates in pieces of at most `max_length` bytes, a tiny gzip bomb would
+        otherwise come back as one giant buffer before the parser sees any of it"""
+        while True:
+            out = self._decompressor.decompress(data, max_length)
+            data = self._decompressor.unconsumed_tail
+            # Concatenated gzip members (e.g. several exported parts cat'ed together)
+            if self._decompressor.eof and self._decompressor.unused_data:
+                data = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(wbits=47)
+            if out:
+                yield out
+            # A full piece can mean zlib is still holding output back even with no input left
+            if not data and len(out) < max_length:
+                return
+
+    def _consume(self, data: bytes, final: bool = False):
+        if self.fmt == "json":
+            self._add(self._parse_json(data, final))
+        else:
+            if final:
+                data += b"\n"
+            self._add(self._parse_lines(data))
+
+    def feed(self, data: bytes):
+        if not self._decompressor:
+            return self._consume(data)
+        for piece in self._decompress(data):
+            self._consume(piece)
+
+    def close(self) -> IngestReport:
+        self._consume(self._decompressor.flush() if self._decompressor else b"", final=True)
+        self.report.unique = len(self.ids)
+        self.report.duplicates = self.ids.duplicates
+        return self.report
+
+
+async def ingest_attachment(
+    attachment: discord.Attachment, chunksize: int = 64 * 1024
+) -> tuple[np.ndarray, IngestReport]:
+    """Downloads and parses an attachment chunk by chunk, returns the sorted
+    unique ids along with a report of what was skipped"""
+    parser = IdParser(attachment.filename)
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(chunksize):
+                parser.feed(chunk)
+    report = parser.close()
+    return parser.ids.array(), report
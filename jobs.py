@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+_log = logging.getLogger(__name__)
+
+URGENT_KINDS = frozenset({"lockdown", "unlock"})
+"""Small and time critical, these start right away instead of waiting on a worker"""
+
+
+class JobCancelled(Exception):
+    """Raised from a checkpoint once someone cancelled the job"""
+
+
+class JobProgress:
+    """In-memory view of a job while this process works on it, the database row is the
+    source of truth and only gets written at checkpoints"""
+
+    def __init__(self, job_id: int, guild_id: int, kind: str, total: int, done: int = 0) -> None:
+        self.job_id = job_id
+        self.guild_id = guild_id
+        self.kind = kind
+        self.total = total
+        self.done = done
+        self.succeeded = 0
+        self.failed = 0
+        self.state = "queued"
+        self.error: Optional[str] = None
+        self.cancelled = False
+        self._started: Optional[float] = None
+        self._done_at_start = done
+        """Resumed jobs don't get credit for work an earlier process did"""
+
+    def start(self):
+        self.state = "running"
+        self._started = time.monotonic()
+        self._done_at_start = self.done
+
+    @property
+    def rate(self) -> float:
+        """Items per second since this process picked the job up"""
+        if not self._started:
+            return 0.0
+        elapsed = time.monotonic() - self._started
+        return (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[timedelta]:
+        if not (rate := self.rate):
+            return None
+        return timedelta(seconds=round((self.total - self.done) / rate))
+
+
+class JobQueue:
+    """Bounded pool of workers over durable jobs. `work` does the job and checkpoints it,
+    this only decides when it runs. Urgent kinds skip the queue so a lockdown never
+    sits behind a 50k id massban"""
+
+    def __init__(self, work: Callable[[JobProgress], Awaitable[Any]], workers: int = 2) -> None:
+        self._work = work
+        self.workers = workers
+        self._queue: asyncio.Queue[JobProgress] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._urgent: set[asyncio.Task] = set()
+        self._waiters: dict[int, asyncio.Future] = {}
+        self.progress: dict[int, JobProgress] = {}
+        """Every job this process has queued or run, by job id"""
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def running(self) -> int:
+        return sum(p.state == "running" for p in self.progress.values())
+
+    def submit(self, progress: JobProgress):
+        if progress.job_id in self.progress and self.progress[progress.job_id].state in ("queued", "running"):
+            return
+        self.progress[progress.job_id] = progress
+        if progress.kind in URGENT_KINDS:
+            task = asyncio.create_task(self._run(progress))
+            self._urgent.add(task)
+            task.add_done_callback(self._urgent.discard)
+        else:
+            self._queue.put_nowait(progress)
+
+    def cancel(self, job_id: int) -> bool:
+        """Stops a job at its next checkpoint, False if it isn't queued or running here"""
+        if not (progress := self.progress.get(job_id)) or progress.state not in ("queued", "running"):
+            return False
+        progress.cancelled = True
+        return True
+
+    async def wait(self, job_id: int) -> JobProgress:
+        """Waits until the job finished, failed or got cancelled"""
+        progress = self.progress[job_id]
+        if progress.state in ("queued", "running"):
+            await asyncio.shield(self._waiters.setdefault(job_id, asyncio.get_running_loop().create_future()))
+        return progress
+
+    async def join(self):
+        """Waits until nothing is queued or running"""
+        await self._queue.join()
+        while self._urgent:
+            await asyncio.gather(*self._urgent, return_exceptions=True)
+
+    def start(self):
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def stop(self):
+        """Jobs stopped halfway stay running in the database and are resumed on the next start"""
+        for task in [*self._tasks, *self._urgent]:
+            task.cancel()
+        self._tasks.clear()
+
+    async def _worker(self):
+        while True:
+            progress = await self._queue.get()
+            try:
+                await self._run(progress)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, progress: JobProgress):
+        try:
+            progress.start()
+            await self._work(progress)
+        except Exception as e:
+            _log.exception("Job %s (%s) crashed", progress.job_id, progress.kind)
+            progress.state, progress.error = "failed", str(e)
+        finally:
+            if (waiter := self._waiters.pop(progress.job_id, None)) and not waiter.done():
+                waiter.set_result(progress)
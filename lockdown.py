@@ -0,0 +1,60 @@
+from typing import Iterable, Union
+
+import discord
+from discord import PermissionOverwrite, Permissions, Role
+
+# Matches the values discord uses for overwrite types
+ROLE, MEMBER = 0, 1
+
+Target = Union[Role, discord.Member, discord.Object]
+
+
+def is_moderator_role(role: Role) -> bool:
+    perms = role.permissions
+    return perms.ban_members or perms.kick_members or perms.deafen_members
+
+
+def target_type(target: Target) -> int:
+    if isinstance(target, Role) or getattr(target, "type", None) is Role:
+        return ROLE
+    return MEMBER
+
+
+def snapshot(channel: discord.abc.GuildChannel) -> list[tuple[int, int, int, int]]:
+    """Every overwrite on a channel as (target id, target type, allow, deny)"""
+    rows = []
+    for target, overwrite in channel.overwrites.items():
+        allow, deny = overwrite.pair()
+        rows.append((target.id, target_type(target), allow.value, deny.value))
+    return rows
+
+
+def restore(rows: Iterable[tuple[int, int, int, int]]) -> dict[discord.Object, PermissionOverwrite]:
+    """Turns a snapshot back into something `channel.edit(overwrites=...)` takes,
+    plain objects are used so nothing needs to be in the cache to be restored"""
+    return {
+        discord.Object(id=target_id, type=Role if kind == ROLE else discord.Member):
+            PermissionOverwrite.from_pair(Permissions(allow), Permissions(deny))
+        for target_id, kind, allow, deny in rows
+    }
+
+
+def locked(
+    channel: discord.abc.GuildChannel, moderators: bool = True
+) -> tuple[dict[Target, PermissionOverwrite], list[Role]]:
+    """The channel's overwrites with sending messages denied for every role that can
+    talk, returned along with the roles that got locked. Everything else on the
+    channel is left as it was so the lock can be applied in a single edit"""
+    overwrites = dict(channel.overwrites)
+    roles = []
+    for role in channel.guild.roles:
+        if not role.permissions.send_messages:
+            continue
+        if moderators and is_moderator_role(role):
+            # Moderators can talk here to help with damage control
+            continue
+        overwrite = overwrites.get(role) or PermissionOverwrite()
+        overwrite.update(send_messages=False)
+        overwrites[role] = overwrite
+        roles.append(role)
+    return overwrites, roles
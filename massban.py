@@ -0,0 +1,162 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+import discord
+from discord import Guild
+
+from executor import ModerationExecutor, Priority
+from taskmaster import amap
+
+# Discord's bulk-ban endpoint won't take more than this many ids at once
+BULK_BAN_LIMIT = 200
+
+
+def chunked(ids: Sequence[int], size: int = BULK_BAN_LIMIT):
+    for i in range(0, len(ids), size):
+        yield ids[i : i + size]
+
+
+class MassBan:
+    """Bans a large list of discord ids using the bulk-ban endpoint in chunks of 200,
+    falling back to concurrent single bans when bulk banning isn't allowed. Server
+    errors and 429s on a chunk are retried rather than giving up on bulk bans.
+    Progress is reported by editing a single message rather than sending one per ban"""
+
+    def __init__(
+        self,
+        guild: Guild,
+        ids: Sequence[int],
+        reason: Optional[str] = None,
+        concurrency: int = 8,
+        progress: Optional[discord.Message] = None,
+        report_interval: float = 3.0,
+        actions: Optional[ModerationExecutor] = None,
+        on_chunk: Optional[Callable[["MassBan"], Awaitable[Any]]] = None,
+    ) -> None:
+        self.guild = guild
+        # Anything sliceable works here, including the numpy arrays coming out of ingest
+        self.ids = ids
+        self.reason = reason
+        self.concurrency = concurrency
+        self.progress = progress
+        self.report_interval = report_interval
+        self.actions = actions
+        self.on_chunk = on_chunk
+        """Called after every chunk, jobs checkpoint from here"""
+
+        self.banned = 0
+        self.failed = 0
+        self.skipped = 0
+        self.banned_ids: list[int] = []
+        self.use_bulk = True
+        self.bulk_retries = 3
+        """How often a bulk ban is retried on a 5xx or 429 before the chunk goes one by one"""
+        self.retry_delay = 1.0
+        self._started = 0.0
+        self._last_report = 0.0
+
+    @property
+    def done(self) -> int:
+        return self.banned + self.failed + self.skipped
+
+    @property
+    def rate(self) -> float:
+        """Bans handled per second"""
+        elapsed = time.monotonic() - self._started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Massban {'finished' if self.done >= len(self.ids) else 'in progress'}: "
+            f"{self.done}/{len(self.ids)} | banned: {self.banned} | failed: {self.failed} "
+            f"| skipped: {self.skipped} | {self.rate:.1f} ids/s"
+        )
+
+    async def report(self, force: bool = False):
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if force or now - self._last_report >= self.report_interval:
+            self._last_report = now
+            try:
+                await self.progress.edit(content=self.summary())
+            except discord.HTTPException:
+                pass
+
+    def is_protected(self, user_id: int) -> bool:
+        """Moderators should never be caught up in a massban"""
+        if member := self.guild.get_member(user_id):
+            perms = member.guild_permissions
+            return perms.ban_members or perms.kick_members
+        return False
+
+    async def _ban_one(self, user_id: int) -> Optional[int]:
+        try:
+            user = discord.Object(id=user_id)
+            if self.actions:
+                await self.actions.ban(self.guild, user, priority=Priority.RAID, reason=self.reason)
+            else:
+                await self.guild.ban(user, reason=self.reason)
+            return user_id
+        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+            return None
+
+    async def _bulk_ban(self, chunk: Sequence[int]) -> bool:
+        """Bans the chunk with one bulk request, False when it has to go one by one instead"""
+        users = [discord.Object(id=i) for i in chunk]
+        for attempt in range(self.bulk_retries + 1):
+            try:
+                if self.actions:
+                    result = await self.actions.bulk_ban(self.guild, users, reason=self.reason)
+                else:
+                    result = await self.guild.bulk_ban(users, reason=self.reason)
+            except discord.RateLimited as e:
+                delay = e.retry_after
+            except discord.HTTPException as e:
+                if e.status < 500 and e.status != 429:
+                    # Bulk banning requires manage_guild on top of ban_members,
+                    # fallback to single bans for the rest of the run
+                    self.use_bulk = False
+                    return False
+                # Discord having a bad moment, worth another go before paying 200 requests
+                delay = self.retry_delay * 2**attempt
+            else:
+                self.banned += len(result.banned)
+                self.banned_ids.extend(u.id for u in result.banned)
+                self.failed += len(result.failed)
+                return True
+            if attempt < self.bulk_retries:
+                await asyncio.sleep(delay)
+        # Still failing, single bans for this chunk only, the next one tries bulk again
+        return False
+
+    async def _ban_chunk(self, chunk: Sequence[int]):
+        if self.use_bulk and await self._bulk_ban(chunk):
+            return
+
+        async for user_id in amap(self._ban_one, chunk, concurrency=self.concurrency):
+            if user_id is not None:
+                self.banned += 1
+                self.banned_ids.append(user_id)
+            else:
+                self.failed += 1
+            await self.report()
+
+    async def run(self) -> "MassBan":
+        self._started = time.monotonic()
+        for chunk in chunked(self.ids):
+            targets = []
+            for i in map(int, chunk):
+                if self.is_protected(i):
+                    self.skipped += 1
+                else:
+                    targets.append(i)
+            if targets:
+                await self._ban_chunk(targets)
+            await self.report()
+            if self.on_chunk:
+                await self.on_chunk(self)
+
+        await self.report(force=True)
+        return self
@@ -0,0 +1,272 @@
+import bisect
+import functools
+import re
+import time
+from typing import Awaitable, Callable, Optional, TypeVar, Union
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+T = TypeVar("T")
+
+# Seconds, tuned for everything from a cached DB lookup up to a rate-limited ban
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count], sum
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, *labels):
+        if (counts := self._counts.get(labels)) is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def time(self, *labels) -> "_Timer":
+        """`with histogram.time("label"):` records how long the block took"""
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts in self._counts.items():
+            total = 0
+            for le, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                bucket = 'le="%s"' % _number(le)
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, bucket)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {self._sums[labels]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {total}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from a callback, either a single number or {label values: number}"""
+
+    def __init__(
+        self, name: str, help: str, func: Callable[[], Union[float, dict[tuple, float]]], labels: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.func = func
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.func()
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, v in values.items():
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(v)}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: tuple) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Union[Counter, Histogram, Gauge]] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._metrics.get(name) or self.register(Counter(name, help, labels))
+
+    def histogram(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._metrics.get(name) or self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, func, labels: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help, func, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+EVENT_SECONDS = REGISTRY.histogram(
+    "defender_event_seconds", "Time spent in gateway event handlers", ("event",)
+)
+EVENT_ERRORS = REGISTRY.counter(
+    "defender_event_errors_total", "Gateway event handlers that raised", ("event",)
+)
+COMMAND_SECONDS = REGISTRY.histogram(
+    "defender_command_seconds", "Slash command latency from interaction creation to completion", ("command",)
+)
+COMMAND_ERRORS = REGISTRY.counter(
+    "defender_command_errors_total", "Slash commands that raised", ("command",)
+)
+DB_SECONDS = REGISTRY.histogram(
+    "defender_db_seconds", "Time spent in Defender database methods", ("method",)
+)
+TASK_SECONDS = REGISTRY.histogram(
+    "defender_task_seconds", "Time spent in Defender methods that mostly wait on discord (sweeps, prunes, ban crawls)",
+    ("method",),
+)
+FLOW_QUERIES = REGISTRY.histogram(
+    "defender_flow_queries", "SQL statements sent per unit of work (one join, one sweep...)", ("flow",),
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 50, 100),
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "defender_http_seconds", "Discord HTTP request latency per route", ("method", "route")
+)
+HTTP_RESPONSES = REGISTRY.counter(
+    "defender_http_responses_total", "Discord HTTP responses per route and status, 429s included",
+    ("method", "route", "status"),
+)
+
+
+def timed(histogram: Histogram, errors: Optional[Counter] = None, label: Optional[str] = None):
+    """Decorator that records how long a coroutine function takes, labeled by its name"""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        name = label or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors:
+                    errors.inc(name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    return decorator
+
+
+event = functools.partial(timed, EVENT_SECONDS, EVENT_ERRORS)
+"""`@metrics.event()` for gateway event handlers, goes under `@bot.event`"""
+
+db = timed(DB_SECONDS)
+"""`@metrics.db` for Defender's database methods"""
+
+task = timed(TASK_SECONDS)
+"""`@metrics.task` for methods that spend most of their time on discord HTTP, their own
+session blocks go under `DB_SECONDS.time(...)` so the database numbers stay honest"""
+
+
+# === Discord HTTP ===
+
+_SNOWFLAKE = re.compile(r"/\d{15,21}")
+_TOKEN = re.compile(r"(/(?:webhooks|interactions)/\{id\})/[^/]+")
+
+
+def route_of(url: Union[str, URL]) -> str:
+    """/api/v10/guilds/1234/bans/5678 -> /guilds/{id}/bans/{id}, keeps the label count bounded"""
+    path = URL(str(url)).path
+    path = re.sub(r"^/api/v\d+", "", path)
+    path = _SNOWFLAKE.sub("/{id}", path)
+    # Webhook and interaction tokens should never end up in a label
+    return _TOKEN.sub(r"\1/{token}", path)
+
+
+def http_trace() -> aiohttp.TraceConfig:
+    """aiohttp trace config for `Client(http_trace=...)` that times every request discord.py makes"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        route = route_of(params.url)
+        HTTP_SECONDS.observe(time.perf_counter() - ctx.start, params.method, route)
+        HTTP_RESPONSES.inc(params.method, route, params.response.status)
+
+    async def on_request_exception(session, ctx, params):
+        HTTP_RESPONSES.inc(params.method, route_of(params.url), "error")
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+class MetricsServer:
+    """Tiny aiohttp server that hands out the registry in Prometheus text format on /metrics"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100, registry: Registry = REGISTRY) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
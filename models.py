@@ -1,17 +1,41 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from typing import NamedTuple, Optional
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Iterable, NamedTuple, Optional, Sequence
 
 import discord
 from discord import Guild, Intents, Member, app_commands, Client
 # from discord.ext.commands import Bot
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncConnection, async_sessionmaker, create_async_engine
 from sqlmodel import Field, Relationship, SQLModel, select, update, delete 
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 import aiofiles
 import yaml
-from taskmaster import suppress, amap
+from taskmaster import suppress, amap, coalesce
+from scheduler import PruneScheduler
+from executor import ModerationExecutor, Priority
+from raid import RaidMonitor
+from blacklist import Blacklist
+from notify import Digest, user_line
+from screening import Policy, Screen, ScreenCache
+from unitofwork import UnitOfWork, count_queries
+from jobs import JobCancelled, JobProgress, JobQueue
+from massban import MassBan
+from recorder import EventRecorder, process_path
+import metrics
 from sqlalchemy.orm import selectinload
+import lockdown
+from sqlalchemy import ColumnElement, Index, UniqueConstraint, event, func, or_, true
+import numpy as np
+from sqlalchemy.dialects.sqlite import insert
+
+_log = logging.getLogger(__name__)
 
 
 global PRUNE_DATE, CREATION_DATE_LIMIT
@@ -45,11 +69,25 @@ class GuildModel(IDModel, table=True):
     moderator_channel: Optional[int] = None
     """Where the bot needs to report pruned users to"""
     pruned_members: list["PrunedMember"] = Relationship(back_populates="guild")
+    raid_threshold: int = 15
+    """How many joins inside `raid_window` seconds it takes to switch into raid mode"""
+    raid_window: float = 10.0
+    raid_lockdown: bool = False
+    """Lock down every text channel as soon as a raid is detected"""
+    blacklist_action: Optional[str] = None
+    """"prune" or "ban" joiners banned in any other federated guild, None keeps the guild out of the federation"""
+    screening: Optional[str] = None
+    """Join screening `Policy` as json, None screens with the bot's defaults"""
 
 
 class PrunedMember(IDModel, table=True):
     """A Member that is scheduled for pruning"""
 
+    __table_args__ = (
+        Index("ix_prunedmember_guild_id_prune_date", "guild_id", "prune_date"),
+        Index("ix_prunedmember_member_id", "member_id"),
+    )
+
     member_id: int
     """Discord Snowflake, the user could be apart of multiple \
     guilds ready to be pruned hence not being a unqiue key"""
@@ -69,6 +107,72 @@ class PrunedMember(IDModel, table=True):
 
 
 
+# === BANS ===
+
+class BannedUser(IDModel, table=True):
+    """Local copy of a guild's ban list so we don't have to crawl `guild.bans()` every time"""
+
+    __table_args__ = (UniqueConstraint("guild_id", "user_id"),)
+
+    guild_id: int = Field(index=True)
+    """Discord guild snowflake"""
+    user_id: int
+    reason: Optional[str] = None
+    banned_at: Optional[datetime] = None
+    """When we saw the ban happen, None for bans that were seeded from discord"""
+
+
+class BanIndexState(IDModel, table=True):
+    """Marks a guild's ban list as seeded so the local index can be trusted"""
+
+    guild_id: int = Field(unique=True)
+    synced_at: datetime
+
+
+# === COMMAND SYNC ===
+
+class CommandSync(IDModel, table=True):
+    """Fingerprint of the command tree last synced to a guild, restarts skip guilds where it still matches"""
+
+    guild_id: int = Field(unique=True)
+    fingerprint: str
+    synced_at: datetime
+
+
+# === JOBS ===
+
+class Job(IDModel, table=True):
+    """A long running moderation job (massban, lockdown...) checkpointed as it goes so
+    a restart picks it back up where it left off"""
+
+    guild_id: int = Field(index=True)
+    kind: str
+    """massban, ban-pruned, lockdown or unlock"""
+    state: str = Field(default="queued", index=True)
+    """queued, running, done, failed or cancelled"""
+    params: Optional[str] = None
+    """json, the reason and whatever else the kind needs"""
+    total: int = 0
+    done: int = 0
+    """Targets handled so far, anything past this is what's left after a restart"""
+    succeeded: int = 0
+    failed: int = 0
+    channel_id: Optional[int] = None
+    """Where to say it finished"""
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class JobTargets(IDModel, table=True):
+    """The ids a job works through as packed uint64s, kept apart so listing jobs stays cheap"""
+
+    job_id: int = Field(foreign_key="job.id", unique=True)
+    ids: bytes
+
+
 # ======================== LOCKDOWNS ======================== 
 
 # Inspired by EvilPauze (https://github.com/Alex1304/evilpauze) meant to lockdown and also 
@@ -92,10 +196,22 @@ class LockdownChannel(IDModel, table=True):
     reason:Optional[str] = None
     """Reason for locking down the guild's text channel"""
     roles: list["LockdownRole"] = Relationship(back_populates="channel")
+    snapshot: bool = False
+    """Whether the channel's full overwrites were saved, older lockdowns only have roles"""
+    pending: bool = False
+    """The snapshot is saved but the lock itself hasn't been confirmed yet"""
+    overwrites: list["LockdownOverwrite"] = Relationship(back_populates="channel")
 
     def add_role(self, role:discord.Role):
         self.roles.append(LockdownRole(role_id=role.id))
 
+    def add_snapshot(self, rows: Iterable[tuple[int, int, int, int]]):
+        self.snapshot = True
+        for target_id, target_type, allow, deny in rows:
+            self.overwrites.append(
+                LockdownOverwrite(target_id=target_id, target_type=target_type, allow=allow, deny=deny)
+            )
+
 
 class LockdownRole(IDModel, table=True):
     
@@ -105,6 +221,87 @@ class LockdownRole(IDModel, table=True):
     channel:Optional[LockdownChannel] = Relationship(back_populates="roles")
 
 
+class LockdownOverwrite(IDModel, table=True):
+    """One permission overwrite a channel had before it was locked down, restored as-is on unlock"""
+
+    target_id: int
+    """Role or Member snowflake"""
+    target_type: int
+    """0 for roles and 1 for members, same as discord"""
+    allow: int
+    deny: int
+    channel_id: Optional[int] = Field(default=None, foreign_key="lockdownchannel.id", index=True)
+    channel: Optional[LockdownChannel] = Relationship(back_populates="overwrites")
+
+
+
+
+# === MIGRATIONS ===
+
+# create_all() only creates tables that don't exist yet, anything added to an
+# existing table (columns, indexes) has to be listed here. Each entry is one schema
+# version and is made of SQL strings or `async def step(conn)` callables, they
+# should be safe to run on a database create_all() just made from scratch.
+MIGRATIONS: list[list] = [
+    # 1: Indexes for prune sweeps and member lookups
+    [
+        "CREATE INDEX IF NOT EXISTS ix_prunedmember_guild_id_prune_date ON prunedmember (guild_id, prune_date)",
+        "CREATE INDEX IF NOT EXISTS ix_prunedmember_member_id ON prunedmember (member_id)",
+    ],
+    # 2: Lockdowns keep a full snapshot of the channel's overwrites
+    [
+        lambda conn: add_column(conn, "lockdownchannel", "snapshot", "BOOLEAN NOT NULL DEFAULT 0"),
+    ],
+    # 3: Raid detection settings
+    [
+        lambda conn: add_column(conn, "guildmodel", "raid_threshold", "INTEGER NOT NULL DEFAULT 15"),
+        lambda conn: add_column(conn, "guildmodel", "raid_window", "FLOAT NOT NULL DEFAULT 10.0"),
+        lambda conn: add_column(conn, "guildmodel", "raid_lockdown", "BOOLEAN NOT NULL DEFAULT 0"),
+    ],
+    # 4: Federated blacklist
+    [
+        lambda conn: add_column(conn, "guildmodel", "blacklist_action", "VARCHAR"),
+    ],
+    # 5: Per-guild join screening policies
+    [
+        lambda conn: add_column(conn, "guildmodel", "screening", "VARCHAR"),
+    ],
+    # 6: Lockdowns are snapshotted before the channel is edited
+    [
+        lambda conn: add_column(conn, "lockdownchannel", "pending", "BOOLEAN NOT NULL DEFAULT 0"),
+    ],
+]
+
+
+async def add_column(conn: AsyncConnection, table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN that's skipped when create_all() already made the column"""
+    info = await conn.exec_driver_sql(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in info}:
+        await conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+async def migrate(conn: AsyncConnection):
+    """Brings the database up to date using sqlite's user_version as the schema version"""
+    version = (await conn.exec_driver_sql("PRAGMA user_version")).scalar()
+    for number, steps in enumerate(MIGRATIONS[version:], version + 1):
+        for step in steps:
+            if callable(step):
+                await step(conn)
+            else:
+                await conn.exec_driver_sql(step)
+        await conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers carry on while a sweep is writing and NORMAL sync is still
+    # crash-safe under WAL while skipping an fsync on every commit
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.close()
 
 
 class MissingPruneRole(Exception):
@@ -112,11 +309,34 @@ class MissingPruneRole(Exception):
     pass
 
 
+def is_moderator(member: Member) -> bool:
+    return member.guild_permissions.ban_members or member.guild_permissions.kick_members
 
 
-class MissingPruneRole(Exception):
-    """Owner/Admin didn't set Pruning Roles"""
-    pass
+def pruned_roles(member: Member, prune_role_id: int) -> list[discord.abc.Snowflake]:
+    """The role list a pruned member should be left with, just the prune role. Managed
+    roles (boosts, integrations) can't be taken away so those have to stay, this lets
+    the whole role list be swapped out with a single edit"""
+    return [discord.Object(id=prune_role_id)] + [
+        r for r in member.roles if r.managed and r.id != prune_role_id
+    ]
+
+
+def job_embed(job_id: int, kind: str, progress: JobProgress, took: Optional[timedelta] = None) -> discord.Embed:
+    embed = discord.Embed(title=f"Job #{job_id} {kind} {progress.state}")
+    embed.add_field(name="Progress", value=f"{progress.done}/{progress.total}")
+    embed.add_field(name="Succeeded", value=progress.succeeded)
+    embed.add_field(name="Failed", value=progress.failed)
+    if took is not None:
+        embed.add_field(name="Took", value=str(took).split(".")[0])
+    if progress.error:
+        embed.add_field(name="Error", value=progress.error[:1024], inline=False)
+    return embed
+
+
+def _channel_list(channel_ids: list[int], reason: Optional[str] = None) -> str:
+    text = f"{len(channel_ids)} channel(s): " + ", ".join(f"<#{i}>" for i in channel_ids)
+    return f"{text} ({reason})" if reason else text
 
 
 class PrunedUser(NamedTuple):
@@ -124,20 +344,148 @@ class PrunedUser(NamedTuple):
     pruned_info: PrunedMember
 
 
+class GuildModelCache:
+    """Process-local cache of `GuildModel` rows keyed by discord guild id so that
+    joins and prune sweeps don't have to hit the database for guild config"""
+
+    def __init__(self) -> None:
+        self._models: dict[int, GuildModel] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild_id: int) -> Optional[GuildModel]:
+        if (gm := self._models.get(guild_id)) is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return gm
+
+    def put(self, gm: GuildModel) -> GuildModel:
+        self._models[gm.guild_id] = gm
+        return gm
+
+    def invalidate(self, guild_id: int):
+        self._models.pop(guild_id, None)
+
+    def clear(self):
+        self._models.clear()
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
 class Defender(Client):
     def __init__(
-        self, prefix = "?", intents=Intents.all(), dbname: str = "sqlite+aiosqlite:///defender.db"
+        self, prefix = "?", intents=Intents.all(), dbname: str = "sqlite+aiosqlite:///defender.db", **options
     ) -> None:
-        super().__init__(intents=intents)
+        super().__init__(intents=intents, http_trace=metrics.http_trace(), **options)
         self.engine = create_async_engine(dbname)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine.sync_engine, "connect", _sqlite_pragmas)
         self.session = async_sessionmaker(
             self.engine, class_=AsyncSession, expire_on_commit=False
         )
+        count_queries(self.engine)
         self.tree = app_commands.CommandTree(self)
         self.command = self.tree.command
+        self.guild_cache = GuildModelCache()
+        self.prune_scheduler = PruneScheduler(self.run_due_prunes)
+        self.sweep_pruned_members = coalesce(self.ban_pruned_members)
+        """Single-flight version of `ban_pruned_members` so bursts of joins share one sweep"""
+        self.actions = ModerationExecutor()
+        """Every ban, role edit and permission overwrite is queued through here"""
+        self.raids = RaidMonitor()
+        self.raid_tasks: set[asyncio.Task] = set()
+        """Raid mode lockdowns still running, kept here so they can't be garbage collected halfway"""
+        self.process_index: Optional[int] = None
+        """Which of `python -m sharding`'s processes this is, None when running on its own"""
+        self.blacklist = Blacklist()
+        """Users banned in any guild taking part in the federation"""
+        self.blacklist_path: Optional[str] = None
+        self.blacklist_mmap = False
+        self._blacklist_cursor = 0
+        """Highest BannedUser.id the blacklist has seen, refreshes only read past it"""
+        self.prune_date = PRUNE_DATE
+        """How long pruned members have before they're banned, unless their guild's policy says otherwise"""
+        self.screens = ScreenCache(Policy(account_age=CREATION_DATE_LIMIT.total_seconds()))
+        """Compiled join screening policies per guild"""
+        self.jobs = JobQueue(self.run_job)
+        """Durable massbans, lockdowns and the like, resumed by `catch_up` after a restart"""
+        self.job_kinds: dict[str, Callable[..., Awaitable[Any]]] = {
+            "massban": self._job_massban,
+            "ban-pruned": self._job_ban_pruned,
+            "lockdown": self._job_lockdown,
+            "unlock": self._job_unlock,
+        }
+        self.digest = Digest(self.mod_channel)
+        """Prune, ban and lockdown notices for the mod channel, sent in batches"""
+        self.metrics_server: Optional[metrics.MetricsServer] = None
+        self.recorder: Optional[EventRecorder] = None
+        """Logs joins, bans and messages for offline replays when config.yaml turns it on"""
+        self._caught_up: set[Optional[int]] = set()
+        """Shards (None when not sharded) that already ran their startup catch-up"""
+        self._catch_up_locks: defaultdict[Optional[int], asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._register_gauges()
 
     
 
+    async def close(self):
+        self.jobs.stop()
+        await self.digest.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await super().close()
+
+    def owns(self, guild_id: int) -> bool:
+        """Whether this process looks after the guild, always True unless sharded"""
+        return True
+
+    def owned(self, guild_id: ColumnElement[int], shard_id: Optional[int] = None) -> ColumnElement[bool]:
+        """`owns` as a SQL filter for queries that load work for many guilds at once"""
+        return true()
+
+    def _register_gauges(self):
+        registry = metrics.REGISTRY
+        registry.gauge(
+            "defender_guild_cache", "Guild config cache size, hits and misses",
+            lambda: {(k,): v for k, v in self.guild_cache.stats().items()}, ("stat",),
+        )
+        registry.gauge(
+            "defender_moderation_queue_depth", "Moderation actions waiting per lane",
+            lambda: {(p.name.lower(),): self.actions.depth(p) for p in Priority}, ("lane",),
+        )
+        registry.gauge(
+            "defender_moderation_rate_limited", "Moderation actions that hit a 429 per lane",
+            lambda: {(p.name.lower(),): s.rate_limited for p, s in self.actions.stats.items()}, ("lane",),
+        )
+        registry.gauge(
+            "defender_sweeps", "Prune sweeps that ran and joins that piggybacked on one already running",
+            lambda: {("run",): self.sweep_pruned_members.runs, ("coalesced",): self.sweep_pruned_members.coalesced},
+            ("kind",),
+        )
+        registry.gauge("defender_scheduled_prunes", "Guilds waiting on a prune deadline", lambda: self.prune_scheduler.guilds)
+        registry.gauge("defender_blacklist_size", "Users on the federated blacklist", lambda: len(self.blacklist))
+        registry.gauge(
+            "defender_jobs", "Durable jobs running and waiting for a worker",
+            lambda: {("running",): self.jobs.running, ("pending",): self.jobs.pending}, ("state",),
+        )
+        registry.gauge(
+            "defender_digest", "Mod channel notices waiting, posted and the messages it took to send them",
+            lambda: {("pending",): self.digest.pending, ("posted",): self.digest.posted, ("sent",): self.digest.sent},
+            ("kind",),
+        )
+
+    async def mod_channel(self, guild_id: int) -> Optional[discord.abc.GuildChannel]:
+        if not (guild := self.get_guild(guild_id)):
+            return None
+        gm = await self.get_guild_model(guild_id)
+        return guild.get_channel(gm.moderator_channel) if gm.moderator_channel else None
+
     async def sync_guild(self, id:int):
         """Syncs a guild-id to the enabled servers the bot is allowed to be in"""
         # You should configure these manually as a safety-mechanism...
@@ -145,41 +493,137 @@ class Defender(Client):
         self.tree.copy_global_to(guild=guildObject)
         return await self.tree.sync(guild=guildObject)
 
-
+    def command_fingerprint(self, id: int) -> str:
+        """Hash of exactly what `tree.sync` would upload to a guild"""
+        payload = sorted(
+            (c.to_dict(self.tree) for c in self.tree.get_commands(guild=discord.Object(id=id))),
+            key=lambda c: (c.get("type", 1), c["name"]),
+        )
+        blob = json.dumps([self.application_id, payload], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    async def sync_guilds(self, ids: Iterable[int], concurrency: int = 4, force: bool = False) -> list[int]:
+        """Syncs the command tree to every guild whose last synced fingerprint doesn't
+        match, a few at a time. Returns the guild ids that actually got synced"""
+        ids = list(ids)
+        for i in ids:
+            self.tree.copy_global_to(guild=discord.Object(id=i))
+        wanted = {i: self.command_fingerprint(i) for i in ids}
+        stored = {} if force else await self.get_command_fingerprints(ids)
+        stale = [i for i, fp in wanted.items() if stored.get(i) != fp]
+
+        async def sync(guild_id: int) -> Optional[int]:
+            try:
+                await self.sync_guild(guild_id)
+            except discord.HTTPException as e:
+                # Leave the old fingerprint so the next startup tries again
+                _log.warning("Couldn't sync commands to guild %s: %s", guild_id, e)
+                return None
+            return guild_id
+
+        synced = [i async for i in amap(sync, stale, concurrency=concurrency) if i is not None]
+        await self.save_command_fingerprints({i: wanted[i] for i in synced})
+        _log.info("Commands synced to %d guild(s), %d already up to date", len(synced), len(ids) - len(stale))
+        return synced
 
     async def setup_hook(self):
         
         async with aiofiles.open("config.yaml", "r") as cfg:
             data:dict[str] = yaml.safe_load(await cfg.read())
 
-        for i in data["discordServerIds"]:
-            await self.sync_guild(i)
-            
-        # SETUP GLOBALS UNLESS DEFAULTS ARE GIVEN...
-        # TODO:
-        # if data.get("prune-time"):
-        #     PRUNE_DATE = timedelta(**data["prune-time"])
-        # if data.get("creation-date-limit"):
-        #     CREATION_DATE_LIMIT = timedelta(**data["creation-date-limit"])
+        # Needed before on_ready now that command fingerprints live in the database
+        await self.init_db()
+        cfg = data.get("blacklist") or {}
+        self.blacklist_path = cfg.get("path")
+        self.blacklist_mmap = cfg.get("mmap", False)
+        await self.load_blacklist()
+        await self.sync_guilds(
+            [i for i in data["discordServerIds"] if self.owns(i)], force=data.get("forceCommandSync", False)
+        )
+
+        if path := (data.get("recorder") or {}).get("path"):
+            self.recorder = EventRecorder(process_path(path, self.process_index))
+
+        if (cfg := data.get("metrics") or {}).get("enabled"):
+            # Shard processes can't all bind the same port, each takes the one after the last
+            port = cfg.get("port", 9100) + (self.process_index or 0)
+            self.metrics_server = metrics.MetricsServer(cfg.get("host", "127.0.0.1"), port)
+            await self.metrics_server.start()
+
+        # Defaults for guilds that haven't set up a screening policy of their own
+        if data.get("prune-time"):
+            self.prune_date = timedelta(**data["prune-time"])
+        if data.get("creation-date-limit"):
+            self.screens.default = Policy(account_age=timedelta(**data["creation-date-limit"]).total_seconds())
 
 
     
+    @metrics.db
     async def init_db(self):
         async with self.engine.begin() as e:
             await e.run_sync(IDModel.metadata.create_all)
+            await migrate(e)
 
-    async def get_guild_model(self, guild_id: int) -> GuildModel:
+    @metrics.db
+    async def get_command_fingerprints(self, guild_ids: Iterable[int]) -> dict[int, str]:
+        async with self.session() as s:
+            scalar = await s.exec(
+                select(CommandSync.guild_id, CommandSync.fingerprint).where(CommandSync.guild_id.in_(list(guild_ids)))
+            )
+            return dict(scalar.all())
+
+    @metrics.db
+    async def save_command_fingerprints(self, fingerprints: dict[int, str]):
+        if not fingerprints:
+            return
+        now = datetime.now()
+        stmt = insert(CommandSync).values(
+            [{"guild_id": i, "fingerprint": fp, "synced_at": now} for i, fp in fingerprints.items()]
+        )
+        async with self.session() as s:
+            await s.exec(
+                stmt.on_conflict_do_update(
+                    index_elements=["guild_id"],
+                    set_={"fingerprint": stmt.excluded.fingerprint, "synced_at": stmt.excluded.synced_at},
+                )
+            )
+            await s.commit()
+
+    @metrics.db
+    async def warm_guild_cache(self, shard_id: Optional[int] = None):
+        """Loads every guild model in one query so joins don't need to touch the database"""
         async with self.session() as session:
-            scalar = await session.exec(
+            scalar = await session.exec(select(GuildModel).where(self.owned(GuildModel.guild_id, shard_id)))
+            for gm in scalar:
+                self.guild_cache.put(gm)
+
+    def unit_of_work(self, name: str) -> UnitOfWork:
+        """A session for a whole flow, pass it down to every data access method the flow calls"""
+        return UnitOfWork(self.session(), name)
+
+    def work(self, uow: Optional[UnitOfWork], name: str) -> AsyncContextManager[UnitOfWork]:
+        """The caller's unit of work, or a short one of our own that commits straight away"""
+        return nullcontext(uow) if uow else self.unit_of_work(name)
+
+    @metrics.db
+    async def get_guild_model(self, guild_id: int, uow: Optional[UnitOfWork] = None) -> GuildModel:
+        if guild := self.guild_cache.get(guild_id):
+            return guild
+
+        async with self.work(uow, "get_guild_model") as w:
+            scalar = await w.session.exec(
                 select(GuildModel).where(GuildModel.guild_id == guild_id)
             )
-            guild = scalar.one_or_none()
-            if not guild:
-                guild = await session.merge(GuildModel(guild_id=guild_id))
-                await session.commit()
-
+            if guild := scalar.one_or_none():
+                return self.guild_cache.put(guild)
+            guild = GuildModel(guild_id=guild_id)
+            w.session.add(guild)
+            # Not cached until it's actually in the database, later lookups in the
+            # same flow find it through autoflush
+            w.after_commit(lambda: self.guild_cache.put(guild))
         return guild
 
+    @metrics.db
     async def update_guild_prune_role(self, prune_role_id: int, guild_id: int):
         """Update current guild's prune role"""
         async with self.session() as session:
@@ -189,8 +633,17 @@ class Defender(Client):
                 .values(prune_role_id=prune_role_id)
             )
             await session.commit()
-        return await self.get_guild_model(guild_id)
+        self.guild_cache.invalidate(guild_id)
+        return self._configured(await self.get_guild_model(guild_id))
+
+    def _configured(self, gm: GuildModel) -> GuildModel:
+        # Sweeps skip guilds without a prune role and mod channel, anything that went
+        # overdue in the meantime gets picked up as soon as both are set
+        if gm.moderator_channel and gm.prune_role_id:
+            self.prune_scheduler.schedule(gm.guild_id, datetime.now())
+        return gm
 
+    @metrics.db
     async def update_guild_mod_channel(self, moderator_channel_id: int, guild_id: int):
         """Update current guild's prune role"""
         async with self.session() as session:
@@ -200,8 +653,59 @@ class Defender(Client):
                 .values(moderator_channel=moderator_channel_id)
             )
             await session.commit()
+        self.guild_cache.invalidate(guild_id)
+        return self._configured(await self.get_guild_model(guild_id))
+
+    @metrics.task
+    async def update_guild_blacklist_action(self, guild: Guild, action: Optional[str]):
+        """Joins or leaves the federation, a guild joining shares its whole ban list"""
+        was = (await self.get_guild_model(guild.id)).blacklist_action
+        with metrics.DB_SECONDS.time("update_guild_blacklist_action"):
+            async with self.session() as session:
+                await session.exec(
+                    update(GuildModel).where(GuildModel.guild_id == guild.id).values(blacklist_action=action)
+                )
+                await session.commit()
+        self.guild_cache.invalidate(guild.id)
+        if action and not was:
+            self.blacklist.add(await self.get_guild_bans(guild))
+        elif was and not action:
+            # Only a rebuild knows which of its bans nobody else in the federation has
+            await self.load_blacklist()
+        return await self.get_guild_model(guild.id)
+
+    @metrics.db
+    async def update_guild_screening(self, guild_id: int, policy: Optional[Policy]) -> Screen:
+        """Stores a guild's screening policy, None goes back to the defaults. Raises re.error for a bad name pattern"""
+        source = policy.to_json() if policy else None
+        # Compiling first means a broken pattern never makes it into the database
+        screen = self.screens.get(guild_id, source)
+        async with self.session() as session:
+            await session.exec(update(GuildModel).where(GuildModel.guild_id == guild_id).values(screening=source))
+            await session.commit()
+        self.guild_cache.invalidate(guild_id)
+        return screen
+
+    def screen_for(self, gm: GuildModel) -> Screen:
+        return self.screens.get(gm.guild_id, gm.screening)
+
+    def prune_delay(self, gm: GuildModel) -> timedelta:
+        return self.screen_for(gm).prune_after or self.prune_date
+
+    @metrics.db
+    async def update_guild_raid_settings(self, guild_id: int, threshold: int, window: float, lockdown: bool):
+        """Update current guild's raid detection settings"""
+        async with self.session() as session:
+            await session.exec(
+                update(GuildModel)
+                .where(GuildModel.guild_id == guild_id)
+                .values(raid_threshold=threshold, raid_window=window, raid_lockdown=lockdown)
+            )
+            await session.commit()
+        self.guild_cache.invalidate(guild_id)
         return await self.get_guild_model(guild_id)
 
+    @metrics.db
     async def get_pruned_member(self, snowflake: int, guild_id: int):
         async with self.session() as session:
             scalar = await session.exec(
@@ -217,24 +721,182 @@ class Defender(Client):
             member = guild.get_member(pinfo.member_id)
         return PrunedUser(member, pinfo)
 
-    async def prune_member(self, member: Member, reason: str = "Suspicious account"):
+    @metrics.task
+    async def prune_member(
+        self, member: Member, reason: str = "Suspicious account", uow: Optional[UnitOfWork] = None
+    ):
         """Applies pruned role to an existing member and will be awaiting execution/ban"""
-        guildmodel = await self.get_guild_model(member.guild.id)
-        await member.add_roles(guildmodel.prune_role_id, reason=reason)
+        guildmodel = await self.get_guild_model(member.guild.id, uow)
+        await self.actions.edit_member(member, roles=pruned_roles(member, guildmodel.prune_role_id), reason=reason)
+
+        pm = PrunedMember(
+            member_id=member.id,
+            prune_date=datetime.now() + self.prune_delay(guildmodel),
+            guild_id=member.guild.id,
+            reason=reason,
+        )
+        with metrics.DB_SECONDS.time("prune_member"):
+            async with self.work(uow, "prune_member") as w:
+                w.session.add(pm)
+                w.after_commit(lambda: self.prune_scheduler.schedule(pm.guild_id, pm.prune_date))
+        self.digest.post(member.guild.id, "prune", user_line(member, reason))
+        return pm
 
+    @metrics.db
+    async def get_pruned_ids(self, guild_id: int) -> set[int]:
         async with self.session() as s:
-            pm = await s.merge(
-                PrunedMember(
-                    member_id=member.id,
-                    prune_date=datetime.now() + PRUNE_DATE,
-                    guild_id=member.guild.id,
-                    reason=reason,
-                )
+            scalar = await s.exec(select(PrunedMember.member_id).where(PrunedMember.guild_id == guild_id))
+            return set(scalar.all())
+
+    async def prune_members(
+        self,
+        guild: Guild,
+        members: Sequence[Member],
+        reason: str = "Suspicious account",
+        chunksize: int = 500,
+        concurrency: int = 8,
+        progress: Optional[Callable[[int], Awaitable[Any]]] = None,
+        progress_every: float = 5.0,
+    ) -> int:
+        """Prunes many members at once, roles are handed out concurrently and the
+        pruned rows go in one bulk insert per chunk. `progress` is called at most once
+        every `progress_every` seconds. Returns how many were pruned"""
+        gm = await self.get_guild_model(guild.id)
+        already = await self.get_pruned_ids(guild.id)
+        members = [m for m in members if m.id not in already and not is_moderator(m)]
+        deadline = datetime.now() + self.prune_delay(gm)
+
+        async def prune(member: Member) -> int:
+            await self.actions.edit_member(member, roles=pruned_roles(member, gm.prune_role_id), reason=reason)
+            self.digest.post(guild.id, "prune", user_line(member, reason))
+            return member.id
+
+        done = 0
+        reported = time.monotonic()
+        for i in range(0, len(members), chunksize):
+            pruned = []
+            async for m in amap(prune, members[i : i + chunksize], concurrency=concurrency, errors="skip"):
+                pruned.append(m)
+                # A chunk can take minutes once the role edits are rate limited, so this
+                # goes by the clock instead of waiting for the chunk to finish
+                if progress and time.monotonic() - reported >= progress_every:
+                    reported = time.monotonic()
+                    await progress(done + len(pruned))
+            if pruned:
+                async with self.session() as s:
+                    await s.exec(
+                        insert(PrunedMember).values(
+                            [{"member_id": m, "prune_date": deadline, "guild_id": guild.id, "reason": reason} for m in pruned]
+                        )
+                    )
+                    await s.commit()
+            done += len(pruned)
+
+        if done:
+            self.prune_scheduler.schedule(guild.id, deadline)
+        return done
+
+    @metrics.db
+    async def get_overdue_guilds(self, shard_id: Optional[int] = None) -> list[int]:
+        """Guilds with at least one prune past its deadline, one grouped query for all of them"""
+        async with self.session() as s:
+            scalar = await s.exec(
+                select(PrunedMember.guild_id)
+                .where(PrunedMember.prune_date <= datetime.now())
+                .where(self.owned(PrunedMember.guild_id, shard_id))
+                .group_by(PrunedMember.guild_id)
             )
-            await s.commit()
+            return list(scalar.all())
+
+    async def catch_up(self, concurrency: int = 8, shard_id: Optional[int] = None) -> bool:
+        """Startup work that only needs to happen once per process: warming the guild
+        cache, sweeping guilds that went overdue while we were offline and starting the
+        prune scheduler. on_ready fires on every reconnect so after the first successful
+        run this returns False straight away. Sharded bots run it once per shard"""
+        async with self._catch_up_locks[shard_id]:
+            if shard_id in self._caught_up:
+                return False
+            started = time.monotonic()
+            await self.warm_guild_cache(shard_id)
+            overdue = await self.get_overdue_guilds(shard_id)
+
+            async def sweep(guild_id: int):
+                try:
+                    await self.run_due_prunes(guild_id)
+                except Exception:
+                    # One broken guild shouldn't hold up everyone else's catch-up
+                    _log.exception("Startup sweep failed for guild %s", guild_id)
+
+            await amap(sweep, overdue, concurrency=concurrency)
+            # Everything overdue was just swept, the scheduler handles the rest on time
+            await self.load_prune_schedule(shard_id)
+            self.prune_scheduler.start()
+            await self.resume_jobs(shard_id)
+            self._caught_up.add(shard_id)
+            _log.info(
+                "Caught up on %d overdue guild(s)%s in %.2fs", len(overdue),
+                "" if shard_id is None else f" on shard {shard_id}", time.monotonic() - started,
+            )
+            return True
 
-        return pm
+    @metrics.db
+    async def load_prune_schedule(self, shard_id: Optional[int] = None):
+        """Loads every pending prune deadline into the scheduler in one query"""
+        async with self.session() as s:
+            scalar = await s.exec(
+                select(PrunedMember.prune_date, PrunedMember.guild_id).where(self.owned(PrunedMember.guild_id, shard_id))
+            )
+            self.prune_scheduler.load(scalar.all())
+
+    async def run_due_prunes(self, guild_id: int) -> bool:
+        """Scheduler callback for when a guild's prune deadline is met, True when
+        due rows are left over and the scheduler should try again later"""
+        if not self.get_guild(guild_id):
+            # Not in the guild anymore or another process owns it, nothing we can ban
+            return False
+        gm = await self.get_guild_model(guild_id)
+        if not (gm.moderator_channel and gm.prune_role_id):
+            # Retrying can't help until an admin finishes /requirements, which schedules a sweep
+            return False
+        return await self.sweep_pruned_members(guild_id)
+
+    async def _ban_pruned(self, guild: Guild, rows: list[tuple[int, int]]) -> list[int]:
+        """Bans (row id, member id) pairs and returns the row ids that can be deleted"""
+        reason = "Pruned For Suspicous Join/Behavior"
+        banned = []
+
+        async def ban(row_id: int, member_id: int) -> Optional[int]:
+            try:
+                # byebye asshole
+                await self.actions.ban(guild, discord.Object(id=member_id), reason=reason)
+                banned.append(member_id)
+                self.digest.post(guild.id, "ban", user_line(discord.Object(id=member_id)))
+            except discord.NotFound:
+                # Account is gone, nothing left to ban
+                pass
+            except (discord.Forbidden, discord.HTTPException):
+                # Keep the row around so the next sweep can try again
+                return None
+            return row_id
+
+        row_ids, member_ids = zip(*rows) if rows else ((), ())
+        done = [i async for i in amap(ban, row_ids, member_ids, concurrency=8) if i is not None]
+        # Don't leave it to on_member_ban, the federation should know about these right away
+        if banned:
+            await self.record_bans(guild.id, banned, reason=reason, banned_at=datetime.now())
+        return done
+
+    @metrics.db
+    async def delete_pruned_rows(self, row_ids: list[int], chunksize: int = 500):
+        """Deletes pruned rows in bulk, all inside a single transaction"""
+        if not row_ids:
+            return
+        async with self.session() as s:
+            for i in range(0, len(row_ids), chunksize):
+                await s.exec(delete(PrunedMember).where(PrunedMember.id.in_(row_ids[i : i + chunksize])))
+            await s.commit()
 
+    @metrics.task
     async def ban_pruned_members(self, guild_id: int):
         """Bans all members in a guild when the given deadline is met"""
         guild = self.get_guild(guild_id)
@@ -243,20 +905,22 @@ class Defender(Client):
         
         assert channel, "This command requires A Moderation channel"
 
-        async with self.session() as s:
-            scalar = await s.exec(
-                select(PrunedMember)
-                .where(PrunedMember.guild_id == guild_id)
-                .where(PrunedMember.prune_date < datetime.now())
-            )
-            for user in scalar:
-                async with suppress(discord.NotFound, discord.Forbidden, discord.HTTPException):
-                    # byebye asshole
-                    await guild.ban(user.member_id, reason="Pruned For Suspicous Join/Behavior")
-                    await s.delete(user)
-                    await s.commit()
+        with metrics.DB_SECONDS.time("ban_pruned_members"):
+            async with self.session() as s:
+                scalar = await s.exec(
+                    select(PrunedMember.id, PrunedMember.member_id)
+                    .where(PrunedMember.guild_id == guild_id)
+                    .where(PrunedMember.prune_date <= datetime.now())
+                )
+                rows = scalar.all()
+
+        done = await self._ban_pruned(guild, rows)
+        await self.delete_pruned_rows(done)
+        # Failed bans keep their rows, tell the scheduler to come back for them
+        return len(done) < len(rows)
 
 
+    @metrics.db
     async def ban_all_pruned_members(self, guild_id:int):
         """Bans all members in a guild whithout the deadline"""
         guild = self.get_guild(guild_id)
@@ -265,46 +929,408 @@ class Defender(Client):
 
         assert channel, "This command requires A Moderation channel"
 
+        async with self.session() as s:
+            scalar = await s.exec(select(PrunedMember.id).where(PrunedMember.guild_id == guild_id))
+            row_ids = scalar.all()
+
+        # Could be thousands of bans, run it as a job so a restart doesn't start over
+        return await self.submit_job(guild_id, "ban-pruned", row_ids)
+
+    # === JOBS ===
+
+    @metrics.db
+    async def create_job(
+        self, guild_id: int, kind: str, ids: Iterable[int], params: Optional[dict] = None, channel_id: Optional[int] = None
+    ) -> Job:
+        ids = np.asarray(ids, dtype=np.uint64)
+        async with self.session() as s:
+            job = Job(
+                guild_id=guild_id, kind=kind, params=json.dumps(params) if params else None,
+                total=len(ids), channel_id=channel_id, created_at=datetime.now(),
+            )
+            s.add(job)
+            await s.flush()
+            s.add(JobTargets(job_id=job.id, ids=ids.tobytes()))
+            await s.commit()
+        return job
+
+    async def submit_job(
+        self, guild_id: int, kind: str, ids: Iterable[int], params: Optional[dict] = None, channel_id: Optional[int] = None
+    ) -> Job:
+        """Saves a job and queues it, it's durable from here on"""
+        job = await self.create_job(guild_id, kind, ids, params, channel_id)
+        self.jobs.submit(JobProgress(job.id, guild_id, kind, job.total))
+        return job
+
+    @metrics.db
+    async def get_job(self, job_id: int) -> Optional[Job]:
+        async with self.session() as s:
+            return await s.get(Job, job_id)
+
+    @metrics.db
+    async def get_job_targets(self, job_id: int) -> np.ndarray:
+        async with self.session() as s:
+            scalar = await s.exec(select(JobTargets.ids).where(JobTargets.job_id == job_id))
+            return np.frombuffer(scalar.one(), dtype=np.uint64)
+
+    @metrics.db
+    async def get_guild_jobs(self, guild_id: int, limit: int = 10) -> list[Job]:
+        async with self.session() as s:
+            scalar = await s.exec(select(Job).where(Job.guild_id == guild_id).order_by(Job.id.desc()).limit(limit))
+            return list(scalar.all())
+
+    @metrics.db
+    async def update_job(self, job_id: int, **values):
+        async with self.session() as s:
+            await s.exec(update(Job).where(Job.id == job_id).values(updated_at=datetime.now(), **values))
+            await s.commit()
+
+    @metrics.db
+    async def resume_jobs(self, shard_id: Optional[int] = None):
+        """Queues every job that was still queued or running when the last process stopped"""
         async with self.session() as s:
             scalar = await s.exec(
-                select(PrunedMember)
-                .where(PrunedMember.guild_id == guild_id)
+                select(Job)
+                .where(Job.state.in_(["queued", "running"]))
+                .where(self.owned(Job.guild_id, shard_id))
+                .order_by(Job.id)
             )
-            for user in scalar:
-                async with suppress(discord.NotFound, discord.Forbidden, discord.HTTPException):
-                    if member := guild.get_member(user.member_id):
-                        # Byebye asshole...
-                        try:
-                            await member.ban(reason="Pruned For Suspicous Join/Behavior")
-                        except:
-                            await s.delete(user)
-                            await s.commit()
-                    else:
-                        await guild.ban(user.member_id, reason="Pruned For Suspicous Join/Behavior")
-                        await s.delete(user)
-                        await s.commit()
-
-
-    async def check_member(self, member:Member):
-        if member.created_at > (datetime.now() - CREATION_DATE_LIMIT):  
-            await self.prune_member(member)
-            guild = self.get_guild(member.guild.id)
-            gm = await self.get_guild_model(guild)
-            await guild.get_channel(gm.moderator_channel).send(f"Pruned Member named:{member.name}    DeveloperID: {member.id}")
+            jobs = scalar.all()
+        for job in jobs:
+            progress = JobProgress(job.id, job.guild_id, job.kind, job.total, job.done)
+            progress.succeeded, progress.failed = job.succeeded, job.failed
+            self.jobs.submit(progress)
+        self.jobs.start()
+        if jobs:
+            _log.info("Resumed %d job(s)", len(jobs))
+
+    async def run_job(self, progress: JobProgress):
+        """JobQueue callback, hands whatever targets are left to the job's kind and
+        checkpoints the row every time it reports a batch as done"""
+        job = await self.get_job(progress.job_id)
+        guild = self.get_guild(job.guild_id)
+        started = datetime.now()
+        await self.update_job(job.id, state="running", started_at=job.started_at or started)
+
+        async def checkpoint(done: int, succeeded: int = 0, failed: int = 0):
+            progress.done += done
+            progress.succeeded += succeeded
+            progress.failed += failed
+            await self.update_job(
+                job.id, done=progress.done, succeeded=progress.succeeded, failed=progress.failed
+            )
+            if progress.cancelled:
+                raise JobCancelled
+
+        try:
+            if progress.cancelled:
+                raise JobCancelled
+            if not guild:
+                raise RuntimeError("The bot isn't in this server anymore")
+            targets = (await self.get_job_targets(job.id))[job.done :]
+            params = json.loads(job.params) if job.params else {}
+            await self.job_kinds[job.kind](guild, targets, params, checkpoint)
+            progress.state = "done"
+        except JobCancelled:
+            progress.state = "cancelled"
+        except Exception as e:
+            _log.exception("Job %s (%s) failed for guild %s", job.id, job.kind, job.guild_id)
+            progress.state, progress.error = "failed", str(e)
+        await self.update_job(job.id, state=progress.state, error=progress.error, finished_at=datetime.now())
+
+        if guild and job.channel_id and (channel := guild.get_channel(job.channel_id)):
+            async with suppress(discord.Forbidden, discord.HTTPException):
+                await channel.send(embed=job_embed(job.id, job.kind, progress, datetime.now() - started))
+
+    async def _job_massban(self, guild: Guild, ids: np.ndarray, params: dict, checkpoint):
+        reason = params.get("reason")
+        seen = {"done": 0, "banned": 0, "failed": 0}
+
+        async def on_chunk(mb: MassBan):
+            banned = mb.banned_ids[seen["banned"] :]
+            # Into the ban index as we go so a resumed job never has to crawl guild.bans() again
+            if banned:
+                await self.record_bans(guild.id, banned, reason=reason, banned_at=datetime.now())
+            await checkpoint(mb.done - seen["done"], len(banned), mb.failed - seen["failed"])
+            seen.update(done=mb.done, banned=len(mb.banned_ids), failed=mb.failed)
+
+        await MassBan(guild, ids, reason=reason, actions=self.actions, on_chunk=on_chunk).run()
+
+    async def _job_ban_pruned(self, guild: Guild, row_ids: np.ndarray, params: dict, checkpoint, batch: int = 500):
+        for i in range(0, len(row_ids), batch):
+            chunk = [int(r) for r in row_ids[i : i + batch]]
+            async with self.session() as s:
+                scalar = await s.exec(
+                    select(PrunedMember.id, PrunedMember.member_id).where(PrunedMember.id.in_(chunk))
+                )
+                rows = scalar.all()
+            done = await self._ban_pruned(guild, rows)
+            await self.delete_pruned_rows(done)
+            # Rows that were already gone were banned by a sweep or pardoned in the meantime
+            await checkpoint(len(chunk), len(done), len(rows) - len(done))
+
+    async def _job_lockdown(self, guild: Guild, channel_ids: np.ndarray, params: dict, checkpoint, batch: int = 100):
+        for i in range(0, len(channel_ids), batch):
+            chunk = channel_ids[i : i + batch]
+            channels = [c for c in map(guild.get_channel, map(int, chunk)) if c]
+            locked = await self.lock_channels(
+                guild, channels, moderators=params.get("moderators", True), reason=params.get("reason")
+            )
+            await checkpoint(len(chunk), len(locked), len(chunk) - len(locked))
+
+    async def _job_unlock(self, guild: Guild, channel_ids: np.ndarray, params: dict, checkpoint, batch: int = 100):
+        for i in range(0, len(channel_ids), batch):
+            chunk = [int(c) for c in channel_ids[i : i + batch]]
+            unlocked = await self.unlock_channels(guild, chunk)
+            await checkpoint(len(chunk), unlocked, len(chunk) - unlocked)
+
+    async def check_member(self, member: Member, gm: GuildModel, uow: Optional[UnitOfWork] = None) -> Optional[str]:
+        """Screens a new member with their guild's policy and prunes them if anything trips,
+        returns the reason they were pruned"""
+        screen = self.screen_for(gm)
+        # The join rate is the only rule input that isn't on the member, skip it when nothing uses it
+        if reason := screen(member, self.raids.rate(gm.guild_id) if screen.needs_rate else 0):
+            # prune_member posts it to the mod channel's digest
+            await self.prune_member(member, reason=reason, uow=uow)
+        return reason
     
+    def begin_raid_mode(self, guild: Guild, gm: GuildModel) -> asyncio.Task:
+        """Runs `start_raid_mode` in the background so the join that tripped it isn't held up"""
+        task = asyncio.create_task(self.start_raid_mode(guild, gm))
+        self.raid_tasks.add(task)
+        task.add_done_callback(self._raid_mode_done)
+        return task
+
+    def _raid_mode_done(self, task: asyncio.Task):
+        self.raid_tasks.discard(task)
+        if not task.cancelled() and (e := task.exception()):
+            _log.error("Starting raid mode failed", exc_info=e)
+
+    async def start_raid_mode(self, guild: Guild, gm: GuildModel):
+        """Called once when a guild tips over its join threshold"""
+        # Urgent so the mods hear about it now, the prunes that follow get batched up behind it
+        self.digest.post(
+            guild.id, "raid",
+            f"{gm.raid_threshold} joins within {gm.raid_window:g}s, every new member is being pruned"
+            + (" and the server is being locked down" if gm.raid_lockdown else ""),
+            urgent=True,
+        )
+        if gm.raid_lockdown:
+            # Same durable job /lockdown uses so a restart mid-raid picks the lockdown back up
+            await self.submit_job(
+                guild.id, "lockdown", [c.id for c in guild.text_channels], {"moderators": True, "reason": "Raid detected"}
+            )
+
+    # === BAN INDEX ===
+
+    @metrics.db
+    async def is_ban_index_seeded(self, guild_id: int) -> bool:
+        async with self.session() as s:
+            scalar = await s.exec(select(BanIndexState).where(BanIndexState.guild_id == guild_id))
+            return scalar.one_or_none() is not None
+
+    @metrics.db
+    async def record_bans(
+        self, guild_id: int, user_ids: Iterable[int], reason: Optional[str] = None,
+        banned_at: Optional[datetime] = None, chunksize: int = 500,
+    ):
+        """Adds bans to the local index, bans that are already there are left alone"""
+        rows = [
+            {"guild_id": guild_id, "user_id": uid, "reason": reason, "banned_at": banned_at}
+            for uid in user_ids
+        ]
+        async with self.session() as s:
+            await self._insert_bans(s, rows, chunksize)
+            await s.commit()
+        if (await self.get_guild_model(guild_id)).blacklist_action:
+            self.blacklist.add(r["user_id"] for r in rows)
+
+    async def _insert_bans(self, s: AsyncSession, rows: list[dict], chunksize: int = 500):
+        for i in range(0, len(rows), chunksize):
+            await s.exec(insert(BannedUser).values(rows[i : i + chunksize]).on_conflict_do_nothing())
+
+    @metrics.db
+    async def record_unban(self, guild_id: int, user_id: int):
+        async with self.session() as s:
+            await s.exec(
+                delete(BannedUser)
+                .where(BannedUser.guild_id == guild_id)
+                .where(BannedUser.user_id == user_id)
+            )
+            await s.commit()
+        if (await self.get_guild_model(guild_id)).blacklist_action:
+            await self._unblacklist([user_id])
+
+    @metrics.task
+    async def reconcile_ban_index(self, guild: Guild):
+        """Crawls the guild's full ban list once and brings the local index in line with it,
+        this is how a guild gets seeded and is re-run every so often to catch anything missed"""
+        # A big ban list takes a while to crawl, anything on_member_ban records in the
+        # meantime can be missing from it and mustn't be mistaken for a lifted ban
+        started = datetime.now()
+        remote: dict[int, Optional[str]] = {}
+        async for entry in guild.bans(limit=None):
+            remote[entry.user.id] = entry.reason
+
+        local = await self.get_banned_ids(guild.id, before=started)
+        stale = list(local - remote.keys())
+        rows = [
+            {"guild_id": guild.id, "user_id": uid, "reason": remote[uid], "banned_at": None}
+            for uid in remote.keys() - local
+        ]
+        with metrics.DB_SECONDS.time("reconcile_ban_index"):
+            async with self.session() as s:
+                for i in range(0, len(stale), 500):
+                    await s.exec(
+                        delete(BannedUser)
+                        .where(BannedUser.guild_id == guild.id)
+                        .where(BannedUser.user_id.in_(stale[i : i + 500]))
+                        .where(self._banned_before(started))
+                    )
+                await self._insert_bans(s, rows)
+                state = await s.exec(select(BanIndexState).where(BanIndexState.guild_id == guild.id))
+                if st := state.one_or_none():
+                    st.synced_at = datetime.now()
+                    s.add(st)
+                else:
+                    s.add(BanIndexState(guild_id=guild.id, synced_at=datetime.now()))
+                await s.commit()
+        if (await self.get_guild_model(guild.id)).blacklist_action:
+            self.blacklist.add(r["user_id"] for r in rows)
+            await self._unblacklist(stale)
+
+    @staticmethod
+    def _banned_before(when: datetime) -> ColumnElement[bool]:
+        # Seeded rows have no banned_at and are always older
+        return or_(BannedUser.banned_at.is_(None), BannedUser.banned_at < when)
+
+    @metrics.db
+    async def get_banned_ids(self, guild_id: int, before: Optional[datetime] = None) -> set[int]:
+        """Banned user ids from the local index, only ones recorded before `before` if given"""
+        query = select(BannedUser.user_id).where(BannedUser.guild_id == guild_id)
+        if before is not None:
+            query = query.where(self._banned_before(before))
+        async with self.session() as s:
+            scalar = await s.exec(query)
+            return set(scalar.all())
+
+    async def iter_bans(self, guild_id: int, chunksize: int = 5000) -> AsyncIterator[list[BannedUser]]:
+        """Yields a guild's indexed bans in chunks so large ban lists never sit in memory at once"""
+        last_id = 0
+        while True:
+            async with self.session() as s:
+                scalar = await s.exec(
+                    select(BannedUser)
+                    .where(BannedUser.guild_id == guild_id)
+                    .where(BannedUser.id > last_id)
+                    .order_by(BannedUser.id)
+                    .limit(chunksize)
+                )
+                chunk = scalar.all()
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1].id
+
+    @metrics.task
+    async def get_guild_bans(self, guild: Guild) -> set[int]:
+        """Banned user ids for a guild, seeding the index from discord the first time"""
+        if not await self.is_ban_index_seeded(guild.id):
+            await self.reconcile_ban_index(guild)
+        return await self.get_banned_ids(guild.id)
+
+    @metrics.db
+    async def seeded_ban_guilds(self) -> list[int]:
+        async with self.session() as s:
+            scalar = await s.exec(select(BanIndexState.guild_id))
+            return list(scalar.all())
+
+    # === FEDERATED BLACKLIST ===
+
+    def _federated_bans(self, *columns):
+        """Bans from every guild in the federation, just the user ids unless `columns` are given"""
+        return (
+            select(*(columns or (BannedUser.user_id,)))
+            .join(GuildModel, GuildModel.guild_id == BannedUser.guild_id)
+            .where(GuildModel.blacklist_action.is_not(None))
+        )
+
+    @metrics.db
+    async def load_blacklist(self):
+        """Rebuilds the blacklist from every federated guild's bans. When a path is
+        configured it's written there and memory-mapped back so shard processes
+        share the pages instead of each holding their own copy"""
+        async with self.session() as s:
+            cursor = (await s.exec(select(func.max(BannedUser.id)))).one() or 0
+            scalar = await s.exec(self._federated_bans().where(BannedUser.id <= cursor))
+            ids = np.fromiter(scalar, dtype=np.uint64)
+        blacklist = Blacklist(ids)
+        if self.blacklist_path:
+            blacklist.save(self.blacklist_path)
+            blacklist = Blacklist.load(self.blacklist_path, mmap=self.blacklist_mmap)
+        self.blacklist, self._blacklist_cursor = blacklist, cursor
+
+    @metrics.db
+    async def refresh_blacklist(self):
+        """Picks up bans recorded since the last load or refresh, including ones
+        recorded by other processes sharing the database"""
+        async with self.session() as s:
+            scalar = await s.exec(
+                self._federated_bans(BannedUser.user_id, BannedUser.id)
+                .where(BannedUser.id > self._blacklist_cursor)
+                .order_by(BannedUser.id)
+            )
+            rows = scalar.all()
+        if rows:
+            self.blacklist.add(user_id for user_id, _ in rows)
+            self._blacklist_cursor = rows[-1][1]
+
+    async def _unblacklist(self, user_ids: list[int]):
+        """Takes unbanned users off the blacklist unless another federated guild still bans them"""
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i : i + 500]
+            async with self.session() as s:
+                scalar = await s.exec(self._federated_bans().where(BannedUser.user_id.in_(chunk)))
+                still = set(scalar.all())
+            for user_id in chunk:
+                if user_id not in still:
+                    self.blacklist.discard(user_id)
+
+    async def enforce_blacklist(self, member: Member, gm: GuildModel, uow: Optional[UnitOfWork] = None) -> bool:
+        """Prunes or bans a joining member that's banned elsewhere in the federation,
+        returns True when the member was on the blacklist and got dealt with"""
+        if not gm.blacklist_action or member.id not in self.blacklist or is_moderator(member):
+            return False
+        reason = "Banned in another federated server"
+        if gm.blacklist_action == "ban":
+            async with suppress(discord.Forbidden, discord.HTTPException):
+                await self.actions.ban(member.guild, member, priority=Priority.RAID, reason=reason)
+                self.digest.post(member.guild.id, "ban", user_line(member, reason))
+            return True
+        if gm.prune_role_id:
+            async with suppress(discord.Forbidden, discord.HTTPException):
+                await self.prune_member(member, reason=reason, uow=uow)
+            return True
+        return False
+
+    @metrics.db
     async def remove_guild_model(self, guild:Guild):
         """Removes Guild and Pruned memebers scheduled for ban"""
         async with self.session() as s:
-            await s.exec(delete(GuildModel).where(GuildModel.id == guild.id))
+            await s.exec(delete(GuildModel).where(GuildModel.guild_id == guild.id))
             await s.commit()
+        self.guild_cache.invalidate(guild.id)
     
+    @metrics.db
     async def create_guild_model(self, guild:Guild):
         """Creates a New guild Model"""
         async with self.session() as s:
-            await s.merge(GuildModel(guild_id=guild.id))
+            gm = await s.merge(GuildModel(guild_id=guild.id))
             await s.commit()
+        return self.guild_cache.put(gm)
     
 
+    @metrics.db
     async def create_lockdown(self, guild:Guild, channel:discord.TextChannel):
         """Simillar to `EvilPauze` This will essentially create a lock for locking down and unlocking roles/settings from..."""
         async with self.session() as s:
@@ -312,6 +1338,7 @@ class Defender(Client):
             await s.commit()
         return ldc
     
+    @metrics.db
     async def get_lockdown(self, guild:Guild, channel:discord.TextChannel):
         async with self.session() as s:
             scalar = await s.exec(
@@ -323,25 +1350,108 @@ class Defender(Client):
         return ld_channel
 
 
+    @metrics.db
     async def update_lockdown_role(self, ldc:LockdownChannel):
         async with self.session() as s:
             await s.merge(ldc)
             await s.commit()
 
-    async def remove_lockdown(self, guild:Guild, channel:discord.TextChannel):
+    @metrics.db
+    async def get_guild_lockdowns(self, guild_id: int, channel_ids: Optional[Iterable[int]] = None) -> list[LockdownChannel]:
         async with self.session() as s:
-            scalar = await s.exec(
+            query = (
                 select(LockdownChannel)
-                .where(LockdownChannel.guild_id == guild.id)
-                .where(LockdownChannel.channel_id == channel.id)
+                .where(LockdownChannel.guild_id == guild_id)
                 # selectinload is the important part otherwise no roles will be loaded and an error is thrown.
-                .options(selectinload(LockdownChannel.roles))
+                .options(selectinload(LockdownChannel.roles), selectinload(LockdownChannel.overwrites))
             )
-            ldc = scalar.one_or_none()
-
-            for role in ldc.roles:
-                if dsc_role := guild.get_role(role.role_id):
-                    await channel.set_permissions(dsc_role, send_messages=True)
-            await s.delete(ldc)
+            if channel_ids is not None:
+                query = query.where(LockdownChannel.channel_id.in_(list(channel_ids)))
+            scalar = await s.exec(query)
+            return list(scalar.all())
+
+    async def lock_channels(
+        self,
+        guild: Guild,
+        channels: Iterable[discord.abc.GuildChannel],
+        moderators: bool = True,
+        reason: Optional[str] = None,
+        concurrency: int = 16,
+    ) -> list[LockdownChannel]:
+        """Locks many channels at once, one overwrites edit per channel, after snapshotting
+        every overwrite they had. Channels that are already locked are left alone"""
+        existing = {ld.channel_id: ld for ld in await self.get_guild_lockdowns(guild.id)}
+        # The snapshot is saved before the channel is touched so a crash half way through
+        # can never save the locked overwrites as the "original". Rows stay pending until
+        # their edit went through, a pending row keeps its snapshot and just gets locked again
+        targets = [c for c in channels if c.id not in existing or existing[c.id].pending]
+        fresh = []
+        for channel in targets:
+            if channel.id not in existing:
+                ldc = LockdownChannel(
+                    channel_id=channel.id, guild_id=guild.id, reason=reason, date=datetime.now(), pending=True
+                )
+                ldc.add_snapshot(lockdown.snapshot(channel))
+                fresh.append(ldc)
+        if fresh:
+            async with self.session() as s:
+                s.add_all(fresh)
+                await s.commit()
+            existing.update((ld.channel_id, ld) for ld in fresh)
+
+        async def lock(channel: discord.abc.GuildChannel) -> tuple[LockdownChannel, list[LockdownRole]]:
+            ldc = existing[channel.id]
+            overwrites, roles = lockdown.locked(channel, moderators)
+            await self.actions.edit_channel(channel, priority=Priority.RAID, overwrites=overwrites, reason=reason)
+            ldc.pending = False
+            # Only the role rows are new, the channel and its snapshot are already saved
+            return ldc, [LockdownRole(role_id=role.id, channel_id=ldc.id) for role in roles]
+
+        results = [r async for r in amap(lock, targets, concurrency=concurrency, errors="skip")]
+        locked = [ldc for ldc, _ in results]
+        async with self.session() as s:
+            for i in range(0, len(locked), 500):
+                chunk = [ld.id for ld in locked[i : i + 500]]
+                await s.exec(update(LockdownChannel).where(LockdownChannel.id.in_(chunk)).values(pending=False))
+            s.add_all([role for _, roles in results for role in roles])
+            await s.commit()
+        if locked:
+            self.digest.post(guild.id, "lockdown", _channel_list([ld.channel_id for ld in locked], reason))
+        return locked
+
+    async def unlock_channels(
+        self, guild: Guild, channel_ids: Optional[Iterable[int]] = None, concurrency: int = 16
+    ) -> int:
+        """Puts every locked channel (or just the given ones) back exactly how it was, returns how many were unlocked"""
+        lockdowns = await self.get_guild_lockdowns(guild.id, channel_ids)
+
+        async def unlock(ldc: LockdownChannel) -> int:
+            if channel := guild.get_channel(ldc.channel_id):
+                if ldc.snapshot:
+                    rows = [(o.target_id, o.target_type, o.allow, o.deny) for o in ldc.overwrites]
+                    await self.actions.edit_channel(
+                        channel, priority=Priority.CLEANUP, overwrites=lockdown.restore(rows)
+                    )
+                else:
+                    # Lockdowns from before snapshots existed only know which roles were locked
+                    for role in ldc.roles:
+                        if dsc_role := guild.get_role(role.role_id):
+                            await self.actions.set_permissions(channel, dsc_role, priority=Priority.CLEANUP, send_messages=True)
+            return ldc.id
+
+        done = [i async for i in amap(unlock, lockdowns, concurrency=concurrency, errors="skip")]
+        async with self.session() as s:
+            for i in range(0, len(done), 500):
+                chunk = done[i : i + 500]
+                await s.exec(delete(LockdownRole).where(LockdownRole.channel_id.in_(chunk)))
+                await s.exec(delete(LockdownOverwrite).where(LockdownOverwrite.channel_id.in_(chunk)))
+                await s.exec(delete(LockdownChannel).where(LockdownChannel.id.in_(chunk)))
             await s.commit()
+        if done:
+            unlocked = {ld.id: ld.channel_id for ld in lockdowns}
+            self.digest.post(guild.id, "unlock", _channel_list([unlocked[i] for i in done]))
+        return len(done)
+
+    async def remove_lockdown(self, guild:Guild, channel:discord.TextChannel):
+        return await self.unlock_channels(guild, [channel.id])
             
@@ -0,0 +1,135 @@
+import asyncio
+import io
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+_log = logging.getLogger(__name__)
+
+# Discord caps an embed at 25 fields and 6000 characters all told, bigger batches go
+# out as a file instead
+MAX_FIELDS = 25
+MAX_EMBED_CHARS = 6000
+
+LABELS = {
+    "raid": "Raid",
+    "prune": "Pruned",
+    "ban": "Banned",
+    "lockdown": "Locked",
+    "unlock": "Unlocked",
+}
+
+
+@dataclass
+class Notice:
+    kind: str
+    """One of `LABELS`"""
+    text: str
+    at: datetime = field(default_factory=discord.utils.utcnow)
+
+
+def user_line(user: discord.abc.Snowflake, reason: Optional[str] = None) -> str:
+    name = getattr(user, "name", None)
+    line = f"<@{user.id}> ({name}, `{user.id}`)" if name else f"<@{user.id}> (`{user.id}`)"
+    return f"{line}: {reason}" if reason else line
+
+
+def render(notices: list[Notice]) -> tuple[discord.Embed, Optional[discord.File]]:
+    """A field per notice when they fit, otherwise a summary with the full list attached"""
+    counts = Counter(n.kind for n in notices)
+    embed = discord.Embed(
+        title="Moderation Digest",
+        description=" | ".join(f"{LABELS.get(k, k)}: {c}" for k, c in counts.items()),
+        colour=discord.Colour.red() if "raid" in counts else discord.Colour.orange(),
+        timestamp=notices[-1].at,
+    )
+    fields = [
+        (f"{LABELS.get(n.kind, n.kind)} {discord.utils.format_dt(n.at, 'T')}", n.text[:1024]) for n in notices
+    ]
+    # len(embed) is what discord holds against the 6000, title and description included
+    if len(fields) <= MAX_FIELDS and len(embed) + sum(len(k) + len(v) for k, v in fields) <= MAX_EMBED_CHARS:
+        for name, value in fields:
+            embed.add_field(name=name, value=value, inline=False)
+        return embed, None
+
+    embed.set_footer(text=f"{len(notices)} events, full list attached")
+    # Raid notices are the ones the mods need to see without opening the file, as many as fit
+    for n in (n for n in notices if n.kind == "raid"):
+        value = n.text[:1024]
+        if len(embed.fields) == MAX_FIELDS or len(embed) + len(LABELS["raid"]) + len(value) > MAX_EMBED_CHARS:
+            break
+        embed.add_field(name=LABELS["raid"], value=value, inline=False)
+    lines = "\n".join(f"{n.at:%Y-%m-%d %H:%M:%S} {n.kind.upper():<8} {n.text}" for n in notices)
+    return embed, discord.File(io.BytesIO(lines.encode()), filename=f"digest-{notices[0].at:%Y%m%d-%H%M%S}.txt")
+
+
+class Digest:
+    """Buffers moderation notices per guild and posts them to the mod channel in
+    batches instead of one message each. A batch goes out `window` seconds after
+    its first notice, as soon as it reaches `max_batch` or straight away for urgent
+    notices like a raid being detected"""
+
+    def __init__(
+        self,
+        channel: Callable[[int], Awaitable[Optional[discord.abc.Messageable]]],
+        window: float = 5.0,
+        max_batch: int = 1000,
+    ) -> None:
+        self._channel = channel
+        self.window = window
+        self.max_batch = max_batch
+        self._buffers: defaultdict[int, list[Notice]] = defaultdict(list)
+        self._timers: dict[int, asyncio.Task] = {}
+        self.posted = 0
+        self.sent = 0
+        """Messages it took to deliver `posted` notices"""
+
+    @property
+    def pending(self) -> int:
+        return sum(len(b) for b in self._buffers.values())
+
+    def post(self, guild_id: int, kind: str, text: str, urgent: bool = False):
+        self._buffers[guild_id].append(Notice(kind, text))
+        self.posted += 1
+        if urgent or len(self._buffers[guild_id]) >= self.max_batch:
+            self._flush_in(guild_id, 0)
+        elif guild_id not in self._timers:
+            self._flush_in(guild_id, self.window)
+
+    def _flush_in(self, guild_id: int, delay: float):
+        if timer := self._timers.pop(guild_id, None):
+            timer.cancel()
+        self._timers[guild_id] = asyncio.create_task(self._flush_later(guild_id, delay))
+
+    async def _flush_later(self, guild_id: int, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        # Anything posted from here on starts a new window
+        self._timers.pop(guild_id, None)
+        await self.flush(guild_id)
+
+    async def flush(self, guild_id: int):
+        if not (notices := self._buffers.pop(guild_id, None)):
+            return
+        if not (channel := await self._channel(guild_id)):
+            return
+        embed, file = render(notices)
+        try:
+            if file:
+                await channel.send(embed=embed, file=file)
+            else:
+                await channel.send(embed=embed)
+            self.sent += 1
+        except discord.HTTPException:
+            _log.exception("Couldn't post a digest of %d notices for guild %s", len(notices), guild_id)
+
+    async def close(self):
+        """Sends whatever is still buffered, used on shutdown"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        await asyncio.gather(*(self.flush(g) for g in list(self._buffers)))
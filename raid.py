@@ -0,0 +1,71 @@
+import time
+from typing import NamedTuple, Optional
+
+
+class JoinRateDetector:
+    """Fixed-size ring buffer of the last `threshold` join timestamps, a raid is
+    when all of them landed inside `window` seconds. Recording a join is O(1)"""
+
+    def __init__(self, threshold: int, window: float) -> None:
+        self.threshold = max(threshold, 1)
+        self.window = window
+        self._ring = [float("-inf")] * self.threshold
+        self._head = 0
+        self.joins = 0
+
+    def record(self, now: Optional[float] = None) -> bool:
+        """Records a join and returns True when the threshold is crossed"""
+        now = time.monotonic() if now is None else now
+        self._ring[self._head] = now
+        self._head = (self._head + 1) % self.threshold
+        self.joins += 1
+        # The slot we'll overwrite next holds the oldest of the last `threshold` joins
+        return now - self._ring[self._head] <= self.window
+
+    def rate(self, now: Optional[float] = None) -> int:
+        """How many of the recorded joins happened within the last window"""
+        now = time.monotonic() if now is None else now
+        return sum(1 for t in self._ring if now - t <= self.window)
+
+
+class RaidState(NamedTuple):
+    active: bool
+    """The guild is in raid mode and every new joiner should be pruned"""
+    started: bool
+    """This join is the one that tipped the guild into raid mode"""
+
+
+class RaidMonitor:
+    """Per-guild join-rate detectors and raid mode, raid mode lasts until `cooldown`
+    seconds pass without the threshold being crossed again"""
+
+    def __init__(self, cooldown: float = 120.0) -> None:
+        self.cooldown = cooldown
+        self._detectors: dict[int, JoinRateDetector] = {}
+        self._raid_until: dict[int, float] = {}
+
+    def detector(self, guild_id: int, threshold: int, window: float) -> JoinRateDetector:
+        d = self._detectors.get(guild_id)
+        if d is None or d.threshold != threshold or d.window != window:
+            # Settings changed, start over with a fresh buffer
+            d = self._detectors[guild_id] = JoinRateDetector(threshold, window)
+        return d
+
+    def is_active(self, guild_id: int, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self._raid_until.get(guild_id, 0.0) > now
+
+    def record_join(self, guild_id: int, threshold: int, window: float, now: Optional[float] = None) -> RaidState:
+        now = time.monotonic() if now is None else now
+        was_active = self.is_active(guild_id, now)
+        if self.detector(guild_id, threshold, window).record(now):
+            self._raid_until[guild_id] = now + self.cooldown
+            return RaidState(True, not was_active)
+        return RaidState(was_active, False)
+
+    def end(self, guild_id: int):
+        self._raid_until.pop(guild_id, None)
+
+    def rate(self, guild_id: int) -> int:
+        d = self._detectors.get(guild_id)
+        return d.rate() if d else 0
@@ -0,0 +1,92 @@
+"""Gateway event log for replaying real joins and raids offline, see benchmarks/replay.py.
+One compact json object per line, gzipped when the path ends in .gz. Only what screening
+and raid detection look at is kept, never message content
+
+    {"t":1718000000.123,"e":"join","g":GUILD,"u":USER,"n":"name","a":1,"b":0}
+    {"t":1718000003.5,"e":"ban","g":GUILD,"u":USER}
+    {"t":1718000004.0,"e":"msg","g":GUILD,"c":CHANNEL,"u":USER,"l":42,"m":0,"x":0}
+"""
+import gzip
+import json
+import os
+import time
+from typing import IO, Iterator, Optional, Union
+
+import discord
+
+_dumps = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8", buffering=1 << 16)
+
+
+def process_path(path: str, index: Optional[int]) -> str:
+    """Where one of several shard processes logs to, they can't share a file without
+    interleaving half flushed lines and gzip members. events.jsonl.gz is
+    events.1.jsonl.gz for process 1, and unchanged for a bot running on its own"""
+    if index is None:
+        return path
+    head, tail = os.path.split(path)
+    stem, dot, ext = tail.partition(".")
+    return os.path.join(head, f"{stem}.{index}{dot}{ext}")
+
+
+class EventRecorder:
+    """Appends events to the log, writes are buffered and go out every `flush_every`
+    events (and on close) so a busy gateway doesn't cost a syscall per event"""
+
+    def __init__(self, path: str, flush_every: int = 256) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self.events = 0
+        self._file = _open(path, "a")
+
+    def _write(self, record: dict):
+        self._file.write(_dumps(record) + "\n")
+        self.events += 1
+        if self.events % self.flush_every == 0:
+            self._file.flush()
+
+    def join(self, member: discord.Member):
+        self._write({
+            "t": round(time.time(), 3), "e": "join", "g": member.guild.id, "u": member.id, "n": member.name,
+            "a": int(member.avatar is not None), "b": int(member.bot),
+        })
+
+    def ban(self, guild: discord.Guild, user: Union[discord.User, discord.Member]):
+        self._write({"t": round(time.time(), 3), "e": "ban", "g": guild.id, "u": user.id})
+
+    def unban(self, guild: discord.Guild, user: discord.User):
+        self._write({"t": round(time.time(), 3), "e": "unban", "g": guild.id, "u": user.id})
+
+    def message(self, message: discord.Message):
+        self._write({
+            "t": round(time.time(), 3), "e": "msg", "g": message.guild.id, "c": message.channel.id,
+            "u": message.author.id, "l": len(message.content), "m": len(message.mentions),
+            "x": len(message.attachments),
+        })
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_events(path: str) -> Iterator[dict]:
+    """Reads a log back in the order it was written, blank or cut off lines are skipped
+    and a gzipped log that ends early stops at the last complete line"""
+    with _open(path, "r") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a log from a process that got killed can be half written
+                    continue
+        except (EOFError, gzip.BadGzipFile):
+            # Killed before gzip wrote its trailer, everything up to here is still good
+            return
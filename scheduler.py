@@ -0,0 +1,116 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+_log = logging.getLogger(__name__)
+
+
+class PruneScheduler:
+    """Min-heap of `PrunedMember.prune_date` deadlines that sleeps until the
+    very next one is due instead of polling every guild on a timer.
+
+    The callback returns True when the guild still has due rows it couldn't deal with
+    (a ban that failed...), raising counts the same. Those guilds are pushed back with
+    a doubling delay so nothing due is ever forgotten. Up to `concurrency` guilds are
+    swept at once so one slow guild doesn't hold up everyone else's deadlines"""
+
+    def __init__(
+        self,
+        callback: Callable[[int], Awaitable[Any]],
+        retry_base: timedelta = timedelta(minutes=1),
+        retry_max: timedelta = timedelta(hours=1),
+        concurrency: int = 8,
+    ) -> None:
+        self._callback = callback
+        self._heap: list[tuple[datetime, int]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._failures: dict[int, int] = {}
+        """Sweeps in a row that left rows behind, by guild"""
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._sweeps: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        """Deadlines in the heap, one per pruned member"""
+        return len(self._heap)
+
+    @property
+    def guilds(self) -> int:
+        """Guilds with at least one deadline waiting"""
+        return len({guild_id for _, guild_id in self._heap})
+
+    @property
+    def next_deadline(self) -> Optional[datetime]:
+        return self._heap[0][0] if self._heap else None
+
+    def schedule(self, guild_id: int, deadline: datetime):
+        """Schedules a prune sweep for a guild at the given deadline"""
+        heapq.heappush(self._heap, (deadline, guild_id))
+        # Only wake up the runner if this is now the earliest deadline
+        if self._heap[0] == (deadline, guild_id):
+            self._wakeup.set()
+
+    def load(self, deadlines: Iterable[tuple[datetime, int]]):
+        """Bulk loads (deadline, guild_id) pairs, used once at startup"""
+        self._heap.extend(deadlines)
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in self._sweeps:
+            task.cancel()
+
+    def _pop_due(self, now: datetime) -> set[int]:
+        due = set()
+        while self._heap and self._heap[0][0] <= now:
+            due.add(heapq.heappop(self._heap)[1])
+        return due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = (self._heap[0][0] - datetime.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for guild_id in self._pop_due(datetime.now()):
+                task = asyncio.create_task(self._sweep(guild_id))
+                self._sweeps.add(task)
+                task.add_done_callback(self._sweeps.discard)
+
+    async def _sweep(self, guild_id: int):
+        async with self._semaphore:
+            try:
+                retry = await self._callback(guild_id)
+            except Exception:
+                _log.exception("Prune sweep failed for guild %s", guild_id)
+                retry = True
+        if retry:
+            self._retry(guild_id)
+        else:
+            self._failures.pop(guild_id, None)
+
+    def _retry(self, guild_id: int):
+        failures = self._failures[guild_id] = self._failures.get(guild_id, 0) + 1
+        delay = min(self.retry_base * 2 ** (failures - 1), self.retry_max)
+        _log.warning("Guild %s still has due prunes, retrying in %s", guild_id, delay)
+        self.schedule(guild_id, datetime.now() + delay)
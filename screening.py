@@ -0,0 +1,160 @@
+"""Per-guild join screening. A guild's `Policy` is stored as json on its GuildModel and
+compiled once into a `Screen`, a flat tuple of closures that's checked cheapest rule
+first and stops at the first one that trips. Screens are cached per guild and only
+recompiled when the stored policy changes"""
+import json
+import re
+import time
+import unicodedata
+from dataclasses import asdict, dataclass, field
+from datetime import timedelta
+from typing import Callable, Optional
+
+import discord
+
+from ingest import DISCORD_EPOCH
+
+Rule = Callable[[discord.Member, int], bool]
+"""Takes the joining member and the guild's current join rate, True means flag them"""
+
+# One translate table that drops ascii punctuation and folds the characters people swap
+# in to dodge name filters, "m0d_t3am" reads as "modteam"
+_FOLD = {i: None for i in range(128) if not chr(i).isalnum()}
+_FOLD.update(str.maketrans("013457@$|!", "oleastasii"))
+
+
+def skeleton(name: str) -> str:
+    """Lowercase, accents and lookalike digits folded, anything but letters and digits dropped"""
+    if not name.isascii():
+        # Most names are plain ascii and skip this, "Çalloc" becomes "Calloc"
+        name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return name.lower().translate(_FOLD)
+
+
+@dataclass(frozen=True)
+class Policy:
+    account_age: Optional[float] = None
+    """Seconds, accounts younger than this get pruned"""
+    default_avatar: bool = False
+    name_pattern: Optional[str] = None
+    """Regex matched against the username and display name"""
+    similar_names: tuple[str, ...] = ()
+    """Names joiners shouldn't be passing themselves off as (staff, the server's own name...)"""
+    max_join_rate: Optional[int] = None
+    """Prune anyone joining while more than this many joined inside the raid window. Only
+    means something below the raid threshold, the join rate isn't tracked past it and
+    raid mode prunes everyone from there on anyway"""
+    prune_after: Optional[float] = None
+    """Seconds before a pruned member is banned, None uses the bot's default"""
+
+    @classmethod
+    def from_json(cls, data: Optional[str]) -> Optional["Policy"]:
+        if not data:
+            return None
+        raw = json.loads(data)
+        raw["similar_names"] = tuple(raw.get("similar_names", ()))
+        # Ignore anything a newer version stored that we don't know about
+        return cls(**{k: v for k, v in raw.items() if k in cls.__dataclass_fields__})
+
+    def to_json(self) -> str:
+        return json.dumps({k: v for k, v in asdict(self).items() if v not in (None, False, ())})
+
+    def describe(self) -> dict[str, str]:
+        return {
+            "Account Age": f"younger than {timedelta(seconds=self.account_age)}" if self.account_age else "Off",
+            "Default Avatar": "On" if self.default_avatar else "Off",
+            "Name Pattern": f"`{self.name_pattern}`" if self.name_pattern else "Off",
+            "Similar Names": ", ".join(self.similar_names) or "Off",
+            "Join Velocity": f"over {self.max_join_rate} joins" if self.max_join_rate else "Off",
+        }
+
+
+@dataclass(frozen=True)
+class Screen:
+    """A compiled policy, call it with a member to get the reason they should be pruned"""
+
+    rules: tuple[tuple[Rule, str], ...]
+    prune_after: Optional[timedelta] = None
+    needs_rate: bool = False
+    """Whether the caller has to pass the guild's join rate in"""
+    policy: Policy = field(default_factory=Policy)
+
+    def __call__(self, member: discord.Member, rate: int = 0) -> Optional[str]:
+        for rule, reason in self.rules:
+            if rule(member, rate):
+                return reason
+        return None
+
+
+def compile_policy(policy: Policy) -> Screen:
+    """Raises re.error for a bad name pattern"""
+    rules: list[tuple[Rule, str]] = []
+
+    if policy.account_age:
+        # Creation time is in the snowflake, shift the cutoff once here so each join is
+        # a shift and a compare without building any datetimes
+        offset = policy.account_age * 1000 + DISCORD_EPOCH
+        rules.append((lambda m, _: (m.id >> 22) > time.time() * 1000 - offset, "Account is too new"))
+
+    if policy.default_avatar:
+        rules.append((lambda m, _: m.avatar is None, "Default avatar"))
+
+    if limit := policy.max_join_rate:
+        rules.append((lambda _, rate: rate > limit, "Joined during a burst of joins"))
+
+    if policy.name_pattern:
+        search = re.compile(policy.name_pattern, re.IGNORECASE).search
+        rules.append((lambda m, _: bool(search(m.name) or search(m.display_name)), "Name matches the screening pattern"))
+
+    if names := [s for n in policy.similar_names if (s := skeleton(n))]:
+        # One alternation over the folded names, longest first so the regex engine can't stop short
+        search = re.compile("|".join(map(re.escape, sorted(names, key=len, reverse=True)))).search
+
+        def similar(m: discord.Member, _: int) -> bool:
+            # display_name is usually just the username, don't fold it twice
+            return bool(search(skeleton(m.name)) or (m.display_name != m.name and search(skeleton(m.display_name))))
+
+        rules.append((similar, "Impersonating a protected name"))
+
+    return Screen(
+        tuple(rules),
+        prune_after=timedelta(seconds=policy.prune_after) if policy.prune_after else None,
+        needs_rate=bool(policy.max_join_rate),
+        policy=policy,
+    )
+
+
+class ScreenCache:
+    """Compiled screens per guild, keyed on the policy json they were built from so an
+    updated GuildModel recompiles on its next join and an unchanged one never does"""
+
+    def __init__(self, default: Policy) -> None:
+        self._screens: dict[int, tuple[Optional[str], Screen]] = {}
+        self.default = default
+        self.compiles = 0
+
+    @property
+    def default(self) -> Policy:
+        return self._default.policy
+
+    @default.setter
+    def default(self, policy: Policy):
+        """Guilds without a policy of their own use this one"""
+        self._default = compile_policy(policy)
+
+    def get(self, guild_id: int, source: Optional[str]) -> Screen:
+        if not source:
+            return self._default
+        cached = self._screens.get(guild_id)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+        screen = compile_policy(Policy.from_json(source))
+        self._screens[guild_id] = (source, screen)
+        self.compiles += 1
+        return screen
+
+    def invalidate(self, guild_id: int):
+        self._screens.pop(guild_id, None)
+
+    def __len__(self) -> int:
+        return len(self._screens)
@@ -0,0 +1,259 @@
+"""Sharded Defender: guild config caches, prune schedulers and raid detectors are kept
+per shard and a process only loads work for the guilds on its own shards. Shards can
+be spread over several processes that share the same database
+
+    python -m sharding --processes 2
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import yaml
+from discord import AutoShardedClient, Intents
+from sqlalchemy import ColumnElement
+
+from models import Defender, GuildModel, GuildModelCache
+from raid import JoinRateDetector, RaidMonitor, RaidState
+from scheduler import PruneScheduler
+
+_log = logging.getLogger(__name__)
+
+SHARD_IDS_ENV = "DEFENDER_SHARD_IDS"
+"""Comma separated shard ids for this process, set by the launcher and wins over config.yaml"""
+
+PROCESS_INDEX_ENV = "DEFENDER_PROCESS_INDEX"
+"""Position of this process among the ones the launcher started, anything that can't be
+shared between them (the metrics port...) is offset by it"""
+
+
+def shard_for(guild_id: int, shard_count: int) -> int:
+    """Same formula discord uses to decide which shard a guild is on"""
+    return (guild_id >> 22) % shard_count
+
+
+class ShardedGuildCache:
+    """`GuildModelCache` split up per shard, same interface so Defender doesn't need to know"""
+
+    def __init__(self, shard_count: int) -> None:
+        self.shard_count = shard_count
+        self.shards: defaultdict[int, GuildModelCache] = defaultdict(GuildModelCache)
+
+    def shard(self, guild_id: int) -> GuildModelCache:
+        return self.shards[shard_for(guild_id, self.shard_count)]
+
+    def get(self, guild_id: int) -> Optional[GuildModel]:
+        return self.shard(guild_id).get(guild_id)
+
+    def put(self, gm: GuildModel) -> GuildModel:
+        return self.shard(gm.guild_id).put(gm)
+
+    def invalidate(self, guild_id: int):
+        self.shard(guild_id).invalidate(guild_id)
+
+    def clear(self):
+        for cache in self.shards.values():
+            cache.clear()
+
+    def __len__(self) -> int:
+        return sum(len(c) for c in self.shards.values())
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self),
+            "hits": sum(c.hits for c in self.shards.values()),
+            "misses": sum(c.misses for c in self.shards.values()),
+        }
+
+
+class ShardedScheduler:
+    """One `PruneScheduler` per shard so a slow sweep on one shard never holds up
+    deadlines on another"""
+
+    def __init__(self, callback: Callable[[int], Awaitable[Any]], shard_count: int) -> None:
+        self._callback = callback
+        self.shard_count = shard_count
+        self.shards: dict[int, PruneScheduler] = {}
+        self._started = False
+
+    def shard(self, guild_id: int) -> PruneScheduler:
+        i = shard_for(guild_id, self.shard_count)
+        if not (scheduler := self.shards.get(i)):
+            scheduler = self.shards[i] = PruneScheduler(self._callback)
+            if self._started:
+                scheduler.start()
+        return scheduler
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self.shards.values())
+
+    @property
+    def next_deadline(self) -> Optional[datetime]:
+        return min((d for s in self.shards.values() if (d := s.next_deadline)), default=None)
+
+    def schedule(self, guild_id: int, deadline: datetime):
+        self.shard(guild_id).schedule(guild_id, deadline)
+
+    def load(self, deadlines: Iterable[tuple[datetime, int]]):
+        per_shard: defaultdict[int, list[tuple[datetime, int]]] = defaultdict(list)
+        for deadline, guild_id in deadlines:
+            per_shard[shard_for(guild_id, self.shard_count)].append((deadline, guild_id))
+        for rows in per_shard.values():
+            self.shard(rows[0][1]).load(rows)
+
+    def start(self):
+        self._started = True
+        for scheduler in self.shards.values():
+            scheduler.start()
+
+    def stop(self):
+        self._started = False
+        for scheduler in self.shards.values():
+            scheduler.stop()
+
+
+class ShardedRaidMonitor:
+    """`RaidMonitor` per shard"""
+
+    def __init__(self, shard_count: int, cooldown: float = 120.0) -> None:
+        self.shard_count = shard_count
+        self.cooldown = cooldown
+        self.shards: defaultdict[int, RaidMonitor] = defaultdict(lambda: RaidMonitor(self.cooldown))
+
+    def shard(self, guild_id: int) -> RaidMonitor:
+        return self.shards[shard_for(guild_id, self.shard_count)]
+
+    def detector(self, guild_id: int, threshold: int, window: float) -> JoinRateDetector:
+        return self.shard(guild_id).detector(guild_id, threshold, window)
+
+    def is_active(self, guild_id: int, now: Optional[float] = None) -> bool:
+        return self.shard(guild_id).is_active(guild_id, now)
+
+    def record_join(self, guild_id: int, threshold: int, window: float, now: Optional[float] = None) -> RaidState:
+        return self.shard(guild_id).record_join(guild_id, threshold, window, now)
+
+    def end(self, guild_id: int):
+        self.shard(guild_id).end(guild_id)
+
+    def rate(self, guild_id: int) -> int:
+        return self.shard(guild_id).rate(guild_id)
+
+
+class ShardedDefender(Defender, AutoShardedClient):
+    """Defender on top of `AutoShardedClient`. `shard_ids` are the shards this process
+    runs, the rest of `shard_count` can be run by other processes on the same database"""
+
+    def __init__(
+        self,
+        prefix="?",
+        intents=Intents.all(),
+        dbname: str = "sqlite+aiosqlite:///defender.db",
+        shard_count: int = 1,
+        shard_ids: Optional[list[int]] = None,
+    ) -> None:
+        super().__init__(
+            prefix, intents, dbname, shard_count=shard_count, shard_ids=shard_ids or list(range(shard_count))
+        )
+        self.guild_cache = ShardedGuildCache(shard_count)
+        self.prune_scheduler = ShardedScheduler(self.run_due_prunes, shard_count)
+        self.raids = ShardedRaidMonitor(shard_count)
+
+    def owns(self, guild_id: int) -> bool:
+        return shard_for(guild_id, self.shard_count) in self.shard_ids
+
+    def owned(self, guild_id: ColumnElement[int], shard_id: Optional[int] = None) -> ColumnElement[bool]:
+        shards = self.shard_ids if shard_id is None else [shard_id]
+        return (guild_id.op(">>")(22) % self.shard_count).in_(shards)
+
+    async def catch_up(self, concurrency: int = 8, shard_id: Optional[int] = None) -> bool:
+        if shard_id is not None:
+            return await super().catch_up(concurrency, shard_id)
+        # on_ready only fires once every shard is up, most of them will have caught up already
+        done = await asyncio.gather(*(Defender.catch_up(self, concurrency, i) for i in self.shard_ids))
+        return any(done)
+
+    async def on_shard_ready(self, shard_id: int):
+        # Each shard sweeps its own guilds as soon as it's up instead of waiting on the rest
+        await self.catch_up(shard_id=shard_id)
+
+
+def load_config(path: str = "config.yaml") -> dict:
+    try:
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def create_bot(config: dict, prefix: str = "?") -> Defender:
+    """A plain Defender unless config.yaml sets `shardCount`"""
+    if not (shard_count := config.get("shardCount")):
+        return Defender(prefix)
+    if ids := os.environ.get(SHARD_IDS_ENV):
+        shard_ids = [int(i) for i in ids.split(",")]
+    else:
+        shard_ids = config.get("shardIds")
+    bot = ShardedDefender(prefix, shard_count=shard_count, shard_ids=shard_ids)
+    if index := os.environ.get(PROCESS_INDEX_ENV):
+        bot.process_index = int(index)
+    return bot
+
+
+def split_shards(shard_ids: list[int], processes: int) -> list[list[int]]:
+    """Deals shards out round robin so big and small guilds spread evenly"""
+    return [shard_ids[i::processes] for i in range(processes) if shard_ids[i::processes]]
+
+
+def _run_process(shard_ids: list[int], index: int):
+    os.environ[SHARD_IDS_ENV] = ",".join(map(str, shard_ids))
+    os.environ[PROCESS_INDEX_ENV] = str(index)
+    # Imported here so the bot gets built after the shard ids are set
+    import defender
+
+    defender.main()
+
+
+async def _migrate():
+    # Migrations run once up front, otherwise every process would race to run them
+    bot = Defender()
+    try:
+        await bot.init_db()
+    finally:
+        await bot.engine.dispose()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs Defender's shards across several processes")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--config", default="config.yaml")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(args.config)
+    if not (shard_count := config.get("shardCount")):
+        parser.error(f"shardCount has to be set in {args.config} to run shards in separate processes")
+    asyncio.run(_migrate())
+
+    # spawn so every process starts clean without a copy of our event loop or db connections
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=_run_process, args=(ids, i), name=f"defender-shards-{'-'.join(map(str, ids))}")
+        for i, ids in enumerate(split_shards(config.get("shardIds") or list(range(shard_count)), args.processes))
+    ]
+    for p in procs:
+        p.start()
+        _log.info("Started %s (pid %s)", p.name, p.pid)
+    for p in procs:
+        p.join()
+        if p.exitcode:
+            _log.error("%s exited with code %s", p.name, p.exitcode)
+    return max((p.exitcode or 0 for p in procs), default=0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
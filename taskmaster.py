@@ -1,73 +1,225 @@
 import asyncio
-from typing import (Any, AsyncIterator, Awaitable, Callable, Iterable,
-                    Optional, Sequence, Tuple, Type, TypeVar, cast)
+import weakref
+from collections import deque
+from typing import (Any, AsyncGenerator, AsyncIterable, AsyncIterator, Awaitable,
+                    Callable, Hashable, Iterable, Optional, TypeVar, Union)
 
 from contextlib import AbstractAsyncContextManager
 
 T = TypeVar("T")
 
-class amap(AsyncIterator[T], Awaitable[Sequence[T]]):
+_DONE = object()
+
+ERROR_POLICIES = ("raise", "return", "skip")
+"""What amap does when an item fails: re-raise it (cancelling everything else),
+yield the exception object in place of the result, or drop the item"""
+
+
+async def _aiter_sync(iterable: Iterable[Any]) -> AsyncIterator[Any]:
+    for i in iterable:
+        yield i
+
+
+class amap(AsyncIterator[T], Awaitable[list[T]]):
     """Singular map for asyncio tasks that carry an unknown amount of objects with it
-    with a set level of conccurrency so that iterables provided can be infinate."""
-    def __init__(self, func: Callable[..., Awaitable[T]],  iterables: Sequence[Iterable[Any]] , concurrency:int = 16) -> None:
-        self._func = func 
-        self._queue = asyncio.Queue()
+    with a set level of conccurrency so that iterables provided can be infinate.
+
+    Multiple iterables (sync or async) are zipped together like the builtin `map`.
+    No more than `concurrency` items are ever running or waiting to be consumed,
+    results come back in completion order unless `ordered` is set and leaving early
+    (break, aclose or `async with`) cancels whatever is still in flight.
+
+::
+
+        async for result in amap(safe_prune, members, concurrency=2):
+            ...
+        results = await amap(fetch, ids, ordered=True, errors="return")
+    """
+
+    def __init__(
+        self,
+        func: Callable[..., Awaitable[T]],
+        *iterables: Union[Iterable[Any], AsyncIterable[Any]],
+        concurrency: int = 16,
+        ordered: bool = False,
+        errors: str = "raise",
+    ) -> None:
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if errors not in ERROR_POLICIES:
+            raise ValueError(f"errors must be one of {ERROR_POLICIES}")
+
+        self._func = func
         self._concurrency = concurrency
-        self._iters = zip(iterables)
-        self._running = True
-        self._task = asyncio.ensure_future(self.__loop())
-        self.__mapped = self.__results()
-
-    async def __loop(self):
-        pending: set[asyncio.Future[T]] = set()
-
-        def on_done(fut:asyncio.Future[T]):
-            nonlocal pending
-            pending.remove(fut)
-            exception = fut.exception()
-            if not exception:
-                self._queue.put_nowait((fut.result(), None))
-            else:
-                self._queue.put_nowait((None, exception))
-
-
-        while self._running or pending:
-            while self._running and (len(pending) < self._concurrency):
-                try:
-                    item = next(self._iters)
-                except StopIteration:
-                    self._running = False
-                    break
-
-                fut = asyncio.ensure_future(self._func(*item))
-                fut.add_done_callback(on_done)
-                pending.add(fut)
-
-            await asyncio.sleep(0.005)
-    
+        self._ordered = ordered
+        self._errors = errors
+
+        if any(hasattr(i, "__aiter__") for i in iterables):
+            self._iters = None
+            self._aiters = [
+                i.__aiter__() if hasattr(i, "__aiter__") else _aiter_sync(i)
+                for i in iterables
+            ]
+        else:
+            # Fast path, no need to await anything to get the next arguments
+            self._iters = zip(*iterables)
+        self.__mapped: Optional[weakref.ref[AsyncGenerator[T, None]]] = None
+        self.__pinned: Optional[AsyncGenerator[T, None]] = None
+
+    async def __next_args(self):
+        if self._iters is not None:
+            return next(self._iters, _DONE)
+        try:
+            return [await i.__anext__() for i in self._aiters]
+        except StopAsyncIteration:
+            return _DONE
+
     async def __results(self):
-        while not self._task.done() or not self._queue.empty():
-            try:
-                item, exc = cast(Tuple[T, Optional[BaseException]], self._queue.get_nowait())
-                if exc:
+        loop = asyncio.get_running_loop()
+        # Tasks in the order they were submitted (only needed when ordered)
+        queue: deque[asyncio.Task[T]] = deque()
+        running: set[asyncio.Task[T]] = set()
+        finished: deque[asyncio.Task[T]] = deque()
+        waiter: Optional[asyncio.Future[None]] = None
+
+        def on_done(task: asyncio.Task[T]):
+            finished.append(task)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+        exhausted = False
+        try:
+            while True:
+                # Results that are done but not consumed yet still count towards
+                # the limit which is what gives us backpressure
+                while not exhausted and len(running) < self._concurrency:
+                    args = await self.__next_args()
+                    if args is _DONE:
+                        exhausted = True
+                        break
+                    task = loop.create_task(self._func(*args))
+                    running.add(task)
+                    if self._ordered:
+                        queue.append(task)
+                    else:
+                        task.add_done_callback(on_done)
+
+                if not running:
+                    return
+
+                if self._ordered:
+                    task = queue.popleft()
+                    if not task.done():
+                        await asyncio.wait((task,))
+                else:
+                    while not finished:
+                        waiter = loop.create_future()
+                        await waiter
+                    task = finished.popleft()
+                running.discard(task)
+
+                if task.cancelled():
+                    exc: Optional[BaseException] = asyncio.CancelledError()
+                else:
+                    exc = task.exception()
+
+                if exc is None:
+                    yield task.result()
+                elif self._errors == "return":
+                    yield exc
+                elif self._errors == "raise":
                     raise exc
-                yield item
-            except asyncio.QueueEmpty:
-                await asyncio.sleep(0.005)
-        
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    def __generator(self) -> AsyncGenerator[T, None]:
+        if (mapped := self.__mapped and self.__mapped()) is None:
+            mapped = self.__results()
+            # Only a weak reference, the generator's frame already points back at us and
+            # a cycle would keep it (and every task it started) alive until the next gc
+            self.__mapped = weakref.ref(mapped)
+        return mapped
+
+    def __aiter__(self) -> AsyncGenerator[T, None]:
+        # The loop owns the generator, so breaking out drops the last reference and
+        # asyncio closes it straight away, its finally cancels whatever is in flight
+        return self.__generator()
+
+    async def __anext__(self) -> T:
+        # Driving amap by hand means holding on to it, close it with aclose or async with
+        if self.__pinned is None:
+            self.__pinned = self.__generator()
+        return await self.__pinned.__anext__()
+
+    async def aclose(self):
+        """Stops mapping and cancels any tasks still in flight"""
+        if (mapped := self.__mapped and self.__mapped()) is not None:
+            await mapped.aclose()
+        self.__pinned = None
+
+    async def __aenter__(self) -> "amap[T]":
+        # Held until __aexit__ so the tasks are cancelled by the time the block exits
+        self.__pinned = self.__generator()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def __collect(self) -> list[T]:
+        async with self:
+            return [i async for i in self]
+
+    def __await__(self):
+        return self.__collect().__await__()
 
-    async def __collect(self) -> Sequence[T]:
-        return [i async for i in self.__mapped]
 
-    def __await__(self) -> Sequence[T]:
-        return self.__collect().__await__()
+class coalesce:
+    """Single-flight wrapper for a coroutine function keyed by its first argument,
+    only one call per key runs at a time and any calls made while it is running
+    collapse into one follow-up run instead of piling up.
+
+::
+
+        sweep = coalesce(bot.ban_pruned_members)
+        await sweep(guild_id)
+    """
+
+    def __init__(self, func: Callable[[Hashable], Awaitable[Any]]) -> None:
+        self._func = func
+        self._running: dict[Hashable, asyncio.Future] = {}
+        self._dirty: set[Hashable] = set()
+        self.runs = 0
+        """Number of times the wrapped function actually ran"""
+        self.coalesced = 0
+        """Number of calls that were folded into an already running call"""
+
+    def is_running(self, key: Hashable) -> bool:
+        return key in self._running
+
+    async def _drain(self, key: Hashable):
+        try:
+            while True:
+                self._dirty.discard(key)
+                self.runs += 1
+                result = await self._func(key)
+                if key not in self._dirty:
+                    # Everyone waiting gets what the last run returned
+                    return result
+        finally:
+            del self._running[key]
+
+    async def __call__(self, key: Hashable):
+        if fut := self._running.get(key):
+            self._dirty.add(key)
+            self.coalesced += 1
+        else:
+            fut = self._running[key] = asyncio.ensure_future(self._drain(key))
+        # shielded so that one impatient caller can't cancel everyone else's run
+        return await asyncio.shield(fut)
 
-    async def __aiter__(self) -> AsyncIterator[T]:
-        async for i in self.__mapped:
-            yield i 
-    
-    async def __anext__(self) -> Awaitable[T]:
-        return self.__mapped.__anext__()
 
 # Ripped from the cotextlib libarary and made async...
 class suppress(AbstractAsyncContextManager):
@@ -0,0 +1,67 @@
+import logging
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import metrics
+
+_log = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["UnitOfWork"]] = ContextVar("unit_of_work", default=None)
+
+
+def count_queries(engine: AsyncEngine):
+    """Counts every statement sent to the database against the unit of work that sent it.
+    SQLAlchemy runs the driver in the caller's context so the contextvar is still ours"""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        uow = _current.get()
+        while uow is not None:
+            uow.queries += 1
+            uow = uow.parent
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+class UnitOfWork:
+    """One session shared by every data access call in a flow (handling a join, a sweep...).
+    Writes are only flushed when the flow ends, so the whole flow commits once, and
+    SQLite's write lock isn't held while the flow waits on discord. `queries` counts
+    the statements the flow sent, nested units of work count towards their parent too"""
+
+    def __init__(self, session: AsyncSession, name: str) -> None:
+        self.session = session
+        self.name = name
+        self.queries = 0
+        self.parent: Optional[UnitOfWork] = None
+        self._after_commit: list[Callable[[], Any]] = []
+
+    async def __aenter__(self) -> "UnitOfWork":
+        self.parent = _current.get()
+        self._token = _current.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.commit()
+            else:
+                await self.session.rollback()
+        finally:
+            await self.session.close()
+            _current.reset(self._token)
+            metrics.FLOW_QUERIES.observe(self.queries, self.name)
+            _log.debug("%s took %d queries", self.name, self.queries)
+
+    def after_commit(self, callback: Callable[[], Any]):
+        """Runs `callback` once the flow's writes are in the database, dropped on rollback"""
+        self._after_commit.append(callback)
+
+    async def commit(self):
+        await self.session.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()